@@ -0,0 +1,85 @@
+"""
+recall and latency of the ivf search mode of NumpyVectorStore, measured against its exact search.
+
+the stored embeddings are clustered around random topics, like question embeddings are. every query is a perturbed
+copy of a stored embedding with a cosine similarity above the cutoff, so the report shows how many of the matches
+that the local query engine would accept (similarity >= SIMILARITY_CUTOFF) are still found by the approximate search.
+
+usage:
+    PYTHONPATH=. python app/benchmarks/ann_recall_benchmark.py --sizes 10000 100000 --n-probes 4 8 16 32
+"""
+import argparse
+import time
+import numpy as np
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from app.llama_index_server.numpy_vector_store import (
+    NumpyVectorStore,
+    normalize,
+    SEARCH_MODE_EXACT,
+    SEARCH_MODE_IVF,
+)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", help="number of stored documents", type=int, nargs="+", default=[10000, 100000])
+parser.add_argument("--dim", help="embedding dimension, 1536 for text-embedding-ada-002", type=int, default=1536)
+parser.add_argument("--n-probes", help="n_probe values to evaluate", type=int, nargs="+", default=[4, 8, 16, 32])
+parser.add_argument("--queries", help="number of queries per measurement", type=int, default=200)
+parser.add_argument("--top-k", help="similarity_top_k of each query", type=int, default=2)
+parser.add_argument("--cutoff", help="similarity cutoff of the local query engine", type=float, default=0.85)
+
+
+def clustered_embeddings(rng, size, dim, n_topics):
+    topics = normalize(rng.standard_normal((n_topics, dim), dtype=np.float32))
+    noise = normalize(rng.standard_normal((size, dim), dtype=np.float32))
+    return normalize(topics[rng.integers(n_topics, size=size)] + noise)
+
+
+def perturbed_queries(rng, embeddings, n_queries, cutoff):
+    """queries whose cosine similarity to a random stored embedding is between the cutoff and 1"""
+    originals = embeddings[rng.integers(len(embeddings), size=n_queries)]
+    noise = rng.standard_normal(originals.shape, dtype=np.float32)
+    noise = normalize(noise - np.sum(noise * originals, axis=1, keepdims=True) * originals)
+    similarity = rng.uniform(cutoff + 0.01, 0.99, size=(n_queries, 1)).astype(np.float32)
+    return similarity * originals + np.sqrt(1 - similarity ** 2) * noise
+
+
+def search(vector_store, queries, top_k):
+    start = time.perf_counter()
+    results = [vector_store.query(VectorStoreQuery(query_embedding=q, similarity_top_k=top_k)) for q in queries]
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return elapsed_ms, results
+
+
+def matches(results, cutoff):
+    return [{i for i, s in zip(r.ids, r.similarities) if s >= cutoff} for r in results]
+
+
+def run(size, args):
+    rng = np.random.default_rng(size)
+    embeddings = clustered_embeddings(rng, size, args.dim, n_topics=max(1, size // 50))
+    queries = perturbed_queries(rng, embeddings, args.queries, args.cutoff).tolist()
+    node_ids = [f"node-{i}" for i in range(size)]
+    exact_store = NumpyVectorStore(search_mode=SEARCH_MODE_EXACT)
+    exact_store.add_embeddings(node_ids, node_ids, embeddings)
+    ivf_store = NumpyVectorStore(search_mode=SEARCH_MODE_IVF)
+    start = time.perf_counter()
+    ivf_store.add_embeddings(node_ids, node_ids, embeddings)
+    print(f"{size} docs: ivf trained in {time.perf_counter() - start:.1f} s")
+    exact_ms, exact_results = search(exact_store, queries, args.top_k)
+    exact_matches = matches(exact_results, args.cutoff)
+    total_matches = sum(len(m) for m in exact_matches)
+    print(f"    exact          {exact_ms:8.2f} ms/query, {total_matches} matches >= {args.cutoff}")
+    for n_probe in args.n_probes:
+        ivf_store.n_probe = n_probe
+        ivf_ms, ivf_results = search(ivf_store, queries, args.top_k)
+        found = sum(len(e & a) for e, a in zip(exact_matches, matches(ivf_results, args.cutoff)))
+        top_1 = np.mean([e.ids[:1] == a.ids[:1] for e, a in zip(exact_results, ivf_results)])
+        print(f"    ivf n_probe={n_probe:<3} {ivf_ms:8.2f} ms/query, recall of matches >= {args.cutoff}: "
+              f"{found / max(1, total_matches):.4f}, top-1 agreement: {top_1:.4f}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"dim = {args.dim}, {args.queries} queries per measurement")
+    for size in args.sizes:
+        run(size, args)
@@ -0,0 +1,75 @@
+"""
+load test of a running server: throughput and latency of /qa/query at increasing numbers of concurrent clients.
+
+the questions are the standard questions of the knowledge base, so every request embeds a query, searches the index
+and reads mongodb, without the llm's latency or cost. with --unique a counter is appended to each question, so the
+response cache does not answer the repeated ones.
+
+to compare the async pipeline with the thread pool one at a fixed thread count, start one worker with the same
+AI_BOT_EXECUTOR_MAX_WORKERS on both versions, e.g.
+    AI_BOT_EXECUTOR_MAX_WORKERS=8 uvicorn app.main:app --workers 1
+the thread pool version levels off once all the threads wait for i/o, the async one keeps scaling with the clients.
+
+usage:
+    PYTHONPATH=. python app/benchmarks/concurrency_load_test.py --url http://127.0.0.1:8081 --concurrency 1 8 32 128
+"""
+import argparse
+import asyncio
+import os
+import time
+import httpx
+import numpy as np
+from app.utils import csv_util
+
+LLAMA_INDEX_HOME = os.path.join(os.path.dirname(os.path.dirname(__file__)), "llama_index_server")
+parser = argparse.ArgumentParser()
+parser.add_argument("--url", help="root url of the server", default="http://127.0.0.1:8081")
+parser.add_argument("--concurrency", help="numbers of concurrent clients", type=int, nargs="+",
+                    default=[1, 8, 32, 128])
+parser.add_argument("--requests", help="number of requests for each concurrency", type=int, default=500)
+parser.add_argument("--unique", help="make every question unique, so none is answered from the response cache",
+                    action="store_true")
+parser.add_argument("--knowledge-base", help="csv file of the standard questions",
+                    default=os.path.join(LLAMA_INDEX_HOME, "documents/golf-knowledge-base.csv"))
+
+
+async def run(client, questions, concurrency, requests):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            question = questions[i % len(questions)]
+            start = time.perf_counter()
+            try:
+                response = await client.post("/api/v1/qa/query", json={"question": question})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start, np.array(latencies), errors
+
+
+async def main(args):
+    questions = [answer.question for answer in csv_util.iter_standard_answers_from_csv(args.knowledge_base)]
+    print(f"{len(questions)} questions, {args.requests} requests per run, unique = {args.unique}")
+    async with httpx.AsyncClient(base_url=args.url, timeout=60,
+                                 limits=httpx.Limits(max_connections=max(args.concurrency))) as client:
+        for run_index, concurrency in enumerate(args.concurrency):
+            run_questions = [f"{q} {run_index}-{i}" for i, q in enumerate(questions)] if args.unique else questions
+            elapsed, latencies, errors = await run(client, run_questions, concurrency, args.requests)
+            if len(latencies) == 0:
+                print(f"concurrency {concurrency:>4}: all {errors} requests failed")
+                continue
+            print(f"concurrency {concurrency:>4}: {len(latencies) / elapsed:8.1f} req/s, "
+                  f"p50 {np.percentile(latencies, 50) * 1000:7.1f} ms, "
+                  f"p99 {np.percentile(latencies, 99) * 1000:7.1f} ms, errors {errors}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
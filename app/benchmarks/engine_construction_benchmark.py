@@ -0,0 +1,103 @@
+"""
+per-request construction overhead of the query engines and the chat agent, before and after they are shared.
+
+before: every /qa/query builds the local and the llm query engine, every chat message also builds an OpenAI client,
+a query engine tool and an OpenAIAgent.
+after: the query engines, the llm, the tool and the agent worker are built once, a chat message only builds an
+AgentRunner with the memory of its conversation.
+nothing is sent to openai, only the construction is measured.
+
+usage:
+    PYTHONPATH=. python app/benchmarks/engine_construction_benchmark.py --requests 1000
+"""
+import argparse
+import os
+import time
+from llama_index.core import MockEmbedding, Prompt, Settings, VectorStoreIndex
+from llama_index.core.agent import AgentRunner
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.response_synthesizers import get_response_synthesizer, ResponseMode
+from llama_index.agent.openai import OpenAIAgent, OpenAIAgentWorker
+from llama_index.llms.openai import OpenAI
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.my_query_engine_tool import MyQueryEngineTool
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--requests", help="number of simulated requests", type=int, default=1000)
+parser.add_argument("--history", help="number of chat history messages of a conversation", type=int, default=10)
+
+SYSTEM_PROMPT = "You are an expert Q&A system."
+PROMPT = "The question is: {query_str}\n"
+
+
+def build_query_engines(index):
+    local_query_engine = index.as_query_engine(
+        response_synthesizer=get_response_synthesizer(response_mode=ResponseMode.NO_TEXT),
+        node_postprocessors=[SimilarityPostprocessor(similarity_cutoff=0.85)],
+    )
+    llm_query_engine = index.as_query_engine(text_qa_template=Prompt(PROMPT))
+    return local_query_engine, llm_query_engine
+
+
+def build_tool(query_engine):
+    return MyQueryEngineTool.from_defaults(query_engine=query_engine, name="local_query_engine",
+                                          description="Queries from a knowledge base")
+
+
+def build_llm():
+    return OpenAI(temperature=0, model="gpt-3.5-turbo", max_tokens=100)
+
+
+def per_request_before(index, chat_history):
+    local_query_engine, _ = build_query_engines(index)
+    OpenAIAgent.from_tools(
+        tools=[build_tool(local_query_engine)],
+        llm=build_llm(),
+        chat_history=chat_history,
+        verbose=True,
+        system_prompt=SYSTEM_PROMPT,
+    )
+
+
+def per_request_after(agent_worker, llm, chat_history):
+    AgentRunner(
+        agent_worker,
+        memory=ChatMemoryBuffer.from_defaults(chat_history=chat_history, llm=llm),
+        llm=llm,
+        callback_manager=llm.callback_manager,
+    )
+
+
+def measure(name, n_requests, fn):
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        fn()
+    elapsed_us = (time.perf_counter() - start) * 1e6 / n_requests
+    print(f"    {name:<8} {elapsed_us:10.1f} us/request")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    Settings.embed_model = MockEmbedding(embed_dim=8)
+    index = VectorStoreIndex.from_vector_store(NumpyVectorStore())
+    chat_history = [ChatMessage(role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT, content=f"message {i}")
+                    for i in range(args.history)]
+    shared_llm = build_llm()
+    shared_local_query_engine, _ = build_query_engines(index)
+    shared_agent_worker = OpenAIAgentWorker.from_tools(
+        tools=[build_tool(shared_local_query_engine)],
+        llm=shared_llm,
+        verbose=True,
+        callback_manager=shared_llm.callback_manager,
+        prefix_messages=[ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPT)],
+    )
+    print(f"{args.requests} requests, {args.history} chat history messages")
+    print("/qa/query, query engines")
+    measure("before", args.requests, lambda: build_query_engines(index))
+    measure("after", args.requests, lambda: None)
+    print("/chat, chat engine")
+    measure("before", args.requests, lambda: per_request_before(index, chat_history))
+    measure("after", args.requests, lambda: per_request_after(shared_agent_worker, shared_llm, chat_history))
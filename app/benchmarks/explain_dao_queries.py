@@ -0,0 +1,55 @@
+"""
+checks that every query the daos run on mongodb is served by an index: each one is explained, and the check fails if
+mongodb would scan a whole collection for any of them. the daos create their indexes first, as the server does.
+
+the one-time migration of the query timestamps is not checked, it reads every document anyway.
+
+usage:
+    AI_BOT_MONGO_URI=mongodb://localhost:27017 PYTHONPATH=. python app/benchmarks/explain_dao_queries.py
+"""
+import sys
+from app.llama_index_server.document_meta_dao import (
+    DocumentMetaDao,
+    KNOWLEDGE_BASE_QUERY,
+    NOT_KNOWLEDGE_BASE_QUERY,
+)
+from app.llama_index_server.eviction_policy import EVICTION_POLICIES
+from app.llama_index_server.chat_message_dao import ChatMessageDao, CHAT_HISTORY_LIMIT, CHAT_HISTORY_SORT
+from app.utils.mongo_dao import find_collection_scans
+
+
+def index_names(plan):
+    """the indexes a query plan reads"""
+    if isinstance(plan, dict):
+        names = [plan["indexName"]] if "indexName" in plan else []
+        return names + [name for value in plan.values() for name in index_names(value)]
+    if isinstance(plan, list):
+        return [name for value in plan for name in index_names(value)]
+    return []
+
+
+def main():
+    document_meta_dao = DocumentMetaDao()
+    chat_message_dao = ChatMessageDao()
+    queries = [
+        ("doc meta by doc_id(get_doc_meta, the record_queries bulk write, delete_doc)", document_meta_dao,
+         {"doc_id": "How do I putt?"}, None, 0),
+        ("knowledge base doc ids", document_meta_dao, KNOWLEDGE_BASE_QUERY, None, 0),
+        ("cleanup for test", document_meta_dao, NOT_KNOWLEDGE_BASE_QUERY, None, 0),
+        ("chat history", chat_message_dao, {"conversation_id": "conversation"}, CHAT_HISTORY_SORT, CHAT_HISTORY_LIMIT),
+    ]
+    scans = 0
+    plans = [(name, query, dao.explain(query, sort=sort, limit=limit)) for name, dao, query, sort, limit in queries]
+    plans += [(f"eviction candidates by {policy_name}", NOT_KNOWLEDGE_BASE_QUERY,
+               document_meta_dao.explain_eviction(policy)) for policy_name, policy in EVICTION_POLICIES.items()]
+    for name, query, plan in plans:
+        if find_collection_scans(plan):
+            scans += 1
+            print(f"COLLSCAN  {name}: {query}")
+        else:
+            print(f"ok        {name}: index {', '.join(dict.fromkeys(index_names(plan)))}")
+    return 1 if scans > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
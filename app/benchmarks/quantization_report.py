@@ -0,0 +1,100 @@
+"""
+memory saved by the quantized embedding storage of NumpyVectorStore(AI_BOT_VECTOR_QUANTIZATION), and how often its
+match decisions agree with the float32 storage.
+
+the stored embeddings are the ones of the golf knowledge base snapshot if it exists(--snapshot), grown to each size
+with user-asked questions clustered around them, or random clustered embeddings otherwise. the queries are perturbed
+copies of stored embeddings whose similarity is spread around the cutoff, the hardest case for a quantized score.
+a match decision is the matched node id if its similarity >= cutoff, otherwise no match, like the local query engine.
+
+usage:
+    PYTHONPATH=. python app/benchmarks/quantization_report.py --sizes 10000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from app.llama_index_server.index_snapshot import open_snapshot
+from app.llama_index_server.numpy_vector_store import (
+    NumpyVectorStore,
+    normalize,
+    QUANTIZATION_NONE,
+    QUANTIZATION_FLOAT16,
+    QUANTIZATION_INT8,
+)
+
+DEFAULT_SNAPSHOT = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                "llama_index_server/saved_index/snapshots")
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", help="number of stored questions", type=int, nargs="+", default=[10000, 100000])
+parser.add_argument("--dim", help="embedding dimension without a snapshot", type=int, default=1536)
+parser.add_argument("--snapshot", help="snapshot root of the golf knowledge base index", default=DEFAULT_SNAPSHOT)
+parser.add_argument("--queries", help="number of queries per measurement", type=int, default=500)
+parser.add_argument("--cutoff", help="similarity cutoff of the local query engine", type=float, default=0.85)
+
+
+def base_embeddings(args):
+    snapshot = open_snapshot(args.snapshot) if os.path.exists(args.snapshot) else None
+    if snapshot is not None and snapshot.size > 0:
+        print(f"knowledge base snapshot: {snapshot.size} questions, dim = {snapshot.dim}")
+        return np.array(snapshot.matrix[:snapshot.size])
+    print(f"no knowledge base snapshot in {args.snapshot}, using random embeddings, dim = {args.dim}")
+    return normalize(np.random.default_rng(0).standard_normal((50, args.dim), dtype=np.float32))
+
+
+def grown_embeddings(rng, base, size):
+    """the base questions, and user-asked questions around them"""
+    n_new = max(0, size - len(base))
+    topics = base[rng.integers(len(base), size=n_new)]
+    noise = normalize(rng.standard_normal(topics.shape, dtype=np.float32))
+    return np.concatenate([base, normalize(topics + 1.2 * noise)])[:size]
+
+
+def queries_around_cutoff(rng, embeddings, n_queries, cutoff):
+    originals = embeddings[rng.integers(len(embeddings), size=n_queries)]
+    noise = rng.standard_normal(originals.shape, dtype=np.float32)
+    noise = normalize(noise - np.sum(noise * originals, axis=1, keepdims=True) * originals)
+    similarity = rng.uniform(cutoff - 0.05, cutoff + 0.05, size=(n_queries, 1)).astype(np.float32)
+    return similarity * originals + np.sqrt(1 - similarity ** 2) * noise
+
+
+def decisions(vector_store, queries, cutoff):
+    start = time.perf_counter()
+    results = [vector_store.query(VectorStoreQuery(query_embedding=q, similarity_top_k=1)) for q in queries]
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return elapsed_ms, [r.ids[0] if r.similarities[0] >= cutoff else None for r in results]
+
+
+def run(size, base, args):
+    rng = np.random.default_rng(size)
+    embeddings = grown_embeddings(rng, base, size)
+    queries = queries_around_cutoff(rng, embeddings, args.queries, args.cutoff).tolist()
+    node_ids = [f"node-{i}" for i in range(len(embeddings))]
+    print(f"{len(embeddings)} questions, {args.queries} queries with a similarity of {args.cutoff} +- 0.05")
+    expected = None
+    for quantization in (QUANTIZATION_NONE, QUANTIZATION_FLOAT16, QUANTIZATION_INT8):
+        with tempfile.TemporaryDirectory() as snapshot_root:
+            vector_store = NumpyVectorStore(quantization=quantization)
+            vector_store.add_embeddings(node_ids, node_ids, embeddings)
+            # as in the server: the float32 rows are mapped from the snapshot once it is written
+            vector_store.save_snapshot(snapshot_root)
+            memory = vector_store.memory_bytes()
+            elapsed_ms, result = decisions(vector_store, queries, args.cutoff)
+            if expected is None:
+                expected = result
+            line = f"    {quantization:<8} {memory / 2 ** 20:8.1f} MiB in memory, {elapsed_ms:6.2f} ms/query, " \
+                   f"agreement {np.mean([e == r for e, r in zip(expected, result)]):.4f}"
+            if quantization != QUANTIZATION_NONE:
+                vector_store.rescore = False
+                _, result = decisions(vector_store, queries, args.cutoff)
+                line += f", without re-scoring {np.mean([e == r for e, r in zip(expected, result)]):.4f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    base = base_embeddings(args)
+    for size in args.sizes:
+        run(size, base, args)
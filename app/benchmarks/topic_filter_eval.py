@@ -0,0 +1,61 @@
+"""
+offline evaluation of the topic filter(AI_BOT_TOPIC_RELEVANCE_THRESHOLD) on labelled questions.
+
+the knowledge base questions and the labelled questions(a csv file with the columns `question` and `relevant`) are
+embedded with openai's embedding model, through the same on-disk embedding cache as the server, so only the first run
+calls the api. for each threshold it reports the precision and recall of the off-topic rejections, and the share of
+the on-topic questions which still reach the llm. it also suggests the highest threshold which keeps that share above
+--relevant-pass-rate.
+
+usage:
+    PYTHONPATH=. python app/benchmarks/topic_filter_eval.py --thresholds 0.72 0.75 0.78 0.8
+"""
+import argparse
+import csv
+import os
+import numpy as np
+from llama_index.embeddings.openai import OpenAIEmbedding
+from app.utils import csv_util
+from app.llama_index_server.cached_embedding import CachedEmbedding
+from app.llama_index_server.topic_filter import TopicFilter, evaluate, calibrate
+
+LLAMA_INDEX_HOME = os.path.join(os.path.dirname(os.path.dirname(__file__)), "llama_index_server")
+parser = argparse.ArgumentParser()
+parser.add_argument("--knowledge-base", help="csv file of the standard questions",
+                    default=os.path.join(LLAMA_INDEX_HOME, "documents/golf-knowledge-base.csv"))
+parser.add_argument("--samples", help="csv file of labelled questions",
+                    default=os.path.join(LLAMA_INDEX_HOME, "documents/topic-relevance-samples.csv"))
+parser.add_argument("--thresholds", help="thresholds to evaluate", type=float, nargs="+",
+                    default=[0.7, 0.72, 0.74, 0.75, 0.76, 0.78, 0.8, 0.82])
+parser.add_argument("--k", help="number of nearest knowledge base questions to average", type=int, default=1)
+parser.add_argument("--relevant-pass-rate", help="share of on-topic questions the suggested threshold lets through",
+                    type=float, default=0.99)
+parser.add_argument("--cache", help="sqlite file of the embedding cache",
+                    default=os.path.join(LLAMA_INDEX_HOME, "llama_index_cache/embeddings.sqlite"))
+
+
+def load_samples(path):
+    with open(path, "r") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    return [row["question"] for row in rows], np.array([row["relevant"].lower() == "true" for row in rows])
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    embed_model = CachedEmbedding(OpenAIEmbedding(), disk_path=args.cache)
+    standard_questions = [answer.question for answer in csv_util.iter_standard_answers_from_csv(args.knowledge_base)]
+    questions, relevant = load_samples(args.samples)
+    topic_filter = TopicFilter(np.array(embed_model.get_text_embedding_batch(standard_questions)), threshold=0,
+                               k=args.k)
+    scores = topic_filter.scores(np.array([embed_model.get_query_embedding(q) for q in questions]))
+    print(f"{len(standard_questions)} knowledge base questions, {int(relevant.sum())} on-topic and "
+          f"{int((~relevant).sum())} off-topic samples, k = {args.k}")
+    print(f"on-topic scores:  min {scores[relevant].min():.4f}, mean {scores[relevant].mean():.4f}")
+    print(f"off-topic scores: max {scores[~relevant].max():.4f}, mean {scores[~relevant].mean():.4f}")
+    for result in evaluate(scores, relevant, args.thresholds):
+        print(f"    threshold {result['threshold']:.3f}: precision {result['precision']:.3f}, "
+              f"recall {result['recall']:.3f}, on-topic passed {result['relevant_pass_rate']:.3f}")
+    print(f"suggested AI_BOT_TOPIC_RELEVANCE_THRESHOLD: "
+          f"{calibrate(scores, relevant, args.relevant_pass_rate):.3f}")
+    for question, score, label in sorted(zip(questions, scores, relevant), key=lambda x: x[1]):
+        print(f"    {score:.4f} {'on ' if label else 'off'} {question}")
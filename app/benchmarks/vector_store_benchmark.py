@@ -0,0 +1,63 @@
+"""
+compare the query latency of llama index's SimpleVectorStore with NumpyVectorStore.
+
+usage:
+    PYTHONPATH=. python app/benchmarks/vector_store_benchmark.py --sizes 1000 10000 100000 --dim 1536
+"""
+import argparse
+import time
+import numpy as np
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", help="number of stored documents", type=int, nargs="+", default=[1000, 10000, 100000])
+parser.add_argument("--dim", help="embedding dimension, 1536 for text-embedding-ada-002", type=int, default=1536)
+parser.add_argument("--queries", help="number of queries per measurement", type=int, default=20)
+parser.add_argument("--top-k", help="similarity_top_k of each query", type=int, default=2)
+
+
+def build_nodes(embeddings):
+    return [
+        TextNode(
+            id_=f"node-{i}",
+            text=f"question {i}",
+            embedding=embedding,
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"question {i}")},
+        )
+        for i, embedding in enumerate(embeddings.tolist())
+    ]
+
+
+def measure(vector_store, query_embeddings, top_k):
+    start = time.perf_counter()
+    results = [
+        vector_store.query(VectorStoreQuery(query_embedding=q, similarity_top_k=top_k))
+        for q in query_embeddings
+    ]
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(query_embeddings)
+    return elapsed_ms, results
+
+
+def run(size, dim, queries, top_k):
+    rng = np.random.default_rng(size)
+    embeddings = rng.standard_normal((size, dim), dtype=np.float32)
+    query_embeddings = rng.standard_normal((queries, dim), dtype=np.float32).tolist()
+    nodes = build_nodes(embeddings)
+    simple_store, numpy_store = SimpleVectorStore(), NumpyVectorStore()
+    simple_store.add(nodes)
+    numpy_store.add(nodes)
+    simple_ms, simple_results = measure(simple_store, query_embeddings, top_k)
+    numpy_ms, numpy_results = measure(numpy_store, query_embeddings, top_k)
+    same_ids = all(s.ids == n.ids for s, n in zip(simple_results, numpy_results))
+    print(f"{size:>8} docs | SimpleVectorStore {simple_ms:10.2f} ms/query | NumpyVectorStore {numpy_ms:8.2f} ms/query"
+          f" | speedup {simple_ms / numpy_ms:8.1f}x | same top-{top_k}: {same_ids}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"dim = {args.dim}, {args.queries} queries per measurement")
+    for size in args.sizes:
+        run(size, args.dim, args.queries, args.top_k)
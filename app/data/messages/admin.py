@@ -0,0 +1,7 @@
+from pydantic import Field
+from typing import Optional
+from app.data.messages.response import BaseResponseModel
+
+
+class StatsResponse(BaseResponseModel):
+    data: Optional[dict] = Field(None, description="runtime statistics of the server components")
@@ -1,9 +1,14 @@
+from datetime import datetime, timezone
 from pydantic import Field, BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, IndexModel
 from llama_index.core.llms import ChatMessage, MessageRole
-from app.utils import data_util
+from app.utils import data_util, data_consts
 from app.data.models.qa import Source
 
+# a document keeps one query counter per day for this many days
+QUERY_STATS_DAYS = 7
+
 
 class CollectionModel(BaseModel):
     """
@@ -18,6 +23,16 @@ class CollectionModel(BaseModel):
     def collection_name():
         return None
 
+    @staticmethod
+    def indexes() -> List[IndexModel]:
+        """the indexes of the collection, created by the dao if they do not exist"""
+        return []
+
+
+class QueryBucket(BaseModel):
+    day: int = Field(..., description="The day of the queries, in days since the epoch(utc)")
+    count: int = Field(0, description="How many times the document was queried on that day")
+
 
 class LlamaIndexDocumentMeta(CollectionModel):
     """
@@ -26,10 +41,6 @@ class LlamaIndexDocumentMeta(CollectionModel):
     In llama index, a `Document` is a container around any data source.
     reference: https://docs.llamaindex.ai/en/stable/getting_started/concepts.html
     """
-    """
-    Indexes:
-        doc_id(primary)
-    """
     doc_id: str = Field(..., description="Global unique id of the document")
     question: str = Field(..., description="the original question")
     matched_question: Optional[str] = Field(None, description="matched question, if any")
@@ -37,12 +48,22 @@ class LlamaIndexDocumentMeta(CollectionModel):
     source: Source = Field(..., description="Source of the answer")
     answer: str = Field(..., description="answer to the question")
     insert_timestamp: int = Field(..., description="The timestamp when the document is inserted, in milliseconds")
-    query_timestamps: List[int] = Field([], description="The timestamps when the document is queried")
+    last_query_timestamp: Optional[int] = Field(None, description="The timestamp when the document is last queried")
+    query_buckets: Dict[str, QueryBucket] = Field(
+        {}, description=f"Query counts of the last {QUERY_STATS_DAYS} days, keyed by day modulo {QUERY_STATS_DAYS}")
 
     @staticmethod
     def collection_name():
         return "llama_index_document_meta"
 
+    @staticmethod
+    def indexes() -> List[IndexModel]:
+        return [
+            IndexModel([("doc_id", ASCENDING)], name="doc_id", unique=True),
+            # the knowledge base doc ids, and the eviction candidates by source and age
+            IndexModel([("source", ASCENDING), ("insert_timestamp", ASCENDING)], name="source_insert_timestamp"),
+        ]
+
     @staticmethod
     def from_answer(answer):
         doc_meta = LlamaIndexDocumentMeta(
@@ -53,7 +74,6 @@ class LlamaIndexDocumentMeta(CollectionModel):
             category=answer.category,
             answer=answer.answer,
             insert_timestamp=data_util.get_current_milliseconds(),
-            query_timestamps=[],
         )
         return doc_meta
 
@@ -62,6 +82,11 @@ class LlamaIndexDocumentMeta(CollectionModel):
             data["doc_id"] = data_util.get_doc_id(data["question"])
         super().__init__(**data)
 
+    def query_count(self, days=QUERY_STATS_DAYS):
+        """how many times the document was queried in the last `days` days, today included"""
+        today = data_util.milliseconds_to_day(data_util.get_current_milliseconds())
+        return sum(bucket.count for bucket in self.query_buckets.values() if bucket.day > today - days)
+
 
 class LlamaIndexDocumentMetaReadable(LlamaIndexDocumentMeta):
     insert_time: str = Field(..., description="The time when the document is inserted, in human readable format")
@@ -71,11 +96,9 @@ class LlamaIndexDocumentMetaReadable(LlamaIndexDocumentMeta):
     def __init__(self, **data):
         data["insert_time"] = data_util.milliseconds_to_human_readable(data["insert_timestamp"])
         super().__init__(**data)
-        if len(self.query_timestamps) > 0:
-            self.query_timestamps.sort()
-            self.last_query_time = data_util.milliseconds_to_human_readable(self.query_timestamps[-1])
-        self.query_count_7_days = len([t for t in self.query_timestamps if
-                                       t > data_util.get_current_milliseconds() - 7 * data_util.MILLISECONDS_PER_DAY])
+        if self.last_query_timestamp is not None:
+            self.last_query_time = data_util.milliseconds_to_human_readable(self.last_query_timestamp)
+        self.query_count_7_days = self.query_count(7)
 
 
 class Message(CollectionModel):
@@ -84,11 +107,24 @@ class Message(CollectionModel):
     content: str = Field(..., description="Content of the chat message")
     timestamp: int = Field(..., description="Time when this chat message was sent, in milliseconds")
     time: Optional[str] = Field(None, description="Time when this chat message was sent, in human readable format")
+    created_at: Optional[datetime] = Field(None, description="Time when this chat message was sent, as a date")
 
     @staticmethod
     def collection_name():
         return "chat_message"
 
+    @staticmethod
+    def indexes() -> List[IndexModel]:
+        indexes = [
+            # the last messages of a conversation
+            IndexModel([("conversation_id", ASCENDING), ("timestamp", DESCENDING)], name="conversation_history"),
+        ]
+        if data_consts.CHAT_MESSAGE_TTL_DAYS > 0:
+            # mongodb only expires documents by a date field
+            indexes.append(IndexModel([("created_at", ASCENDING)], name="created_at_ttl",
+                                      expireAfterSeconds=int(data_consts.CHAT_MESSAGE_TTL_DAYS * 24 * 60 * 60)))
+        return indexes
+
     @staticmethod
     def from_chat_message(conversation_id: str, chat_message: ChatMessage):
         return Message(
@@ -96,6 +132,7 @@ class Message(CollectionModel):
             role=chat_message.role,
             content=chat_message.content,
             timestamp=data_util.get_current_milliseconds(),
+            created_at=datetime.now(timezone.utc),
         )
 
     def __init__(self, **data):
@@ -24,6 +24,8 @@ class Source(str, Enum):
     CHATGPT35 = "gpt-3.5-turbo"
     CHATGPT4 = "gpt-4"
     CLAUDE_2 = "claude-2"
+    # refused by the topic filter, without asking the llm
+    TOPIC_FILTER = "topic-filter"
 
 
 class Answer(BaseModel):
@@ -49,6 +51,8 @@ class Answer(BaseModel):
             doc_id=data_util.get_doc_id(self.question),
             text=self.question,
             excluded_llm_metadata_keys=["category", "source", "answer"],
+            # only the question is embedded, so the embedding of a query can be stored as is
+            excluded_embed_metadata_keys=["category", "source", "answer"],
             metadata={
                 "category": self.category,
                 "source": self.source.value,
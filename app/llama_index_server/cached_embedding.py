@@ -0,0 +1,209 @@
+import asyncio
+import os
+import sqlite3
+from collections import OrderedDict
+from threading import Lock, local
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from app.utils.log_util import logger
+
+KIND_QUERY = "query"
+KIND_TEXT = "text"
+
+
+def normalize_text(text: str) -> str:
+    """the questions `How do I putt?` and ` how do I  putt?` share one cache entry"""
+    return " ".join(text.split()).lower()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    embedding model in front of another one, which only calls the wrapped model for texts it has not embedded before.
+
+    the cache is keyed on the wrapped model's name, the kind(query or text, since a model may embed them differently)
+    and the normalized text. it has a bounded in-memory lru tier and an optional sqlite tier that survives restarts,
+    an entry found on disk is promoted to memory. every thread has its own sqlite connection, and the disk is read
+    and written outside the lock of the memory tier. a failed disk read is a miss, the wrapped model is called.
+    """
+
+    embed_model: BaseEmbedding = Field(description="the wrapped embedding model")
+    max_size: int = Field(default=10000, description="max number of embeddings kept in memory")
+    _lock: Lock = PrivateAttr()
+    _memory: "OrderedDict[Tuple[str, str], Embedding]" = PrivateAttr()
+    _disk_path: Optional[str] = PrivateAttr()
+    _connections: local = PrivateAttr()
+    _hits: int = PrivateAttr()
+    _disk_hits: int = PrivateAttr()
+    _misses: int = PrivateAttr()
+    _disk_errors: int = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, max_size: int = 10000, disk_path: Optional[str] = None,
+                 **kwargs: Any):
+        super().__init__(
+            embed_model=embed_model,
+            max_size=max_size,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._lock = Lock()
+        self._memory = OrderedDict()
+        self._disk_path = disk_path or None
+        self._connections = local()
+        if self._disk_path is not None:
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            disk = self._disk()
+            # readers do not wait for a writer
+            disk.execute("PRAGMA journal_mode=WAL")
+            disk.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, kind TEXT, text TEXT, vector BLOB, "
+                "PRIMARY KEY (model, kind, text))"
+            )
+            disk.commit()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._disk_errors = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "size": len(self._memory),
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "disk_errors": self._disk_errors,
+                "hit_rate": (self._hits + self._disk_hits) / lookups if lookups > 0 else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._disk_path is not None:
+            disk = self._disk()
+            disk.execute("DELETE FROM embeddings WHERE model = ?", (self.model_name,))
+            disk.commit()
+
+    def _disk(self) -> sqlite3.Connection:
+        """the sqlite connection of the current thread"""
+        disk = getattr(self._connections, "disk", None)
+        if disk is None:
+            disk = sqlite3.connect(self._disk_path, timeout=1)
+            self._connections.disk = disk
+        return disk
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._get_cached([query], KIND_QUERY, lambda texts: [self.embed_model.get_query_embedding(texts[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        embedding = await self._alookup(query, KIND_QUERY)
+        if embedding is None:
+            embedding = await self.embed_model.aget_query_embedding(query)
+            await self._astore([query], KIND_QUERY, [embedding])
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._get_cached(texts, KIND_TEXT, self.embed_model.get_text_embedding_batch)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        embeddings = [await self._alookup(text, KIND_TEXT) for text in texts]
+        misses = [text for text, embedding in zip(texts, embeddings) if embedding is None]
+        if len(misses) > 0:
+            computed = await self.embed_model.aget_text_embedding_batch(misses)
+            await self._astore(misses, KIND_TEXT, computed)
+            computed = iter(computed)
+            embeddings = [embedding if embedding is not None else next(computed) for embedding in embeddings]
+        return embeddings
+
+    def _get_cached(self, texts: List[str], kind: str, embed) -> List[Embedding]:
+        embeddings = [self._lookup(text, kind) for text in texts]
+        misses = [text for text, embedding in zip(texts, embeddings) if embedding is None]
+        if len(misses) > 0:
+            computed = embed(misses)
+            self._store(misses, kind, computed)
+            computed = iter(computed)
+            embeddings = [embedding if embedding is not None else next(computed) for embedding in embeddings]
+        return embeddings
+
+    def _lookup(self, text: str, kind: str) -> Optional[Embedding]:
+        key = (kind, normalize_text(text))
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                return embedding
+        if self._disk_path is not None:
+            embedding = self._read_disk(key)
+            if embedding is not None:
+                with self._lock:
+                    self._put(key, embedding)
+                    self._disk_hits += 1
+                return embedding
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def _read_disk(self, key: Tuple[str, str]) -> Optional[Embedding]:
+        try:
+            row = self._disk().execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND kind = ? AND text = ?",
+                (self.model_name, key[0], key[1]),
+            ).fetchone()
+        except sqlite3.Error as e:
+            # e.g. the file is locked or corrupted, the embedding is computed instead
+            logger.warning(f"Failed to read an embedding from the disk cache: {e}")
+            with self._lock:
+                self._disk_errors += 1
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist() if row is not None else None
+
+    async def _alookup(self, text: str, kind: str) -> Optional[Embedding]:
+        # only the sqlite tier does i/o, the memory tier is read in the event loop
+        if self._disk_path is None:
+            return self._lookup(text, kind)
+        return await asyncio.to_thread(self._lookup, text, kind)
+
+    async def _astore(self, texts: List[str], kind: str, embeddings: List[Embedding]):
+        if self._disk_path is None:
+            self._store(texts, kind, embeddings)
+        else:
+            await asyncio.to_thread(self._store, texts, kind, embeddings)
+
+    def _store(self, texts: List[str], kind: str, embeddings: List[Embedding]):
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                self._put((kind, normalize_text(text)), embedding)
+        if self._disk_path is not None:
+            try:
+                disk = self._disk()
+                disk.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                    [(self.model_name, kind, normalize_text(text), np.asarray(embedding, dtype=np.float32).tobytes())
+                     for text, embedding in zip(texts, embeddings)],
+                )
+                disk.commit()
+            except sqlite3.Error as e:
+                # the disk tier is best effort, the embeddings are still cached in memory
+                logger.warning(f"Failed to write embeddings to the disk cache: {e}")
+                with self._lock:
+                    self._disk_errors += 1
+
+    def _put(self, key: Tuple[str, str], embedding: Embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
@@ -0,0 +1,53 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional, Sequence, Set
+from llama_index.core.llms import ChatMessage, ChatResponseAsyncGen
+from llama_index.llms.openai import OpenAI
+
+# the tasks which stream a completion for the current request, see track_generations
+_generation_tasks: ContextVar[Optional[Set[asyncio.Task]]] = ContextVar("generation_tasks", default=None)
+
+
+@contextmanager
+def track_generations() -> Iterator[Set[asyncio.Task]]:
+    """
+    collect the tasks which stream the completions started in this block, so they can be cancelled.
+    an agent consumes the stream of the final answer in a task of its own, which cancelling the request does not reach
+    """
+    tasks = set()
+    token = _generation_tasks.set(tasks)
+    try:
+        yield tasks
+    finally:
+        _generation_tasks.reset(token)
+
+
+def cancel_generations(tasks: Set[asyncio.Task]):
+    current = asyncio.current_task()
+    for task in tasks:
+        if task is not current:
+            # closes the http stream, so openai stops generating. a finished task is not affected
+            task.cancel()
+
+
+class CancellableOpenAI(OpenAI):
+    """openai llm whose streamed chat completions are registered in the block of track_generations which started them"""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CancellableOpenAI"
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        stream = await super().astream_chat(messages, **kwargs)
+        tasks = _generation_tasks.get()
+        if tasks is None:
+            return stream
+
+        async def registered_stream() -> ChatResponseAsyncGen:
+            # the consuming task copied the context of the request, so it finds the same set
+            tasks.add(asyncio.current_task())
+            async for chunk in stream:
+                yield chunk
+
+        return registered_stream()
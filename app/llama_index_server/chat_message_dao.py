@@ -2,11 +2,23 @@ from typing import List
 import pymongo
 from llama_index.core.llms import ChatMessage
 from app.utils.mongo_dao import MongoDao
+from app.utils.async_mongo_dao import AsyncMongoDao
 from app.utils import data_consts
 from app.data.models.mongodb import Message
 from app.utils.log_util import logger
 
 CHAT_HISTORY_LIMIT = 20
+CHAT_HISTORY_SORT = [("timestamp", pymongo.DESCENDING)]
+
+
+def to_chat_history(messages) -> List[Message]:
+    """the last messages in time order, from the documents sorted by CHAT_HISTORY_SORT"""
+    if messages is None:
+        return []
+    messages = [Message(**m) for m in messages]
+    messages.sort(key=lambda m: m.timestamp)
+    logger.info(f"Found message history size: {len(messages)}")
+    return messages
 
 
 class ChatMessageDao(MongoDao):
@@ -14,24 +26,42 @@ class ChatMessageDao(MongoDao):
                  mongo_uri=data_consts.MONGO_URI,
                  db_name=Message.db_name(),
                  collection_name=Message.collection_name(),
+                 indexes=Message.indexes(),
                  ):
-        super().__init__(mongo_uri, db_name, collection_name)
+        super().__init__(mongo_uri, db_name, collection_name, indexes=indexes)
 
     def get_chat_history(self, conversation_id: str) -> List[Message]:
         messages = self.find(
             query={"conversation_id": conversation_id, },
             limit=CHAT_HISTORY_LIMIT,
-            sort=[("timestamp", pymongo.DESCENDING)],
+            sort=CHAT_HISTORY_SORT,
         )
-        if messages is None:
-            return []
-        else:
-            messages = list(messages)
-            messages = [Message(**m) for m in messages]
-            messages.sort(key=lambda m: m.timestamp)
-            logger.info(f"Found message history size: {len(messages)}")
-            return messages
+        return to_chat_history(messages)
 
     def save_chat_history(self, conversation_id: str, chat_message: ChatMessage):
         message = Message.from_chat_message(conversation_id, chat_message)
         self.insert_one(message)
+
+
+class AsyncChatMessageDao(AsyncMongoDao):
+    """ChatMessageDao for the event loop"""
+
+    def __init__(self,
+                 mongo_uri=data_consts.MONGO_URI,
+                 db_name=Message.db_name(),
+                 collection_name=Message.collection_name(),
+                 indexes=Message.indexes(),
+                 ):
+        super().__init__(mongo_uri, db_name, collection_name, indexes=indexes)
+
+    async def get_chat_history(self, conversation_id: str) -> List[Message]:
+        messages = await self.find(
+            query={"conversation_id": conversation_id, },
+            limit=CHAT_HISTORY_LIMIT,
+            sort=CHAT_HISTORY_SORT,
+        )
+        return to_chat_history(messages)
+
+    async def save_chat_history(self, conversation_id: str, chat_message: ChatMessage):
+        message = Message.from_chat_message(conversation_id, chat_message)
+        await self.insert_one(message)
@@ -0,0 +1,152 @@
+import asyncio
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from app.utils.log_util import logger
+from app.utils.metrics_util import Histogram, MILLISECONDS_BUCKETS, SIZE_BUCKETS
+
+_CLOSED = None
+
+
+class EmbeddingCoalescer:
+    """
+    gathers the texts submitted by concurrent callers within `window_ms` of the first one, or until `max_batch_size`
+    texts are waiting, and embeds them with one call of `embed_batch`. each caller gets a future of its own vector.
+    a collector thread forms the batches, up to `max_concurrent_batches` of them are embedded at the same time.
+    the futures cancelled before their batch is dispatched are left out of it, embed() waits at most `timeout` seconds.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[Embedding]], window_ms: float = 5,
+                 max_batch_size: int = 64, max_concurrent_batches: int = 4, timeout: Optional[float] = 60):
+        self._embed_batch = embed_batch
+        self._timeout = timeout
+        self._window = window_ms / 1000
+        self._max_batch_size = max(1, max_batch_size)
+        self._queue: "queue.Queue[Optional[Tuple[str, Future, float]]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches)
+        self._batch_sizes = Histogram(SIZE_BUCKETS)
+        self._queue_waits = Histogram(MILLISECONDS_BUCKETS)
+        self._thread = Thread(target=self._collect, name="embedding-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> Embedding:
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            # not embedded if its batch was not dispatched yet
+            future.cancel()
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self._batch_sizes.to_dict(),
+            "queue_wait_ms": self._queue_waits.to_dict(),
+        }
+
+    def close(self):
+        self._queue.put(_CLOSED)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _collect(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSED:
+                return
+            batch = [item]
+            deadline = item[2] + self._window
+            closed = False
+            while len(batch) < self._max_batch_size:
+                try:
+                    timeout = deadline - time.perf_counter()
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _CLOSED:
+                    closed = True
+                    break
+                batch.append(item)
+            self._executor.submit(self._dispatch, batch)
+            if closed:
+                return
+
+    def _dispatch(self, batch: List[Tuple[str, Future, float]]):
+        now = time.perf_counter()
+        for _, _, submitted in batch:
+            self._queue_waits.observe((now - submitted) * 1000)
+        # e.g. the request timed out or its client disconnected. the others can no longer be cancelled
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if len(batch) == 0:
+            return
+        # the same question asked by several users at once is embedded once
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self._batch_sizes.observe(len(texts))
+        try:
+            embeddings = dict(zip(texts, self._embed_batch(texts)))
+        except Exception as e:
+            logger.warning(f"Failed to embed a batch of {len(texts)} texts: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            future.set_result(embeddings[text])
+
+
+class CoalescingEmbedding(BaseEmbedding):
+    """
+    embedding model in front of another one, which embeds the queries of concurrent requests in batches.
+    the queries are embedded with the wrapped model's text batch api, so it must embed a query like a text, which
+    openai's embedding models do. texts are already embedded in batches, they are passed through.
+    """
+
+    embed_model: BaseEmbedding = Field(description="the wrapped embedding model")
+    _coalescer: EmbeddingCoalescer = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, window_ms: float = 5, max_batch_size: int = 64,
+                 timeout: Optional[float] = 60, **kwargs: Any):
+        super().__init__(
+            embed_model=embed_model,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._coalescer = EmbeddingCoalescer(embed_model.get_text_embedding_batch, window_ms=window_ms,
+                                             max_batch_size=max_batch_size, timeout=timeout)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CoalescingEmbedding"
+
+    def stats(self) -> Dict[str, Any]:
+        return self._coalescer.stats()
+
+    def close(self):
+        self._coalescer.close()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._coalescer.embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.wrap_future(self._coalescer.submit(query))
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self.embed_model.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self.embed_model.aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self.embed_model.get_text_embedding_batch(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self.embed_model.aget_text_embedding_batch(texts)
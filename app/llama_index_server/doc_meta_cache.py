@@ -0,0 +1,183 @@
+import asyncio
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from pymongo.errors import PyMongoError
+from app.data.models.mongodb import LlamaIndexDocumentMeta
+from app.llama_index_server.response_cache import ResponseCache
+from app.utils.async_mongo_dao import AsyncMongoDao
+from app.utils.log_util import logger
+from app.utils.metrics_util import Histogram, SECONDS_BUCKETS
+
+# the change stream is reopened this many seconds after it failed
+CHANGE_STREAM_RETRY_SECONDS = 5
+# the fields updated by every query hit, the cached metas may be stale in them for up to the ttl
+QUERY_STATS_FIELDS = ("query_buckets", "last_query_timestamp")
+
+
+class DocMetaCache:
+    """
+    read-through cache of the document metas, keyed on doc_id: at most `max_size` of them, each for `ttl_seconds`
+    after it was read from mongodb. the writes of this process invalidate their documents, follow_changes() the
+    writes of everyone else, and the ttl bounds the staleness if neither does.
+    a meta read from mongodb before an invalidation is not cached after it, so an invalidation is never undone.
+    the changes reported by the change stream also invalidate the `response_cache`, whose bodies hold the answers.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, response_cache: Optional[ResponseCache] = None):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._response_cache = response_cache
+        self._lock = Lock()
+        # doc_id -> (meta, monotonic time when it was read)
+        self._entries: "OrderedDict[str, Tuple[LlamaIndexDocumentMeta, float]]" = OrderedDict()
+        # mongodb _id -> doc_id of the cached metas, the change events only have the _id
+        self._doc_ids: Dict[Any, str] = {}
+        self._object_ids: Dict[str, Any] = {}
+        # incremented by every invalidation
+        self._epoch = 0
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._ages = Histogram(SECONDS_BUCKETS)
+        self._change_events = 0
+        self._change_lags = Histogram(SECONDS_BUCKETS)
+        self._following = False
+
+    async def get(self, doc_id: str, load: Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+                  ) -> Optional[LlamaIndexDocumentMeta]:
+        """
+        the meta of the document, if it is not cached `load` reads its mongodb document.
+        callers get a copy they may change
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None and now - entry[1] > self._ttl:
+                self._remove(doc_id)
+                self._expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(doc_id)
+                self._hits += 1
+            else:
+                self._misses += 1
+            epoch = self._epoch
+        if entry is not None:
+            self._ages.observe(now - entry[1])
+            return entry[0].model_copy()
+        document = await load(doc_id)
+        if document is None:
+            return None
+        doc_meta = LlamaIndexDocumentMeta(**document)
+        if self._max_size > 0:
+            with self._lock:
+                if self._epoch == epoch:
+                    self._remove(doc_id)
+                    self._entries[doc_id] = (doc_meta.model_copy(), now)
+                    self._doc_ids[document.get("_id")] = doc_id
+                    self._object_ids[doc_id] = document.get("_id")
+                    while len(self._entries) > self._max_size:
+                        self._remove(next(iter(self._entries)))
+        return doc_meta
+
+    def invalidate(self, doc_id: str):
+        with self._lock:
+            self._epoch += 1
+            if self._remove(doc_id):
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._doc_ids.clear()
+            self._object_ids.clear()
+
+    async def follow_changes(self, dao: AsyncMongoDao):
+        """
+        invalidate the documents changed by anyone, e.g. an answer edited in mongodb directly, as the change stream of
+        the collection reports them. change streams need a replica set. runs until cancelled
+        """
+        while True:
+            try:
+                async with dao.watch() as stream:
+                    self._following = True
+                    logger.info("Following the changes of the document metas")
+                    async for change in stream:
+                        self._on_change(change)
+            except PyMongoError as e:
+                logger.warning(f"Change stream of the document metas failed, retrying: {e}")
+            finally:
+                self._following = False
+            # the changes made meanwhile are not reported
+            self._forget_all()
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            stats = {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "ttl_seconds": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+                "hit_rate": self._hits / lookups if lookups > 0 else 0.0,
+                "following_changes": self._following,
+                "change_events": self._change_events,
+            }
+        stats["age_at_hit_seconds"] = self._ages.to_dict()
+        stats["change_lag_seconds"] = self._change_lags.to_dict()
+        return stats
+
+    def _on_change(self, change: Dict[str, Any]):
+        with self._lock:
+            self._change_events += 1
+        if "clusterTime" in change:
+            self._change_lags.observe(max(0, time.time() - change["clusterTime"].time))
+        operation = change["operationType"]
+        if operation == "update" and self._only_query_stats(change["updateDescription"]):
+            return
+        if operation == "insert" and "doc_id" in change["fullDocument"]:
+            self._forget(change["fullDocument"]["doc_id"])
+        elif operation in ("update", "replace", "delete"):
+            # the _ids of the cached metas are known
+            with self._lock:
+                doc_id = self._doc_ids.get(change["documentKey"]["_id"])
+            if doc_id is not None:
+                self._forget(doc_id)
+            elif self._response_cache is not None:
+                # a response may outlive the meta it was built from, which document it was is unknown
+                self._response_cache.clear()
+            if operation == "replace" and "doc_id" in change["fullDocument"]:
+                self._forget(change["fullDocument"]["doc_id"])
+        else:
+            # drop, rename or invalidate of the collection
+            self._forget_all()
+
+    def _forget(self, doc_id: str):
+        self.invalidate(doc_id)
+        if self._response_cache is not None:
+            self._response_cache.invalidate(doc_id)
+
+    def _forget_all(self):
+        self.clear()
+        if self._response_cache is not None:
+            self._response_cache.clear()
+
+    def _remove(self, doc_id: str) -> bool:
+        if self._entries.pop(doc_id, None) is None:
+            return False
+        self._doc_ids.pop(self._object_ids.pop(doc_id), None)
+        return True
+
+    @staticmethod
+    def _only_query_stats(update_description: Dict[str, Any]) -> bool:
+        fields = list(update_description.get("updatedFields", {})) + update_description.get("removedFields", [])
+        return all(field.split(".")[0] in QUERY_STATS_FIELDS for field in fields)
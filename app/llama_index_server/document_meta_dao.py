@@ -1,9 +1,55 @@
+from typing import Dict, List, Tuple
+from pymongo.operations import UpdateOne
 from app.utils.mongo_dao import MongoDao
+from app.utils.async_mongo_dao import AsyncMongoDao
 from app.utils.log_util import logger
-from app.utils.data_util import get_current_milliseconds, MILLISECONDS_PER_DAY
+from app.utils.data_util import get_current_milliseconds, milliseconds_to_day, MILLISECONDS_PER_DAY
 from app.utils import data_consts
-from app.data.models.mongodb import LlamaIndexDocumentMeta
+from app.data.models.mongodb import LlamaIndexDocumentMeta, QUERY_STATS_DAYS
 from app.data.models.qa import Source
+from app.llama_index_server.eviction_policy import EvictionPolicy
+
+KNOWLEDGE_BASE_QUERY = {"source": Source.KNOWLEDGE_BASE.value}
+NOT_KNOWLEDGE_BASE_QUERY = {"source": {"$ne": Source.KNOWLEDGE_BASE.value}}
+DOC_ID_PROJECTION = {"_id": 0, "doc_id": 1}
+
+
+def get_record_queries_update(doc_id, day, count, last_timestamp) -> Tuple[dict, List[dict]]:
+    """
+    (filter, update pipeline) adding `count` queries of `day` to its bucket, or starting the bucket over with them if
+    it is of an older day, in one atomic update which does not read the document first.
+    the buckets are reused modulo QUERY_STATS_DAYS, so a document never has more than QUERY_STATS_DAYS of them
+    """
+    bucket = f"query_buckets.{day % QUERY_STATS_DAYS}"
+    previous_count = {"$cond": [{"$eq": [f"${bucket}.day", day]}, f"${bucket}.count", 0]}
+    return {"doc_id": doc_id}, [{"$set": {
+        bucket: {"day": {"$literal": day}, "count": {"$add": [previous_count, count]}},
+        "last_query_timestamp": {"$max": ["$last_query_timestamp", last_timestamp]},
+    }}]
+
+
+def get_eviction_pipeline(policy: EvictionPolicy, limit: int) -> List[dict]:
+    """the user questions inserted more than EVICTION_MIN_AGE_DAYS ago, in the order of `policy`"""
+    now = get_current_milliseconds()
+    return [
+        {"$match": {**NOT_KNOWLEDGE_BASE_QUERY,
+                    "insert_timestamp": {"$lt": now - data_consts.EVICTION_MIN_AGE_DAYS * MILLISECONDS_PER_DAY}}},
+        *policy.stages(now),
+        {"$limit": limit},
+        {"$project": DOC_ID_PROJECTION},
+    ]
+
+
+def to_query_buckets(timestamps: List[int], now: int) -> Dict[str, dict]:
+    """the buckets of the query timestamps of the last QUERY_STATS_DAYS days"""
+    today = milliseconds_to_day(now)
+    buckets = {}
+    for timestamp in timestamps:
+        day = milliseconds_to_day(timestamp)
+        if today - QUERY_STATS_DAYS < day <= today:
+            bucket = buckets.setdefault(str(day % QUERY_STATS_DAYS), {"day": day, "count": 0})
+            bucket["count"] += 1
+    return buckets
 
 
 class DocumentMetaDao(MongoDao):
@@ -11,41 +57,66 @@ class DocumentMetaDao(MongoDao):
                  mongo_uri=data_consts.MONGO_URI,
                  db_name=LlamaIndexDocumentMeta.db_name(),
                  collection_name=LlamaIndexDocumentMeta.collection_name(),
+                 indexes=LlamaIndexDocumentMeta.indexes(),
                  size_limit=data_consts.DOCUMENT_META_LIMIT,
                  ):
-        super().__init__(mongo_uri, db_name, collection_name, size_limit)
-
-    def prune(self):
-        """
-        remove all documents that satisfy the following conditions:
-            1. not from knowledge base, and
-            2. inserted more than 7 days ago, and
-            3. not queried in the last 7 days
-        """
-        logger.info(f"current doc size: {self.doc_size()}, pruning...")
-        seven_days_ago = get_current_milliseconds() - 7 * MILLISECONDS_PER_DAY
-        query = {
-            "source": {"$ne": Source.KNOWLEDGE_BASE.value},
-            "insert_timestamp": {"$lt": seven_days_ago},
-            "query_timestamps": {
-                "$not": {
-                    "$elemMatch": {"$gte": seven_days_ago}
-                }
-            }
-        }
-        projection = {
-            "_id": 0,
-            "doc_id": 1,
-        }
-        pruned_doc_ids = []
-        for doc in self.find(query, projection):
-            pruned_doc_ids.append(doc["doc_id"])
-        if len(pruned_doc_ids) > 0:
-            self.delete_many(query)
-        return pruned_doc_ids
+        super().__init__(mongo_uri, db_name, collection_name, size_limit, indexes)
+
+    def record_queries(self, hits: Dict[Tuple[str, int], List[int]]):
+        """count the queries {(doc_id, day): [count, last timestamp]} with one unordered bulk write"""
+        operations = [UpdateOne(*get_record_queries_update(doc_id, day, count, last_timestamp))
+                      for (doc_id, day), (count, last_timestamp) in hits.items()]
+        result = self._collection.bulk_write(operations, ordered=False)
+        logger.info(f"Recorded the queries of {len(operations)} docs, matched = {result.matched_count}")
+
+    def migrate_query_timestamps(self):
+        """one-time migration of the query_timestamps arrays of the documents into query buckets"""
+        now = get_current_milliseconds()
+        operations = []
+        for doc in self.find({"query_timestamps": {"$exists": True}}, {"_id": 0, "doc_id": 1, "query_timestamps": 1}):
+            timestamps = doc["query_timestamps"]
+            update = {"$set": {"query_buckets": to_query_buckets(timestamps, now)}, "$unset": {"query_timestamps": ""}}
+            if len(timestamps) > 0:
+                update["$max"] = {"last_query_timestamp": max(timestamps)}
+            operations.append(UpdateOne({"doc_id": doc["doc_id"]}, update))
+        if len(operations) > 0:
+            result = self._collection.bulk_write(operations, ordered=False)
+            logger.info(f"Migrated the query timestamps of {len(operations)} docs, result = {result}")
+
+    def knowledge_base_doc_ids(self):
+        return [doc["doc_id"] for doc in self.find(KNOWLEDGE_BASE_QUERY, DOC_ID_PROJECTION)]
+
+    def eviction_candidates(self, policy: EvictionPolicy, limit: int) -> List[str]:
+        """the doc ids of the first `limit` documents not from the knowledge base, in the order of `policy`"""
+        pipeline = get_eviction_pipeline(policy, limit)
+        return [doc["doc_id"] for doc in self._collection.aggregate(pipeline)]
+
+    def delete_docs(self, doc_ids: List[str]):
+        """delete the documents not from the knowledge base among `doc_ids`"""
+        return self.delete_many({**NOT_KNOWLEDGE_BASE_QUERY, "doc_id": {"$in": doc_ids}})
+
+    def explain_eviction(self, policy: EvictionPolicy):
+        """the plans mongodb chooses for eviction_candidates, see find_collection_scans"""
+        return self.explain_aggregate(get_eviction_pipeline(policy, 1))
 
     def cleanup_for_test(self):
-        query = {
-            "source": {"$ne": Source.KNOWLEDGE_BASE.value},
-        }
-        super().delete_many(query)
+        super().delete_many(NOT_KNOWLEDGE_BASE_QUERY)
+
+
+class AsyncDocumentMetaDao(AsyncMongoDao):
+    """DocumentMetaDao for the event loop"""
+
+    def __init__(self,
+                 mongo_uri=data_consts.MONGO_URI,
+                 db_name=LlamaIndexDocumentMeta.db_name(),
+                 collection_name=LlamaIndexDocumentMeta.collection_name(),
+                 indexes=LlamaIndexDocumentMeta.indexes(),
+                 size_limit=data_consts.DOCUMENT_META_LIMIT,
+                 ):
+        super().__init__(mongo_uri, db_name, collection_name, size_limit, indexes)
+
+    async def knowledge_base_doc_ids(self):
+        return [doc["doc_id"] for doc in await self.find(KNOWLEDGE_BASE_QUERY, DOC_ID_PROJECTION)]
+
+    async def cleanup_for_test(self):
+        await super().delete_many(NOT_KNOWLEDGE_BASE_QUERY)
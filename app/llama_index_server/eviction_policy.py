@@ -0,0 +1,126 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+from app.data.models.mongodb import QUERY_STATS_DAYS
+from app.utils.data_util import milliseconds_to_day
+from app.utils.file_lock_util import FileLock
+from app.utils.log_util import logger
+from app.utils.metrics_util import Histogram, MILLISECONDS_BUCKETS, SIZE_BUCKETS
+
+EVICTION_POLICY_AGE = "age"
+EVICTION_POLICY_LRU = "lru"
+EVICTION_POLICY_LFU = "lfu"
+
+
+# the last time a document was used: queried, or inserted if it was never queried
+LAST_USED_TIMESTAMP = {"$max": ["$last_query_timestamp", "$insert_timestamp"]}
+
+
+class EvictionPolicy(ABC):
+    """
+    ranks the documents which may be evicted, the first ones are evicted first: the aggregation stages following
+    the $match of the candidates, which sort them. the ties are broken by age, the oldest first
+    """
+
+    @abstractmethod
+    def stages(self, now: int) -> List[dict]:
+        pass
+
+
+class AgeEvictionPolicy(EvictionPolicy):
+    """the oldest documents first, whether they are queried or not"""
+
+    def stages(self, now: int) -> List[dict]:
+        return [{"$sort": {"insert_timestamp": 1}}]
+
+
+class LruEvictionPolicy(EvictionPolicy):
+    """the least recently used documents first, a document never queried is as recent as its insertion"""
+
+    def stages(self, now: int) -> List[dict]:
+        return [
+            {"$set": {"last_used_timestamp": LAST_USED_TIMESTAMP}},
+            {"$sort": {"last_used_timestamp": 1, "insert_timestamp": 1}},
+        ]
+
+
+class LfuEvictionPolicy(EvictionPolicy):
+    """the documents queried the least in the last QUERY_STATS_DAYS days first, then the least recently used ones"""
+
+    def stages(self, now: int) -> List[dict]:
+        recent_buckets = {"$filter": {
+            "input": {"$objectToArray": {"$ifNull": ["$query_buckets", {}]}},
+            "cond": {"$gt": ["$$this.v.day", milliseconds_to_day(now) - QUERY_STATS_DAYS]},
+        }}
+        return [
+            {"$set": {
+                "recent_query_count": {"$sum": {"$map": {"input": recent_buckets, "in": "$$this.v.count"}}},
+                "last_used_timestamp": LAST_USED_TIMESTAMP,
+            }},
+            {"$sort": {"recent_query_count": 1, "last_used_timestamp": 1, "insert_timestamp": 1}},
+        ]
+
+
+EVICTION_POLICIES: Dict[str, EvictionPolicy] = {
+    EVICTION_POLICY_AGE: AgeEvictionPolicy(),
+    EVICTION_POLICY_LRU: LruEvictionPolicy(),
+    EVICTION_POLICY_LFU: LfuEvictionPolicy(),
+}
+
+
+def get_eviction_policy(name: str) -> EvictionPolicy:
+    if name not in EVICTION_POLICIES:
+        raise ValueError(f"Invalid eviction policy: {name}, expected one of {list(EVICTION_POLICIES)}")
+    return EVICTION_POLICIES[name]
+
+
+class Evictor:
+    """
+    one eviction run at a time on the host: `mongo` is the document meta dao, `remove` removes the evicted documents
+    from the index and mongo. the processes sharing an index pass the same `lock_path`, a process finding it taken
+    skips its run, the holder evicts for all of them. the excess is computed under the lock, so it includes the
+    evictions of the others
+    """
+
+    def __init__(self, mongo, policy: EvictionPolicy, batch_size: int, remove: Callable[[List[str]], Any],
+                 lock_path: Optional[str] = None):
+        self._mongo = mongo
+        self._policy = policy
+        self._batch_size = batch_size
+        self._remove = remove
+        self._lock = FileLock(lock_path) if lock_path else None
+        self._evictions_per_run = Histogram(SIZE_BUCKETS)
+        self._latencies = Histogram(MILLISECONDS_BUCKETS)
+        self._evicted = 0
+        self._skipped = 0
+        self._last_excess_doc_size = 0
+
+    def run(self) -> List[str]:
+        """evict at most a batch of the documents beyond the limit, returns their doc ids"""
+        if self._lock is not None and not self._lock.acquire(blocking=False):
+            self._skipped += 1
+            return []
+        start = time.perf_counter()
+        try:
+            excess = self._mongo.excess_doc_size()
+            self._last_excess_doc_size = excess
+            doc_ids = self._mongo.eviction_candidates(self._policy, min(excess, self._batch_size)) if excess > 0 else []
+            if len(doc_ids) > 0:
+                self._remove(doc_ids)
+                logger.info(f"Evicted {len(doc_ids)} docs, {excess} were beyond the limit")
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+        self._evicted += len(doc_ids)
+        self._evictions_per_run.observe(len(doc_ids))
+        self._latencies.observe((time.perf_counter() - start) * 1000)
+        return doc_ids
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "excess_docs": self._last_excess_doc_size,
+            "evicted": self._evicted,
+            "skipped_runs": self._skipped,
+            "evictions_per_run": self._evictions_per_run.to_dict(),
+            "run_ms": self._latencies.to_dict(),
+        }
@@ -0,0 +1,130 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.indices.utils import embed_nodes
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, TransformComponent
+from app.data.models.qa import Answer
+from app.data.models.mongodb import LlamaIndexDocumentMeta
+from app.utils.log_util import logger
+from app.utils import csv_util, data_util
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.index_wal import IndexWriteAheadLog
+
+
+def csv_fingerprint(csv_path: str) -> dict:
+    """a checkpoint is only resumed for the same csv file"""
+    stat = os.stat(csv_path)
+    return {"csv_path": os.path.abspath(csv_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def read_checkpoint(checkpoint_path: str) -> Optional[dict]:
+    if not os.path.exists(checkpoint_path):
+        return None
+    try:
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def write_checkpoint(checkpoint_path: str, checkpoint: dict):
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def iter_batches(answers: Iterator[Answer], batch_size: int) -> Iterator[List[Answer]]:
+    while True:
+        batch = list(islice(answers, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def embed_batch(answers: List[Answer], embed_model: BaseEmbedding,
+                transformations: List[TransformComponent]) -> List[BaseNode]:
+    """parse and embed the questions of one batch, in a worker thread"""
+    nodes = run_transformations([answer.to_llama_index_document() for answer in answers], transformations)
+    embeddings = embed_nodes(nodes, embed_model)
+    for node in nodes:
+        node.embedding = embeddings[node.node_id]
+    return nodes
+
+
+def bootstrap_index(csv_path: str, vector_store: NumpyVectorStore, wal: IndexWriteAheadLog, mongo,
+                    checkpoint_path: str, snapshot_root: str, batch_size: int = 100, concurrency: int = 4,
+                    embed_model: Optional[BaseEmbedding] = None,
+                    transformations: Optional[List[TransformComponent]] = None) -> Dict[str, Any]:
+    """
+    build the index from the csv file of standard answers, without loading the whole file.
+
+    the rows are embedded in batches of `batch_size` by `concurrency` threads. the batches are stored in csv order:
+    the metas are bulk upserted to mongo, then the nodes are added to the vector store, whose write-ahead log record
+    is the checkpoint of the batch. if the build is interrupted, the next one replays the log and only embeds the rows
+    after the last stored batch. the log is folded into a snapshot at the end, and the checkpoint file removed.
+    """
+    embed_model = embed_model or Settings.embed_model
+    transformations = transformations if transformations is not None else Settings.transformations
+    fingerprint = csv_fingerprint(csv_path)
+    if read_checkpoint(checkpoint_path) == fingerprint:
+        replayed = vector_store.attach_wal(wal)
+        logger.info(f"Resuming index bootstrap from {csv_path}, {replayed} rows were stored before")
+    else:
+        wal.reset()
+        write_checkpoint(checkpoint_path, fingerprint)
+        vector_store.attach_wal(wal)
+    seen_doc_ids = set(vector_store.ref_doc_ids())
+    skipped = 0
+
+    def pending_answers() -> Iterator[Answer]:
+        nonlocal skipped
+        for answer in csv_util.iter_standard_answers_from_csv(csv_path):
+            doc_id = data_util.get_doc_id(answer.question)
+            if doc_id in seen_doc_ids:
+                skipped += 1
+                continue
+            seen_doc_ids.add(doc_id)
+            yield answer
+
+    rows = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # at most `concurrency` batches are embedded ahead of the one being stored
+        in_flight = deque()
+        batches = iter_batches(pending_answers(), batch_size)
+        for batch in islice(batches, concurrency):
+            in_flight.append((batch, executor.submit(embed_batch, batch, embed_model, transformations)))
+        while len(in_flight) > 0:
+            batch, future = in_flight.popleft()
+            nodes = future.result()
+            next_batch = next(batches, None)
+            if next_batch is not None:
+                in_flight.append((next_batch, executor.submit(embed_batch, next_batch, embed_model, transformations)))
+            mongo.bulk_upsert([LlamaIndexDocumentMeta.from_answer(answer).model_dump() for answer in batch],
+                              primary_keys=["doc_id"])
+            vector_store.add(nodes)
+            rows += len(batch)
+            elapsed = time.perf_counter() - start
+            logger.info(f"Bootstrapped {rows} rows, {rows / elapsed:.1f} rows/s")
+    seconds = time.perf_counter() - start
+    vector_store.save_snapshot(snapshot_root)
+    os.remove(checkpoint_path)
+    stats = {
+        "rows": rows,
+        "skipped": skipped,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+    }
+    logger.info(f"Index bootstrap done: {stats}")
+    return stats
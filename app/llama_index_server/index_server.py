@@ -1,13 +1,15 @@
-from typing import Union
-from llama_index.core import Prompt
+from typing import AsyncIterator, Optional, Tuple, Union
+from llama_index.core import Prompt, Settings, QueryBundle
 from llama_index.core.response_synthesizers import get_response_synthesizer, ResponseMode
 from llama_index.core.postprocessor import SimilarityPostprocessor
 from llama_index.core.llms import ChatMessage, MessageRole
-from llama_index.agent.openai import OpenAIAgent
-from llama_index.llms.openai import OpenAI
+from llama_index.core.agent import AgentRunner
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.agent.openai import OpenAIAgentWorker
 import asyncio
+from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
-from app.data.messages.qa import DocumentRequest
+from app.data.messages.qa import DocumentRequest, QuestionAnsweringResponse
 from app.data.models.qa import Source, Answer, get_default_answer_id, get_default_answer
 from app.data.models.mongodb import (
     LlamaIndexDocumentMeta,
@@ -15,12 +17,18 @@ from app.data.models.mongodb import (
     Message,
 )
 from app.utils.log_util import logger
-from app.utils import data_util
-from app.llama_index_server.chat_message_dao import ChatMessageDao
+from app.utils.data_consts import API_TIMEOUT, EXECUTOR_MAX_WORKERS, DOC_META_CHANGE_STREAM
+from app.utils import data_util, scheduler_util
+from app.utils.async_util import call_in_executor, iterate_in_executor, run_in_background
+from app.llama_index_server.chat_message_dao import AsyncChatMessageDao
 from app.llama_index_server.index_storage import index_storage
 from app.llama_index_server.my_query_engine_tool import MyQueryEngineTool, MATCHED_MARK
+from app.llama_index_server.response_cache import QUESTION_PLACEHOLDER, normalize_question
+from app.llama_index_server.single_flight import SingleFlight
+from app.llama_index_server.cancellable_openai import CancellableOpenAI, track_generations, cancel_generations
 
-executor = ThreadPoolExecutor(max_workers=100)
+# only for the blocking work: index writes and the sync llama index calls of the streaming query engine
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS)
 SIMILARITY_CUTOFF = 0.85
 PROMPT_TEMPLATE_FOR_QUERY_ENGINE = (
     "Assume you are an experienced golf coach glad to answer questions from golfer beginners, "
@@ -39,11 +47,18 @@ SYSTEM_PROMPT_TEMPLATE_FOR_CHAT_ENGINE = (
     "please give short, simple, accurate, precise answer to the question, limited to 80 words maximum.\n"
     "You may need to combine the chat history to fully understand the query of the user.\n"
 )
-chat_message_dao = ChatMessageDao()
+# opened on startup, in the event loop which serves the requests: a motor client is bound to the first loop using it
+chat_message_dao: Optional[AsyncChatMessageDao] = None
+# keyed on the normalized question
+llm_single_flight = SingleFlight()
+# the task invalidating the cached doc metas changed outside the server, with AI_BOT_DOC_META_CHANGE_STREAM
+doc_meta_changes: Optional[asyncio.Task] = None
 
 
+@lru_cache(maxsize=None)
 def get_local_query_engine():
     """
+    built once and shared by all the requests, a query engine keeps no state between queries.
     strictly limited to local knowledge base. our local knowledge base is a list of standard questions which are indexed in vector store,
     while the standard answers are stored in mongodb through DocumentMetaDao.
     there is a one-to-one mapping between each standard question and a standard answer.
@@ -59,9 +74,14 @@ def get_local_query_engine():
     )
 
 
-def get_matched_question_from_local_query_engine(query_text):
+async def embed_query(query_text) -> QueryBundle:
+    """embed the query once, the retrievers skip embedding a query bundle which already has an embedding"""
+    return QueryBundle(query_str=query_text, embedding=await Settings.embed_model.aget_query_embedding(query_text))
+
+
+async def get_matched_question_from_local_query_engine(query: Union[str, QueryBundle]):
     local_query_engine = get_local_query_engine()
-    local_query_response = local_query_engine.query(query_text)
+    local_query_response = await local_query_engine.aquery(query)
     if len(local_query_response.source_nodes) > 0:
         matched_node = local_query_response.source_nodes[0]
         matched_question = matched_node.text
@@ -71,50 +91,87 @@ def get_matched_question_from_local_query_engine(query_text):
         return None
 
 
-def get_doc_meta(text):
+async def get_doc_meta(text):
     matched_doc_id = data_util.get_doc_id(text)
-    mongo = index_storage.mongo()
-    doc_meta = mongo.find_one({"doc_id": matched_doc_id})
-    doc_meta = LlamaIndexDocumentMeta(**doc_meta) if doc_meta else None
+    doc_meta = await index_storage.doc_meta_cache().get(
+        matched_doc_id, lambda doc_id: index_storage.amongo().find_one({"doc_id": doc_id}))
     return matched_doc_id, doc_meta
 
 
+@lru_cache(maxsize=None)
 def get_llm_query_engine():
     index = index_storage.index()
     qa_template = Prompt(PROMPT_TEMPLATE_FOR_QUERY_ENGINE)
     return index.as_query_engine(text_qa_template=qa_template)
 
 
+async def match_knowledge_base(
+        query_text) -> Tuple[Optional[str], Optional[LlamaIndexDocumentMeta], Optional[QueryBundle]]:
+    """the matched standard question and its doc meta if any, and the embedded query if it had to be embedded"""
+    # a question which only differs from an indexed one in case, whitespace or punctuation needs no vector search
+    matched_question = index_storage.find_exact_question(query_text)
+    query_bundle = None
+    if matched_question is None:
+        # the same embedding is used to match, to retrieve the context for the llm, and to index the new question
+        query_bundle = await embed_query(query_text)
+        matched_question = await get_matched_question_from_local_query_engine(query_bundle)
+    if not matched_question:
+        return None, None, query_bundle
+    matched_doc_id, doc_meta = await get_doc_meta(matched_question)
+    if doc_meta:
+        logger.debug(f"An matched doc meta found from mongodb: {doc_meta}")
+        index_storage.query_hits().record(matched_doc_id, data_util.get_current_milliseconds())
+    else:
+        # means the document meta has been removed from mongodb. for example by pruning
+        logger.warning(f"'{matched_doc_id}' is not found in mongodb")
+    return matched_question, doc_meta, query_bundle
+
+
+def get_answer_from_doc_meta(query_text, matched_question, doc_meta: LlamaIndexDocumentMeta) -> Answer:
+    return Answer(
+        category=doc_meta.category,
+        question=query_text,
+        matched_question=matched_question,
+        source=Source.KNOWLEDGE_BASE if doc_meta.source == Source.KNOWLEDGE_BASE else Source.USER_ASKED,
+        answer=doc_meta.answer,
+    )
+
+
+def get_off_topic_answer(query_text) -> Answer:
+    # clearly off-topic, the llm would only answer the default answer. it is not indexed either
+    logger.info(f"Off-topic question, not sent to the llm: {query_text}")
+    return Answer(
+        category=None,
+        question=query_text,
+        source=Source.TOPIC_FILTER,
+        answer=get_default_answer(),
+    )
+
+
 async def query_index(query_text, only_for_meta=False) -> Union[Answer, LlamaIndexDocumentMeta, None]:
     data_util.assert_not_none(query_text, "query cannot be none")
     logger.info(f"Query test: {query_text}")
+    matched_question, doc_meta, query_bundle = await match_knowledge_base(query_text)
+    if matched_question and only_for_meta:
+        return doc_meta
+    if doc_meta:
+        return get_answer_from_doc_meta(query_text, matched_question, doc_meta)
+    if query_bundle is None:
+        query_bundle = await embed_query(query_text)
+    if not index_storage.topic_filter().is_relevant(query_bundle.embedding):
+        return get_off_topic_answer(query_text)
+    # if not found, turn to LLM. the concurrent requests for the same question share one llm call
+    answer, shared = await llm_single_flight.do(normalize_question(query_text),
+                                                lambda: query_llm(query_text, query_bundle))
+    if shared:
+        answer = answer.model_copy(update={"question": query_text})
+    return answer
+
+
+async def query_llm(query_text, query_bundle: QueryBundle) -> Answer:
     loop = asyncio.get_running_loop()
-    # first search locally
-    matched_question = await loop.run_in_executor(executor, get_matched_question_from_local_query_engine, query_text)
-    if matched_question:
-        matched_doc_id, doc_meta = get_doc_meta(matched_question)
-        if doc_meta:
-            logger.debug(f"An matched doc meta found from mongodb: {doc_meta}")
-            doc_meta.query_timestamps.append(data_util.get_current_milliseconds())
-            index_storage.mongo().upsert_one({"doc_id": matched_doc_id}, doc_meta)
-            if only_for_meta:
-                return doc_meta
-            else:
-                return Answer(
-                    category=doc_meta.category,
-                    question=query_text,
-                    matched_question=matched_question,
-                    source=Source.KNOWLEDGE_BASE if doc_meta.source == Source.KNOWLEDGE_BASE else Source.USER_ASKED,
-                    answer=doc_meta.answer,
-                )
-        else:
-            # means the document meta has been removed from mongodb. for example by pruning
-            logger.warning(f"'{matched_doc_id}' is not found in mongodb")
-            if only_for_meta:
-                return None
-    # if not found, turn to LLM
     llm_query_engine = get_llm_query_engine()
-    response = await loop.run_in_executor(executor, llm_query_engine.query, query_text)
+    response = await llm_query_engine.aquery(query_bundle)
     # save the question-answer pair to index
     answer = Answer(
         category=None,
@@ -122,18 +179,90 @@ async def query_index(query_text, only_for_meta=False) -> Union[Answer, LlamaInd
         source=index_storage.current_model,
         answer=str(response),
     )
-    index_storage.add_doc(answer)
+    # the log is fsynced and the meta upserted under the write lock, which is left to a thread
+    await loop.run_in_executor(executor, index_storage.add_doc, answer, query_bundle.embedding)
     return answer
 
 
-def delete_doc(doc_id):
+@lru_cache(maxsize=None)
+def get_llm_streaming_query_engine():
+    index = index_storage.index()
+    qa_template = Prompt(PROMPT_TEMPLATE_FOR_QUERY_ENGINE)
+    return index.as_query_engine(text_qa_template=qa_template, streaming=True)
+
+
+def index_answer(answer: Answer, embedding):
+    try:
+        index_storage.add_doc(answer, embedding=embedding)
+    except Exception as e:
+        logger.exception(f"Failed to index the answer of '{answer.question}': {e}")
+
+
+async def stream_query_index(query_text) -> AsyncIterator[Union[str, Answer]]:
+    """
+    the answer of a question matched in the knowledge base at once. otherwise the llm's answer in pieces while it is
+    generated, then the complete answer, which is indexed in the background. it is not indexed if the consumer stops
+    early. unlike query_index, each request has its own llm call, there is no single answer to share before the end
+    """
+    data_util.assert_not_none(query_text, "query cannot be none")
+    logger.info(f"Streaming query: {query_text}")
+    matched_question, doc_meta, query_bundle = await match_knowledge_base(query_text)
+    if doc_meta:
+        yield get_answer_from_doc_meta(query_text, matched_question, doc_meta)
+        return
+    if query_bundle is None:
+        query_bundle = await embed_query(query_text)
+    if not index_storage.topic_filter().is_relevant(query_bundle.embedding):
+        yield get_off_topic_answer(query_text)
+        return
+    # retrieves the context and starts the completion, the tokens are read as they arrive. a completion which only
+    # starts after the timeout is closed right away, with its connection
+    response = await call_in_executor(executor, lambda: get_llm_streaming_query_engine().query(query_bundle),
+                                      timeout=API_TIMEOUT, release=lambda r: r.response_gen.close())
+    response_text = ""
+    # the timeout is between two tokens, a long answer may take longer as a whole
+    async for delta in iterate_in_executor(executor, response.response_gen, timeout=API_TIMEOUT):
+        response_text += delta
+        yield delta
+    answer = Answer(
+        category=None,
+        question=query_text,
+        source=index_storage.current_model,
+        answer=response_text.strip(),
+    )
+    executor.submit(index_answer, answer, query_bundle.embedding)
+    yield answer
+
+
+def get_cached_response(query_text) -> Optional[bytes]:
+    """the serialized response of a question answered before, the hit is written behind"""
+    cached = index_storage.response_cache().get(query_text)
+    if cached is None:
+        return None
+    doc_id, body = cached
+    index_storage.query_hits().record(doc_id, data_util.get_current_milliseconds())
+    return body
+
+
+def cache_response(answer: Answer):
+    doc_id = data_util.get_doc_id(answer.matched_question or answer.question)
+    if index_storage.find_exact_question(doc_id) is None:
+        # removed while the question was being answered
+        return
+    template = answer.model_copy(update={"question": QUESTION_PLACEHOLDER})
+    body = QuestionAnsweringResponse(data=template).model_dump_json()
+    index_storage.response_cache().put(answer.question, doc_id, body)
+
+
+async def delete_doc(doc_id):
     data_util.assert_not_none(doc_id, "doc_id cannot be none")
     logger.info(f"Delete document with doc id: {doc_id}")
-    return index_storage.delete_doc(doc_id)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, index_storage.delete_doc, doc_id)
 
 
 async def get_document(req: DocumentRequest):
-    doc_meta = index_storage.mongo().find_one({"doc_id": req.doc_id})
+    doc_meta = await index_storage.amongo().find_one({"doc_id": req.doc_id})
     if doc_meta:
         return LlamaIndexDocumentMetaReadable(**doc_meta)
     elif req.fuzzy:
@@ -145,43 +274,67 @@ async def get_document(req: DocumentRequest):
     return None
 
 
-def cleanup_for_test():
-    return index_storage.mongo().cleanup_for_test()
+async def cleanup_for_test():
+    result = await index_storage.amongo().cleanup_for_test()
+    index_storage.doc_meta_cache().clear()
+    index_storage.response_cache().clear()
+    return result
 
 
-def get_chat_engine(conversation_id: str, streaming: bool = False):
-    local_query_engine = get_local_query_engine()
+@lru_cache(maxsize=None)
+def get_chat_llm():
+    return CancellableOpenAI(
+        temperature=0,
+        model=index_storage.current_model,
+        max_tokens=100,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_chat_agent_worker():
+    """the tools, llm and system prompt of the chat engine. the worker keeps no state, the steps of a chat do"""
     query_engine_tools = [
         MyQueryEngineTool.from_defaults(
-            query_engine=local_query_engine,
+            query_engine=get_local_query_engine(),
             name="local_query_engine",
             description="Queries from a knowledge base consists of typical questions that a golf beginner might ask",
         )
     ]
-    chat_llm = OpenAI(
-        temperature=0,
-        model=index_storage.current_model,
-        streaming=streaming,
-        max_tokens=100,
-    )
-    chat_history = chat_message_dao.get_chat_history(conversation_id)
-    chat_history = [ChatMessage(role=c.role, content=c.content) for c in chat_history]
-    return OpenAIAgent.from_tools(
+    chat_llm = get_chat_llm()
+    return OpenAIAgentWorker.from_tools(
         tools=query_engine_tools,
         llm=chat_llm,
-        chat_history=chat_history,
         verbose=True,
-        system_prompt=SYSTEM_PROMPT_TEMPLATE_FOR_CHAT_ENGINE,
+        callback_manager=chat_llm.callback_manager,
+        prefix_messages=[ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPT_TEMPLATE_FOR_CHAT_ENGINE)],
     )
 
 
-def get_response_text_from_chat(agent_chat_response):
+async def get_chat_engine(conversation_id: str):
+    """an agent runner for one chat message, around the shared worker. only its memory is per conversation"""
+    chat_llm = get_chat_llm()
+    chat_history = await chat_message_dao.get_chat_history(conversation_id)
+    chat_history = [ChatMessage(role=c.role, content=c.content) for c in chat_history]
+    return AgentRunner(
+        get_chat_agent_worker(),
+        memory=ChatMemoryBuffer.from_defaults(chat_history=chat_history, llm=chat_llm),
+        llm=chat_llm,
+        callback_manager=chat_llm.callback_manager,
+    )
+
+
+def get_matched_question_from_chat(agent_chat_response) -> Optional[str]:
+    """the standard question matched by the local query engine tool, if the agent called it"""
     sources = agent_chat_response.sources
     if len(sources) > 0:
         source_content = sources[0].content
         if MATCHED_MARK in source_content:
             return source_content.replace(MATCHED_MARK, "").strip()
-    return agent_chat_response.response
+    return None
+
+
+def get_response_text_from_chat(agent_chat_response):
+    return get_matched_question_from_chat(agent_chat_response) or agent_chat_response.response
 
 
 async def chat(query_text: str, conversation_id: str) -> Message:
@@ -189,21 +342,96 @@ async def chat(query_text: str, conversation_id: str) -> Message:
     data_util.assert_not_none(query_text, "query content cannot be none")
     user_message = ChatMessage(role=MessageRole.USER, content=query_text)
     # save immediately, since the following steps may take a while and throw exceptions
-    chat_message_dao.save_chat_history(conversation_id, user_message)
-    chat_engine = get_chat_engine(conversation_id)
-    loop = asyncio.get_running_loop()
-    agent_chat_response = await loop.run_in_executor(executor, chat_engine.chat, query_text)
+    await chat_message_dao.save_chat_history(conversation_id, user_message)
+    chat_engine = await get_chat_engine(conversation_id)
+    agent_chat_response = await chat_engine.achat(query_text)
     response_text = get_response_text_from_chat(agent_chat_response)
     response_text = get_default_answer() if get_default_answer_id() in response_text else response_text
-    matched_doc_id, doc_meta = get_doc_meta(response_text)
+    matched_doc_id, doc_meta = await get_doc_meta(response_text)
     if doc_meta:
         logger.debug(f"An matched doc meta found from mongodb: {doc_meta}")
-        doc_meta.query_timestamps.append(data_util.get_current_milliseconds())
-        index_storage.mongo().update_one({"doc_id": matched_doc_id}, doc_meta)
+        index_storage.query_hits().record(matched_doc_id, data_util.get_current_milliseconds())
         bot_message = ChatMessage(role=MessageRole.ASSISTANT, content=doc_meta.answer)
     else:
         # means the chat engine cannot find a matched doc meta from mongodb
         logger.warning(f"'{matched_doc_id}' is not found in mongodb")
         bot_message = ChatMessage(role=MessageRole.ASSISTANT, content=response_text)
-    chat_message_dao.save_chat_history(conversation_id, bot_message)
+    await chat_message_dao.save_chat_history(conversation_id, bot_message)
     return Message.from_chat_message(conversation_id, bot_message)
+
+
+async def stream_chat(query_text: str, conversation_id: str) -> AsyncIterator[Union[str, Message]]:
+    """
+    the answer in pieces while the agent generates it, then the saved assistant message.
+    if the consumer stops early, e.g. because the client disconnected, the generation is cancelled and the part
+    generated so far is saved
+    """
+    data_util.assert_not_none(query_text, "query content cannot be none")
+    user_message = ChatMessage(role=MessageRole.USER, content=query_text)
+    await chat_message_dao.save_chat_history(conversation_id, user_message)
+    chat_engine = await get_chat_engine(conversation_id)
+    response_text = ""
+    completed = False
+    generations = set()
+    try:
+        with track_generations() as generations:
+            # returns once the tools are called and the final answer started streaming
+            response = await asyncio.wait_for(chat_engine.astream_chat(query_text), timeout=API_TIMEOUT)
+        matched_question = get_matched_question_from_chat(response)
+        matched_doc_id, doc_meta = await get_doc_meta(matched_question) if matched_question else (None, None)
+        if doc_meta:
+            # the standard answer replaces whatever the llm goes on to say
+            logger.debug(f"An matched doc meta found from mongodb: {doc_meta}")
+            index_storage.query_hits().record(matched_doc_id, data_util.get_current_milliseconds())
+            response_text = doc_meta.answer
+            yield response_text
+        else:
+            async for delta in response.async_response_gen():
+                response_text += delta
+                yield delta
+        completed = True
+    finally:
+        cancel_generations(generations)
+        if completed and get_default_answer_id() in response_text:
+            response_text = get_default_answer()
+        bot_message = ChatMessage(role=MessageRole.ASSISTANT, content=response_text.strip())
+        if completed or response_text:
+            if not completed:
+                logger.info(f"Chat streaming of conversation {conversation_id} stopped, saving the partial answer")
+            await chat_message_dao.save_chat_history(conversation_id, bot_message)
+    yield Message.from_chat_message(conversation_id, bot_message)
+
+
+def get_stats():
+    return {
+        "index": index_storage.stats(),
+        "embedding_cache": Settings.embed_model.stats(),
+        "embedding_batches": index_storage.embedding_batch_stats(),
+        "response_cache": index_storage.response_cache().stats(),
+        "llm_single_flight": llm_single_flight.stats(),
+        "topic_filter": index_storage.topic_filter().stats(),
+        "query_hits": index_storage.query_hits().stats(),
+        "doc_meta_cache": index_storage.doc_meta_cache().stats(),
+        "eviction": index_storage.eviction_stats(),
+    }
+
+
+async def startup():
+    global chat_message_dao
+    chat_message_dao = AsyncChatMessageDao()
+    index_storage.open_async_mongo()
+    # the doc meta indexes are created by the sync dao of the index storage
+    await chat_message_dao.ensure_indexes()
+    scheduler_util.start()
+    if DOC_META_CHANGE_STREAM:
+        global doc_meta_changes
+        doc_meta_changes = run_in_background(index_storage.doc_meta_cache().follow_changes(index_storage.amongo()),
+                                             name="doc_meta_changes")
+
+
+def shutdown():
+    if doc_meta_changes is not None:
+        doc_meta_changes.cancel()
+    # waits for a running background persist, so the final one does not race with it
+    scheduler_util.shutdown()
+    index_storage.shutdown()
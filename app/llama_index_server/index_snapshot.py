@@ -0,0 +1,209 @@
+"""
+binary snapshot format of NumpyVectorStore.
+
+a snapshot is a directory under the snapshot root, the root's CURRENT file names the latest complete one:
+    header.json     format version, dim, size, capacity and the last write-ahead log segment it contains
+    vectors.f32     row-major float32 embeddings, sparse-padded to `capacity` rows
+    ids.json        node ids and ref doc ids, in row order
+    nodes.bin       serialized nodes(without embedding), one json record per row, concatenated
+    nodes.idx       int64 offsets of the records in nodes.bin, size + 1 entries
+    centroids.npy   (optional) ivf centroids
+    assignments.npy (optional) ivf cluster of each row
+
+vectors.f32 is memory-mapped copy-on-write, so opening a snapshot does not parse or copy any embedding, and the
+processes that open the same snapshot share its pages. only the pages a process writes to become private.
+the padding lets a process append rows without reallocating the matrix.
+nodes are decoded lazily, only when they are returned by a query.
+"""
+import json
+import os
+import shutil
+from typing import List, Optional
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from app.utils import data_util
+from app.utils.log_util import logger
+
+SNAPSHOT_VERSION = 1
+CURRENT_FNAME = "CURRENT"
+# flocked by the process writing a snapshot, when several processes share the index
+LOCK_FNAME = "LOCK"
+HEADER_FNAME = "header.json"
+VECTORS_FNAME = "vectors.f32"
+IDS_FNAME = "ids.json"
+NODES_FNAME = "nodes.bin"
+OFFSETS_FNAME = "nodes.idx"
+CENTROIDS_FNAME = "centroids.npy"
+ASSIGNMENTS_FNAME = "assignments.npy"
+# extra rows mapped after the stored ones, for the inserts until the next snapshot
+MIN_HEADROOM = 1024
+
+
+def encode_node(node: Optional[BaseNode]) -> bytes:
+    # an empty record stands for a row which was added without a node
+    if node is None:
+        return b""
+    if node.embedding is not None:
+        node = node.copy()
+        node.embedding = None
+    return json.dumps(doc_to_json(node), ensure_ascii=False).encode("utf-8")
+
+
+def decode_node(data: bytes) -> Optional[BaseNode]:
+    return json_to_doc(json.loads(data)) if len(data) > 0 else None
+
+
+class NodeSidecar:
+    """the node records of a snapshot, decoded on demand"""
+
+    def __init__(self, snapshot_dir: str, size: int):
+        self._offsets = np.fromfile(os.path.join(snapshot_dir, OFFSETS_FNAME), dtype=np.int64)
+        data_util.assert_true(len(self._offsets) == size + 1, f"corrupted snapshot: {snapshot_dir}")
+        nodes_path = os.path.join(snapshot_dir, NODES_FNAME)
+        if self._offsets[-1] > 0:
+            self._data = np.memmap(nodes_path, dtype=np.uint8, mode="r")
+        else:
+            self._data = np.zeros(0, dtype=np.uint8)
+
+    def raw(self, i: int) -> bytes:
+        return self._data[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def get(self, i: int) -> Optional[BaseNode]:
+        return decode_node(self.raw(i))
+
+
+class Snapshot:
+    def __init__(self, snapshot_dir: str):
+        with open(os.path.join(snapshot_dir, HEADER_FNAME)) as f:
+            header = json.load(f)
+        data_util.assert_true(header["version"] == SNAPSHOT_VERSION,
+                              f"unsupported snapshot version {header['version']} in {snapshot_dir}")
+        with open(os.path.join(snapshot_dir, IDS_FNAME)) as f:
+            ids = json.load(f)
+        self.snapshot_dir = snapshot_dir
+        self.dim: int = header["dim"]
+        self.size: int = header["size"]
+        self.trained_size: int = header.get("trained_size", 0)
+        self.wal_sequence: int = header.get("wal_sequence", 0)
+        self.node_ids: List[str] = ids["node_ids"]
+        self.ref_doc_ids: List[str] = ids["ref_doc_ids"]
+        self.sidecar = NodeSidecar(snapshot_dir, self.size)
+        if self.dim > 0:
+            self.matrix = np.memmap(os.path.join(snapshot_dir, VECTORS_FNAME), dtype=np.float32, mode="c",
+                                    shape=(header["capacity"], self.dim))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        centroids_path = os.path.join(snapshot_dir, CENTROIDS_FNAME)
+        if os.path.exists(centroids_path):
+            self.centroids: Optional[np.ndarray] = np.load(centroids_path)
+            self.assignments: Optional[np.ndarray] = np.load(os.path.join(snapshot_dir, ASSIGNMENTS_FNAME))
+        else:
+            self.centroids = self.assignments = None
+
+
+def fsync_files(directory: str):
+    for fname in os.listdir(directory):
+        with open(os.path.join(directory, fname), "rb+") as f:
+            os.fsync(f.fileno())
+    fsync_dir(directory)
+
+
+def fsync_dir(directory: str):
+    """make the entries created, renamed or removed in a directory durable"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def current_snapshot_dir(snapshot_root: str) -> Optional[str]:
+    current_path = os.path.join(snapshot_root, CURRENT_FNAME)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path) as f:
+        name = f.read().strip()
+    snapshot_dir = os.path.join(snapshot_root, name)
+    return snapshot_dir if os.path.exists(os.path.join(snapshot_dir, HEADER_FNAME)) else None
+
+
+def snapshot_exists(snapshot_root: str) -> bool:
+    return current_snapshot_dir(snapshot_root) is not None
+
+
+def open_snapshot(snapshot_root: str) -> Optional[Snapshot]:
+    snapshot_dir = current_snapshot_dir(snapshot_root)
+    if snapshot_dir is None:
+        return None
+    logger.info(f"Opening index snapshot: {snapshot_dir}")
+    return Snapshot(snapshot_dir)
+
+
+def write_snapshot(
+        snapshot_root: str,
+        matrix: np.ndarray,
+        node_ids: List[str],
+        ref_doc_ids: List[str],
+        node_records: List[bytes],
+        centroids: Optional[np.ndarray] = None,
+        assignments: Optional[np.ndarray] = None,
+        trained_size: int = 0,
+        wal_sequence: int = 0,
+) -> str:
+    """
+    write a new snapshot next to the current one, then switch CURRENT to it and remove the older snapshots.
+    a crash at any point leaves CURRENT pointing to a complete snapshot.
+    """
+    size = len(node_ids)
+    dim = matrix.shape[1] if size > 0 else 0
+    timestamp = data_util.get_current_milliseconds()
+    while os.path.exists(os.path.join(snapshot_root, f"snapshot-{timestamp}")):
+        timestamp += 1
+    name = f"snapshot-{timestamp}"
+    snapshot_dir = os.path.join(snapshot_root, name)
+    os.makedirs(snapshot_dir)
+    capacity = size + max(MIN_HEADROOM, size // 4)
+    vectors_path = os.path.join(snapshot_dir, VECTORS_FNAME)
+    with open(vectors_path, "wb") as f:
+        np.ascontiguousarray(matrix[:size], dtype=np.float32).tofile(f)
+        # the padding is a hole in a sparse file, it takes no disk space
+        f.truncate(capacity * dim * 4)
+    with open(os.path.join(snapshot_dir, IDS_FNAME), "w") as f:
+        json.dump({"node_ids": node_ids, "ref_doc_ids": ref_doc_ids}, f, ensure_ascii=False)
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    with open(os.path.join(snapshot_dir, NODES_FNAME), "wb") as f:
+        for i, record in enumerate(node_records):
+            f.write(record)
+            offsets[i + 1] = offsets[i] + len(record)
+    offsets.tofile(os.path.join(snapshot_dir, OFFSETS_FNAME))
+    if centroids is not None:
+        np.save(os.path.join(snapshot_dir, CENTROIDS_FNAME), centroids)
+        np.save(os.path.join(snapshot_dir, ASSIGNMENTS_FNAME), assignments[:size])
+    with open(os.path.join(snapshot_dir, HEADER_FNAME), "w") as f:
+        json.dump({
+            "version": SNAPSHOT_VERSION,
+            "dim": dim,
+            "size": size,
+            "capacity": capacity,
+            "trained_size": trained_size,
+            "wal_sequence": wal_sequence,
+        }, f)
+    fsync_files(snapshot_dir)
+    # the entry of the new snapshot, before CURRENT names it
+    fsync_dir(snapshot_root)
+    current_path = os.path.join(snapshot_root, CURRENT_FNAME)
+    with open(current_path + ".tmp", "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_path + ".tmp", current_path)
+    # otherwise after a power loss CURRENT may still name an older snapshot, which is removed below
+    fsync_dir(snapshot_root)
+    for other in os.listdir(snapshot_root):
+        other_dir = os.path.join(snapshot_root, other)
+        # processes which still map an old snapshot keep reading it until they unmap it
+        if other != name and os.path.isdir(other_dir):
+            shutil.rmtree(other_dir, ignore_errors=True)
+    logger.info(f"Wrote index snapshot of {size} nodes: {snapshot_dir}")
+    return snapshot_dir
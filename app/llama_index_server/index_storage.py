@@ -1,39 +1,104 @@
 import os
+from datetime import datetime
 from contextlib import contextmanager
 from multiprocessing import Lock
-from typing import Tuple
+from typing import List, Optional, Tuple
 from llama_index.llms.openai import OpenAI
+from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core.indices.base import BaseIndex
 from llama_index.core import (
     Settings,
-    load_index_from_storage,
-    StorageContext,
     VectorStoreIndex,
 )
 from app.data.models.qa import Source, Answer
 from app.data.models.mongodb import LlamaIndexDocumentMeta
 from app.utils.log_util import logger
-from app.utils import data_util, csv_util
-from app.llama_index_server.document_meta_dao import DocumentMetaDao
+from app.utils import data_util, data_consts
+from app.utils.scheduler_util import scheduler
+from app.utils.file_lock_util import FileLock
+from app.llama_index_server.document_meta_dao import DocumentMetaDao, AsyncDocumentMetaDao
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.index_snapshot import snapshot_exists
+from app.llama_index_server.index_wal import IndexWriteAheadLog
+from app.llama_index_server.index_bootstrap import bootstrap_index
+from app.llama_index_server.cached_embedding import CachedEmbedding
+from app.llama_index_server.coalescing_embedding import CoalescingEmbedding
+from app.llama_index_server.response_cache import ResponseCache, normalize_question
+from app.llama_index_server.query_hit_buffer import QueryHitBuffer
+from app.llama_index_server.doc_meta_cache import DocMetaCache
+from app.llama_index_server.eviction_policy import Evictor, get_eviction_policy
+from app.llama_index_server.topic_filter import TopicFilter
 
 CURRENT_DIR = os.path.dirname(__file__)
 PARENT_DIR = os.path.dirname(CURRENT_DIR)
 LLAMA_INDEX_HOME = os.path.join(PARENT_DIR, "llama_index_server")
 os.environ["LLAMA_INDEX_CACHE_DIR"] = f"{LLAMA_INDEX_HOME}/llama_index_cache"
+EMBEDDING_CACHE_PATH = f"{LLAMA_INDEX_HOME}/llama_index_cache/embeddings.sqlite"
 INDEX_PATH = f"{LLAMA_INDEX_HOME}/saved_index"
+SNAPSHOT_PATH = f"{INDEX_PATH}/snapshots"
+WAL_PATH = f"{INDEX_PATH}/wal"
+BOOTSTRAP_CHECKPOINT_PATH = f"{INDEX_PATH}/bootstrap.json"
+INIT_LOCK_PATH = f"{INDEX_PATH}/init.lock"
+EVICTION_LOCK_PATH = f"{INDEX_PATH}/eviction.lock"
 CSV_PATH = os.path.join(PARENT_DIR, f"{LLAMA_INDEX_HOME}/documents/golf-knowledge-base.csv")
-PERSIST_INTERVAL = 3600
+PERSIST_JOB_ID = "index_persist"
+SYNC_JOB_ID = "index_sync"
+QUERY_HIT_FLUSH_JOB_ID = "query_hit_flush"
+EVICTION_JOB_ID = "eviction"
 
 
 class IndexStorage:
     def __init__(self):
         self._current_model = Source.CHATGPT35
+        self._shared = data_consts.INDEX_SHARED
         logger.info("initializing index and mongo ...")
-        self._index, self._mongo = self.initialize_index()
+        if self._shared:
+            # the first process bootstraps or migrates the index, the others load the snapshot it wrote
+            init_lock = FileLock(INIT_LOCK_PATH)
+            with init_lock:
+                self._index, self._mongo = self.initialize_index()
+            init_lock.close()
+        else:
+            self._index, self._mongo = self.initialize_index()
         logger.info("initializing index and mongo done")
+        # the same collection for the request handlers, which must not block the event loop. a motor client is bound
+        # to the event loop which first uses it, so it is opened by open_async_mongo() in the loop of the server
+        self._amongo: Optional[AsyncDocumentMetaDao] = None
         self._lock = Lock()
-        self._last_persist_time = 0
+        # initialize_index either loads or writes a snapshot
+        self._last_persist_time = data_util.get_current_seconds()
         self._chat_engine_record = {}
+        # a response holds the answer of its meta, so it is not kept longer than the meta would be
+        self._response_cache = ResponseCache(data_consts.RESPONSE_CACHE_SIZE, min(
+            data_consts.RESPONSE_CACHE_TTL_SECONDS, data_consts.DOC_META_CACHE_TTL_SECONDS))
+        self._doc_meta_cache = DocMetaCache(data_consts.DOC_META_CACHE_SIZE, data_consts.DOC_META_CACHE_TTL_SECONDS,
+                                            response_cache=self._response_cache)
+        # the hits are written behind the requests, in the scheduler
+        self._query_hits = QueryHitBuffer(self._mongo.record_queries, max_pending=data_consts.QUERY_HIT_BUFFER_SIZE,
+                                          on_full=self._flush_query_hits_now)
+        # normalized question -> doc_id of every indexed question, for the exact matches which need no embedding
+        self._exact_questions = {
+            normalize_question(doc_id): doc_id for doc_id in self._index.vector_store.ref_doc_ids()
+        }
+        # the standard questions define the topic, they only change when the index is bootstrapped
+        self._topic_filter = TopicFilter(
+            self._index.vector_store.ref_doc_embeddings(self._mongo.knowledge_base_doc_ids()),
+            threshold=data_consts.TOPIC_RELEVANCE_THRESHOLD,
+            k=data_consts.TOPIC_RELEVANCE_K,
+        )
+        scheduler.add_job(self.persist, "interval", seconds=data_consts.INDEX_PERSIST_INTERVAL, id=PERSIST_JOB_ID,
+                          max_instances=1, coalesce=True)
+        # the processes sharing the index evict one at a time
+        self._evictor = Evictor(self._mongo, get_eviction_policy(data_consts.EVICTION_POLICY),
+                                data_consts.EVICTION_BATCH_SIZE, self._remove_evicted,
+                                lock_path=EVICTION_LOCK_PATH if self._shared else None)
+        scheduler.add_job(self.evict, "interval", seconds=data_consts.EVICTION_INTERVAL, id=EVICTION_JOB_ID,
+                          max_instances=1, coalesce=True)
+        scheduler.add_job(self._query_hits.flush, "interval", seconds=data_consts.QUERY_HIT_FLUSH_INTERVAL_MS / 1000,
+                          id=QUERY_HIT_FLUSH_JOB_ID, max_instances=1, coalesce=True)
+        if self._shared:
+            scheduler.add_job(self.sync, "interval", seconds=data_consts.INDEX_SYNC_INTERVAL_MS / 1000,
+                              id=SYNC_JOB_ID, max_instances=1, coalesce=True)
 
     @property
     def chat_engine_record(self):
@@ -46,9 +111,57 @@ class IndexStorage:
     def mongo(self):
         return self._mongo
 
+    def open_async_mongo(self):
+        self._amongo = AsyncDocumentMetaDao()
+
+    def amongo(self) -> AsyncDocumentMetaDao:
+        data_util.assert_not_none(self._amongo, "the async mongo dao is opened on startup")
+        return self._amongo
+
     def index(self):
         return self._index
 
+    def response_cache(self):
+        return self._response_cache
+
+    def topic_filter(self):
+        return self._topic_filter
+
+    def query_hits(self):
+        return self._query_hits
+
+    def doc_meta_cache(self):
+        return self._doc_meta_cache
+
+    def find_exact_question(self, question: str) -> Optional[str]:
+        """the indexed question which only differs from `question` in case, whitespace or punctuation"""
+        return self._exact_questions.get(normalize_question(question))
+
+    def _forget_doc(self, doc_id):
+        self._response_cache.invalidate(doc_id)
+        self._doc_meta_cache.invalidate(doc_id)
+        normalized = normalize_question(doc_id)
+        if self._exact_questions.get(normalized) == doc_id:
+            del self._exact_questions[normalized]
+
+    def sync(self):
+        """apply the changes the other processes made to a shared index"""
+        if not self._shared:
+            return
+        with self.lock():
+            self._sync()
+
+    def _sync(self):
+        if not self._shared:
+            return
+        added, removed = self._index.vector_store.sync()
+        for doc_id in removed:
+            self._forget_doc(doc_id)
+        for doc_id in added:
+            self._response_cache.invalidate(doc_id)
+            self._doc_meta_cache.invalidate(doc_id)
+            self._exact_questions[normalize_question(doc_id)] = doc_id
+
     @contextmanager
     def lock(self):
         # for the write operations on self._index
@@ -59,42 +172,172 @@ class IndexStorage:
         """remove from both index and mongo"""
         with self.lock():
             self._index.delete_ref_doc(doc_id, delete_from_docstore=True)
-            self._index.storage_context.persist(persist_dir=INDEX_PATH)
-            return self._mongo.delete_one({"doc_id": doc_id})
+            self._forget_doc(doc_id)
+            self.maybe_persist()
+            deleted_count = self._mongo.delete_one({"doc_id": doc_id})
+            # a meta read before the delete is not cached after this
+            self._doc_meta_cache.invalidate(doc_id)
+            return deleted_count
 
-    def add_doc(self, answer: Answer):
-        """add to both index and mongo"""
+    def add_doc(self, answer: Answer, embedding: Optional[List[float]] = None) -> bool:
+        """
+        add to both index and mongo. `embedding` is the embedding of the question, if it was already computed.
+        returns False if the same question was already indexed, e.g. answered for a request racing with this one
+        """
         with self.lock():
+            # the same question may have just been added by another process
+            self._sync()
             doc = answer.to_llama_index_document()
+            indexed_doc_id = self.find_exact_question(doc.doc_id)
+            if indexed_doc_id is not None:
+                logger.info(f"'{doc.doc_id}' is already indexed as '{indexed_doc_id}', not added again")
+                # its meta may be missing, e.g. removed by /admin/cleanup or by a crash before the upsert below.
+                # an existing meta is kept as it is
+                doc_meta = LlamaIndexDocumentMeta.from_answer(answer).model_copy(
+                    update={"doc_id": indexed_doc_id, "question": indexed_doc_id})
+                if self._mongo.insert_if_absent({"doc_id": indexed_doc_id}, doc_meta):
+                    logger.info(f"Restored the missing meta of '{indexed_doc_id}'")
+                    self._response_cache.invalidate(indexed_doc_id)
+                    self._doc_meta_cache.invalidate(indexed_doc_id)
+                return False
+            doc.embedding = embedding
             self._index.insert(doc)
-            current_time = data_util.get_current_seconds()
-            if current_time - self._last_persist_time >= PERSIST_INTERVAL:
-                self._index.storage_context.persist(persist_dir=INDEX_PATH)
-                self._last_persist_time = current_time
+            self._response_cache.invalidate(doc.doc_id)
+            self._exact_questions[normalize_question(doc.doc_id)] = doc.doc_id
             doc_meta = LlamaIndexDocumentMeta.from_answer(answer)
-            pruned_doc_ids = self._mongo.upsert_one({"doc_id": doc.doc_id}, doc_meta, need_prune=True)
-            if len(pruned_doc_ids) > 0:
-                for pruned_doc_id in pruned_doc_ids:
-                    self._index.delete_ref_doc(pruned_doc_id, delete_from_docstore=True)
-                self._index.storage_context.persist(persist_dir=INDEX_PATH)
+            # the documents beyond the limit are evicted by the eviction job, not by the requests
+            self._mongo.upsert_one({"doc_id": doc.doc_id}, doc_meta)
+            self._doc_meta_cache.invalidate(doc.doc_id)
+            self.maybe_persist()
+            return True
+
+    def evict(self) -> List[str]:
+        """
+        runs in the scheduler: once there are more documents in mongo than DOCUMENT_META_LIMIT, by the estimated
+        count, remove a batch of the user questions ranked first by the eviction policy from both index and mongo.
+        returns their doc ids
+        """
+        return self._evictor.run()
+
+    def _remove_evicted(self, doc_ids: List[str]):
+        with self.lock():
+            self._sync()
+            # the queries see the index without all the evicted docs at once
+            with self._index.vector_store.batch():
+                for doc_id in doc_ids:
+                    self._index.delete_ref_doc(doc_id, delete_from_docstore=True)
+                    self._forget_doc(doc_id)
+            self._mongo.delete_docs(doc_ids)
+            for doc_id in doc_ids:
+                # a meta read before the delete is not cached after this
+                self._doc_meta_cache.invalidate(doc_id)
+            self.maybe_persist()
+
+    def persist(self, force=False):
+        """
+        fold the write-ahead log into a new snapshot, if the index changed since the last one.
+        runs in the scheduler, readers and writers only wait for the rows to be copied, not for the files.
+        """
+        # switches to the snapshot another process sharing the index may have written since the last sync
+        self.sync()
+        vector_store = self._index.vector_store
+        if vector_store.wal.pending_records == 0 and not force:
+            return
+        try:
+            # a snapshot being written by another process contains the changes of this one as well
+            if vector_store.save_snapshot(SNAPSHOT_PATH, blocking=not self._shared) is not None:
+                self._last_persist_time = data_util.get_current_seconds()
+        except Exception as e:
+            # the mutations are still in the log, the next run retries
+            logger.exception(f"Failed to persist index: {e}")
+
+    def maybe_persist(self):
+        # every mutation is durable once it is in the log, so the snapshot is only written to keep the log short
+        if self._index.vector_store.wal.pending_records >= data_consts.INDEX_WAL_COMPACTION_THRESHOLD:
+            job = scheduler.get_job(PERSIST_JOB_ID)
+            if job is not None:
+                job.modify(next_run_time=datetime.now())
+
+    def _flush_query_hits_now(self):
+        job = scheduler.get_job(QUERY_HIT_FLUSH_JOB_ID)
+        if job is not None:
+            job.modify(next_run_time=datetime.now())
+
+    def shutdown(self):
+        """write the last changes to a snapshot and the last query hits, after the scheduler is shut down"""
+        self._query_hits.flush()
+        self.persist()
+        self._index.vector_store.wal.close()
+        self._coalescing_embedding.close()
+
+    def stats(self):
+        return {
+            "size": self._index.vector_store.size,
+            "memory_bytes": self._index.vector_store.memory_bytes(),
+            "pending_wal_records": self._index.vector_store.wal.pending_records,
+            "last_persist_time": self._last_persist_time,
+            "seconds_since_last_persist": data_util.get_current_seconds() - self._last_persist_time,
+        }
+
+    def eviction_stats(self):
+        return {
+            "policy": data_consts.EVICTION_POLICY,
+            "doc_limit": data_consts.DOCUMENT_META_LIMIT,
+            **self._evictor.stats(),
+        }
+
+    def embedding_batch_stats(self):
+        return self._coalescing_embedding.stats()
+
+    @staticmethod
+    def vector_store_config():
+        return {
+            "search_mode": data_consts.VECTOR_SEARCH_MODE,
+            "n_probe": data_consts.VECTOR_SEARCH_N_PROBE,
+            "quantization": data_consts.VECTOR_QUANTIZATION,
+        }
 
     def initialize_index(self) -> Tuple[BaseIndex, DocumentMetaDao]:
         llm = OpenAI(temperature=0.1, model=self._current_model)
         Settings.llm = llm
+        # the queries of concurrent requests which miss the cache are embedded together
+        self._coalescing_embedding = CoalescingEmbedding(
+            OpenAIEmbedding(),
+            window_ms=data_consts.EMBEDDING_BATCH_WINDOW_MS,
+            max_batch_size=data_consts.EMBEDDING_MAX_BATCH_SIZE,
+            timeout=data_consts.API_TIMEOUT,
+        )
+        Settings.embed_model = CachedEmbedding(
+            self._coalescing_embedding,
+            max_size=data_consts.EMBEDDING_CACHE_SIZE,
+            disk_path=EMBEDDING_CACHE_PATH if data_consts.EMBEDDING_CACHE_ON_DISK else None,
+        )
         mongo = DocumentMetaDao()
-        if os.path.exists(INDEX_PATH) and os.path.exists(INDEX_PATH + "/docstore.json"):
-            logger.info(f"Loading index from dir: {INDEX_PATH}")
-            index = load_index_from_storage(
-                StorageContext.from_defaults(persist_dir=INDEX_PATH),
-            )
+        mongo.migrate_query_timestamps()
+        wal = IndexWriteAheadLog(WAL_PATH, fsync=data_consts.INDEX_WAL_FSYNC, shared=self._shared)
+        if snapshot_exists(SNAPSHOT_PATH):
+            logger.info(f"Loading index from snapshot dir: {SNAPSHOT_PATH}")
+            vector_store = NumpyVectorStore.from_snapshot(SNAPSHOT_PATH, **self.vector_store_config())
+            replayed = vector_store.attach_wal(wal)
+            logger.info(f"Replayed {replayed} write-ahead log records on top of the snapshot")
+        elif os.path.exists(INDEX_PATH + "/docstore.json"):
+            # one-time migration from the json files written by llama index's StorageContext.persist
+            logger.info(f"Migrating index from json dir {INDEX_PATH} to snapshot dir {SNAPSHOT_PATH}")
+            vector_store = NumpyVectorStore.from_json_persist_dir(INDEX_PATH, **self.vector_store_config())
+            wal.reset()
+            vector_store.attach_wal(wal)
+            vector_store.save_snapshot(SNAPSHOT_PATH)
         else:
             data_util.assert_true(os.path.exists(CSV_PATH), f"csv file not found: {CSV_PATH}")
-            standard_answers = csv_util.load_standard_answers_from_csv(CSV_PATH)
-            documents = [answer.to_llama_index_document() for answer in standard_answers]
-            index = VectorStoreIndex.from_documents(documents)
-            index.storage_context.persist(persist_dir=INDEX_PATH)
-            doc_metas = [LlamaIndexDocumentMeta.from_answer(answer).model_dump() for answer in standard_answers]
-            mongo.bulk_upsert(doc_metas, primary_keys=["doc_id"])
+            vector_store = NumpyVectorStore(**self.vector_store_config())
+            bootstrap_index(
+                CSV_PATH, vector_store, wal, mongo,
+                checkpoint_path=BOOTSTRAP_CHECKPOINT_PATH,
+                snapshot_root=SNAPSHOT_PATH,
+                batch_size=data_consts.BOOTSTRAP_BATCH_SIZE,
+                concurrency=data_consts.BOOTSTRAP_CONCURRENCY,
+            )
+        index = VectorStoreIndex.from_vector_store(vector_store)
         logger.info(f"Stored docs size: {mongo.doc_size()}")
         return index, mongo
 
@@ -0,0 +1,254 @@
+"""
+write-ahead log of the mutations of NumpyVectorStore.
+
+every insert and delete is appended to the log before it is applied, with the embedding included, so a crash never
+loses an insert and persisting costs as much as the change, not as much as the index.
+the log is a sequence of segment files wal-<sequence>.log. a snapshot records the last segment it contains:
+taking a snapshot closes the current segment, and once the snapshot is written the segments it contains are removed.
+on startup the segments newer than the snapshot are replayed on top of it.
+
+a shared log is written by several processes on the host, e.g. the workers of one server. the appends, rotations
+and removals are serialized by an flock on the LOCK file of the log directory, and every process tails the log: it
+keeps the segment and offset up to which it applied the records, and applies the records the others appended
+before it appends its own, so all the processes apply the mutations in the order of the log.
+
+a record is:
+    uint32 payload length | uint32 crc32 of the payload | payload
+    payload = uint32 meta length | uint32 node length | uint32 vector length | meta json | node record | float32 vector
+a record whose length or crc does not match is a write torn by a crash, replay stops there and cuts it off.
+"""
+import json
+import os
+import struct
+import zlib
+from contextlib import contextmanager
+from threading import RLock
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from llama_index.core.schema import BaseNode
+from app.llama_index_server.index_snapshot import encode_node, decode_node
+from app.utils.file_lock_util import FileLock
+from app.utils.log_util import logger
+
+OP_INSERT = "insert"
+OP_DELETE = "delete"
+OP_DELETE_NODES = "delete_nodes"
+OP_CLEAR = "clear"
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+LOCK_FNAME = "LOCK"
+RECORD_HEADER = struct.Struct("<II")
+PAYLOAD_HEADER = struct.Struct("<III")
+
+
+class WalRecord:
+    def __init__(self, meta: dict, node: Optional[BaseNode] = None, vector: Optional[np.ndarray] = None):
+        self.op: str = meta["op"]
+        self.meta = meta
+        self.node = node
+        self.vector = vector
+
+
+def encode_record(meta: dict, node_record: bytes = b"", vector: Optional[np.ndarray] = None) -> bytes:
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    vector_bytes = np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else b""
+    payload = PAYLOAD_HEADER.pack(len(meta_bytes), len(node_record), len(vector_bytes)) \
+        + meta_bytes + node_record + vector_bytes
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_payload(payload: bytes) -> WalRecord:
+    meta_len, node_len, vector_len = PAYLOAD_HEADER.unpack_from(payload)
+    start = PAYLOAD_HEADER.size
+    meta = json.loads(payload[start:start + meta_len])
+    start += meta_len
+    node = decode_node(payload[start:start + node_len])
+    start += node_len
+    vector = np.frombuffer(payload[start:start + vector_len], dtype=np.float32) if vector_len > 0 else None
+    return WalRecord(meta, node, vector)
+
+
+class IndexWriteAheadLog:
+    def __init__(self, wal_dir: str, fsync: bool = True, shared: bool = False):
+        self._wal_dir = wal_dir
+        self._fsync = fsync
+        self._shared = shared
+        os.makedirs(wal_dir, exist_ok=True)
+        self._lock = FileLock(os.path.join(wal_dir, LOCK_FNAME)) if shared else RLock()
+        with self._lock:
+            sequences = self.segment_sequences()
+            self._sequence = sequences[-1] if len(sequences) > 0 else 1
+            self._file = open(self._segment_path(self._sequence), "ab")
+        # the records up to this offset of segment self._sequence are applied
+        self._offset = self._file.tell()
+        # records appended since the last snapshot
+        self._pending_records = 0
+
+    @property
+    def pending_records(self) -> int:
+        return self._pending_records
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    @property
+    def shared(self) -> bool:
+        return self._shared
+
+    @contextmanager
+    def exclusive(self):
+        """no other thread, and for a shared log no other process, appends to the log in this block"""
+        with self._lock:
+            yield
+
+    def segment_sequences(self) -> List[int]:
+        sequences = []
+        for fname in os.listdir(self._wal_dir):
+            if fname.startswith(SEGMENT_PREFIX) and fname.endswith(SEGMENT_SUFFIX):
+                sequences.append(int(fname[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(sequences)
+
+    def append_inserts(self, node_ids: List[str], ref_doc_ids: List[str], vectors: np.ndarray,
+                       nodes: List[Optional[BaseNode]]):
+        records = [
+            encode_record({"op": OP_INSERT, "node_id": node_id, "ref_doc_id": ref_doc_id}, encode_node(node), vector)
+            for node_id, ref_doc_id, vector, node in zip(node_ids, ref_doc_ids, vectors, nodes)
+        ]
+        self._append(records)
+
+    def append_delete(self, ref_doc_id: str):
+        self._append([encode_record({"op": OP_DELETE, "ref_doc_id": ref_doc_id})])
+
+    def append_delete_nodes(self, node_ids: List[str]):
+        self._append([encode_record({"op": OP_DELETE_NODES, "node_ids": node_ids})])
+
+    def append_clear(self):
+        self._append([encode_record({"op": OP_CLEAR})])
+
+    def rotate(self) -> int:
+        """
+        close the current segment and start a new one. return the sequence of the closed segment.
+        a shared log must be tailed to its end first
+        """
+        with self._lock:
+            closed = self._sequence
+            self._open_segment(self._sequence + 1)
+            self._pending_records = 0
+            return closed
+
+    def remove_segments(self, up_to_sequence: int):
+        """remove the segments which are contained in a snapshot"""
+        with self._lock:
+            for sequence in self.segment_sequences():
+                if sequence <= up_to_sequence and sequence != self._sequence:
+                    os.remove(self._segment_path(sequence))
+
+    def reset(self):
+        """drop the whole log, for an index which is rebuilt from scratch"""
+        with self._lock:
+            sequence = max(self.segment_sequences() + [self._sequence])
+            self._file.close()
+            for other in self.segment_sequences():
+                os.remove(self._segment_path(other))
+            self._open_segment(sequence + 1)
+            self._pending_records = 0
+
+    def records(self, after_sequence: int = 0) -> Iterator[WalRecord]:
+        """
+        the records of the segments newer than `after_sequence`, in the order they were appended.
+        they are all applied once the iteration ends, a shared log is tailed from there
+        """
+        with self._lock:
+            self._pending_records = 0
+            for sequence in self.segment_sequences():
+                if sequence > after_sequence:
+                    self._move_to(sequence)
+                    for record in self._read_segment(sequence):
+                        self._pending_records += 1
+                        yield record
+
+    def tail(self) -> Optional[List[WalRecord]]:
+        """
+        the records of a shared log which were appended by the other processes since the last applied one.
+        None if the segment of the last applied record was folded into a snapshot and removed meanwhile
+        """
+        with self._lock:
+            sequences = self.segment_sequences()
+            if self._sequence not in sequences:
+                return None
+            records = list(self._read_segment(self._sequence, self._offset))
+            self._pending_records += len(records)
+            for sequence in sequences:
+                if sequence > self._sequence:
+                    # another process rotated the log and is writing a snapshot of the segments before
+                    self._move_to(sequence)
+                    segment_records = list(self._read_segment(sequence))
+                    self._pending_records = len(segment_records)
+                    records.extend(segment_records)
+            return records
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        if self._shared:
+            self._lock.close()
+
+    def _append(self, records: List[bytes]):
+        data = b"".join(records)
+        with self._lock:
+            if self._file.name != self._segment_path(self._sequence):
+                # tailed to a segment started by another process
+                self._file.close()
+                self._file = open(self._segment_path(self._sequence), "ab")
+            self._file.write(data)
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+            self._offset += len(data)
+            self._pending_records += len(records)
+
+    def _open_segment(self, sequence: int):
+        self._file.close()
+        self._sequence = sequence
+        self._file = open(self._segment_path(sequence), "ab")
+        self._offset = 0
+
+    def _move_to(self, sequence: int):
+        self._sequence = sequence
+        self._offset = 0
+
+    def _read_segment(self, sequence: int, offset: int = 0) -> Iterator[WalRecord]:
+        """the records from `offset` on, the offset of the last one read is kept if this is the current segment"""
+        path = self._segment_path(sequence)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        start = offset
+        offset = 0
+        while offset < len(data):
+            record, next_offset = self._read_record(data, offset)
+            if record is None:
+                # under the lock no other process is writing, so this is a write torn by a crash
+                logger.warning(f"Cutting off a torn record at offset {start + offset} of {path}")
+                with open(path, "rb+") as f:
+                    f.truncate(start + offset)
+                return
+            offset = next_offset
+            if sequence == self._sequence:
+                self._offset = start + offset
+            yield record
+
+    @staticmethod
+    def _read_record(data: bytes, offset: int) -> Tuple[Optional[WalRecord], int]:
+        if offset + RECORD_HEADER.size > len(data):
+            return None, offset
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return None, offset
+        return decode_payload(payload), start + length
+
+    def _segment_path(self, sequence: int) -> str:
+        return os.path.join(self._wal_dir, f"{SEGMENT_PREFIX}{sequence:08d}{SEGMENT_SUFFIX}")
@@ -30,7 +30,8 @@ class MyQueryEngineTool(QueryEngineTool):
         return tool_output
 
     async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
-        tool_output = super().call(*args, **kwargs)
+        # aquery of the query engine, so the embedding request and the search do not block the event loop
+        tool_output = await super().acall(*args, **kwargs)
         matched_question = get_matched_question(tool_output.raw_output)
         tool_output.content = matched_question
         return tool_output
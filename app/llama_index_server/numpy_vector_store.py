@@ -0,0 +1,824 @@
+import asyncio
+import json
+import os
+from contextlib import contextmanager
+from threading import Lock, RLock
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores.types import (
+    DEFAULT_PERSIST_FNAME,
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from app.llama_index_server.index_snapshot import (
+    Snapshot,
+    NodeSidecar,
+    current_snapshot_dir,
+    open_snapshot,
+    write_snapshot,
+    encode_node,
+    LOCK_FNAME,
+)
+from app.utils.file_lock_util import FileLock
+from app.llama_index_server.index_wal import (
+    IndexWriteAheadLog,
+    WalRecord,
+    OP_INSERT,
+    OP_DELETE,
+    OP_DELETE_NODES,
+    OP_CLEAR,
+)
+
+DEFAULT_VECTOR_STORE = "default"
+NAMESPACE_SEP = "__"
+INITIAL_CAPACITY = 1024
+SEARCH_MODE_EXACT = "exact"
+SEARCH_MODE_IVF = "ivf"
+# below this size an exact scan is as fast as probing an inverted file, so no ivf is trained
+IVF_MIN_TRAIN_SIZE = 4096
+IVF_TRAIN_ITERATIONS = 10
+IVF_TRAIN_SAMPLES_PER_LIST = 64
+QUANTIZATION_NONE = "float32"
+QUANTIZATION_FLOAT16 = "float16"
+QUANTIZATION_INT8 = "int8"
+# max error of a float16 dot product of two unit vectors: 2^-11 relative error per component, doubled for the sums
+FLOAT16_SCORE_ERROR = 2 ** -10
+# float32 rounding of a sum of products, per dimension, the "exact" scores are rounded as well
+FLOAT32_SCORE_ERROR_PER_DIM = 2 ** -23
+# float16 rows are converted to float32 in chunks of this many rows, numpy has no fast float16 matrix product
+SCORE_CHUNK_ROWS = 512
+# a deleted row is only marked dead, the dead rows are dropped once there are more than this many,
+# and more than this share of the rows
+COMPACTION_MIN_DEAD_ROWS = INITIAL_CAPACITY
+COMPACTION_DEAD_RATIO = 0.25
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """l2-normalize along the last axis, so that a dot product equals the cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """indices of the k highest scores, in descending order of score"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations=IVF_TRAIN_ITERATIONS, seed=0) -> np.ndarray:
+    """cluster normalized vectors by cosine similarity, return the normalized centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        one_hot = np.zeros((len(vectors), n_clusters), dtype=np.float32)
+        one_hot[np.arange(len(vectors)), assignments] = 1.0
+        sums = one_hot.T @ vectors
+        # an empty cluster keeps its previous centroid
+        not_empty = one_hot.sum(axis=0) > 0
+        centroids[not_empty] = normalize(sums[not_empty])
+    return centroids
+
+
+def quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """the quantized rows, and for int8 the scale of each row: row ~= scale * quantized row"""
+    if quantization == QUANTIZATION_FLOAT16:
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class IndexVersion:
+    """
+    the rows as the queries see them. a version is never changed: the writers only append rows past its size, and
+    replace the arrays and lists they would change otherwise, so a query reads the current version without the lock
+    """
+
+    def __init__(self, size: int, n_live: int, dim: int, matrix: np.ndarray, live: Optional[np.ndarray],
+                 node_ids: List[str], nodes: List[Union[BaseNode, int, None]], sidecar: Optional[NodeSidecar],
+                 centroids: Optional[np.ndarray], assignments: np.ndarray, quantized: Optional[np.ndarray],
+                 scales: Optional[np.ndarray]):
+        self.size = size
+        self.n_live = n_live
+        self.dim = dim
+        self.matrix = matrix
+        # None if no row is dead
+        self.live = live
+        self.node_ids = node_ids
+        self.nodes = nodes
+        self.sidecar = sidecar
+        self.centroids = centroids
+        self.assignments = assignments
+        self.quantized = quantized
+        self.scales = scales
+
+    def get_node(self, row: int) -> Optional[BaseNode]:
+        node = self.nodes[row]
+        return self.sidecar.get(node) if isinstance(node, int) else node
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    in-memory vector store that keeps all embeddings in one contiguous, pre-normalized float32 matrix.
+
+    compared with llama index's SimpleVectorStore, which computes the similarity against every stored embedding in a
+    python loop, a query here is a single matrix-vector product plus a top-k selection.
+    queries take no lock: every mutation publishes a new immutable version of the rows, see IndexVersion, and a
+    query reads the version current when it starts. a deleted row is only marked dead in a copy of the live mask,
+    an overwritten node is appended as a new row, and the dead rows are dropped in one pass once there are enough of
+    them, or before a snapshot is written. mutations in a batch() are published as one version.
+    the store keeps the nodes as well(stores_text), so the index needs neither a docstore nor an index store.
+    it is persisted as a binary snapshot, see index_snapshot.py. a loaded snapshot stays memory-mapped:
+    its embeddings are not copied and its nodes are only decoded when a query returns them.
+    with a write-ahead log attached, every mutation is appended to the log before it is applied, and a snapshot folds
+    the log into the snapshot files, see index_wal.py.
+    with a shared log, several processes keep the same rows: before a mutation is logged, the mutations the other
+    processes logged meanwhile are applied, and sync applies them in between. a process switches to the snapshot
+    another one wrote, so the float32 rows stay memory-mapped from the same files, whose pages all of them share.
+
+    with search_mode="ivf" the store additionally keeps an inverted file: the rows are clustered around
+    sqrt(size) centroids, and a query only scores the rows of the n_probe closest clusters.
+    new rows are assigned to their closest centroid on insert, and the centroids are retrained whenever
+    the store has doubled in size since the last training.
+
+    with quantization="float16" or "int8"(with a scale per row), a query scans a quantized copy of the rows, which
+    is the only copy that needs to stay in memory: the float32 rows are memory-mapped from the snapshot.
+    every row whose quantized score is within twice the max quantization error of the k-th best one is re-scored at
+    full precision, so the returned rows and similarities are exactly those of a float32 search, and so are the
+    similarity cutoff decisions made on them.
+    """
+    stores_text: bool = True
+    search_mode: str = Field(SEARCH_MODE_EXACT, description="exact or ivf")
+    n_probe: int = Field(16, description="how many clusters a query scores in ivf mode")
+    quantization: str = Field(QUANTIZATION_NONE, description="float32, float16 or int8")
+    rescore: bool = Field(True, description="re-score the best quantized candidates at full precision")
+
+    _lock: RLock = PrivateAttr()
+    _dim: int = PrivateAttr()
+    _size: int = PrivateAttr()
+    _matrix: np.ndarray = PrivateAttr()
+    _node_ids: List[str] = PrivateAttr()
+    _ref_doc_ids: List[str] = PrivateAttr()
+    # a node itself, or the index of its record in the sidecar of the loaded snapshot
+    _nodes: List[Union[BaseNode, int, None]] = PrivateAttr()
+    _sidecar: Optional[NodeSidecar] = PrivateAttr()
+    _node_id_to_row: Dict[str, int] = PrivateAttr()
+    _ref_doc_id_to_node_ids: Dict[str, Set[str]] = PrivateAttr()
+    _centroids: Optional[np.ndarray] = PrivateAttr()
+    _assignments: np.ndarray = PrivateAttr()
+    _trained_size: int = PrivateAttr()
+    _wal: Optional[IndexWriteAheadLog] = PrivateAttr()
+    # the last write-ahead log segment contained in the loaded snapshot
+    _wal_sequence: int = PrivateAttr()
+    _snapshot_root: Optional[str] = PrivateAttr()
+    _snapshot_dir: Optional[str] = PrivateAttr()
+    # the ref doc ids before the first mutation of another process since the last sync
+    _sync_baseline: Optional[Set[str]] = PrivateAttr()
+    _snapshot_lock: Lock = PrivateAttr()
+    # held by the process writing a snapshot of a shared log
+    _host_lock: Optional[FileLock] = PrivateAttr()
+    _quantized: Optional[np.ndarray] = PrivateAttr()
+    _scales: Optional[np.ndarray] = PrivateAttr()
+    # incremented by every change of the rows
+    _mutations: int = PrivateAttr()
+    # whether each row is live, shared with the published version until a row dies
+    _live: np.ndarray = PrivateAttr()
+    _live_shared: bool = PrivateAttr()
+    _dead: int = PrivateAttr()
+    _version: IndexVersion = PrivateAttr()
+    _batch_depth: int = PrivateAttr()
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        if self.search_mode not in (SEARCH_MODE_EXACT, SEARCH_MODE_IVF):
+            raise ValueError(f"Invalid search mode: {self.search_mode}")
+        if self.quantization not in (QUANTIZATION_NONE, QUANTIZATION_FLOAT16, QUANTIZATION_INT8):
+            raise ValueError(f"Invalid quantization: {self.quantization}")
+        self._lock = RLock()
+        self._dim = 0
+        self._size = 0
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._node_ids = []
+        self._ref_doc_ids = []
+        self._nodes = []
+        self._sidecar = None
+        self._node_id_to_row = {}
+        self._ref_doc_id_to_node_ids = {}
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+        self._wal = None
+        self._wal_sequence = 0
+        self._snapshot_root = None
+        self._snapshot_dir = None
+        self._sync_baseline = None
+        self._snapshot_lock = Lock()
+        self._host_lock = None
+        self._quantized = None
+        self._scales = None
+        self._mutations = 0
+        self._live = np.zeros(0, dtype=bool)
+        self._live_shared = False
+        self._dead = 0
+        self._batch_depth = 0
+        self._publish()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def size(self) -> int:
+        # not __len__: llama index tests vector stores for truthiness, an empty store must not be falsy
+        return self._version.n_live
+
+    def get(self, text_id: str) -> List[float]:
+        """get the (normalized) embedding of a node"""
+        with self._lock:
+            return self._matrix[self._node_id_to_row[text_id]].tolist()
+
+    def memory_bytes(self) -> int:
+        """
+        bytes which have to stay in memory: the rows scanned by every query, and the float32 rows if they are neither
+        scanned nor memory-mapped from a snapshot. memory-mapped float32 rows which are only read for re-scoring can
+        be paged out.
+        """
+        with self._lock:
+            if self._quantized is None:
+                return self._matrix[:self._size].nbytes
+            resident = self._quantized[:self._size].nbytes
+            if self._scales is not None:
+                resident += self._scales[:self._size].nbytes
+            if not isinstance(self._matrix, np.memmap):
+                resident += self._matrix[:self._size].nbytes
+            return resident
+
+    def ref_doc_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._ref_doc_id_to_node_ids.keys())
+
+    def ref_doc_embeddings(self, ref_doc_ids: List[str]) -> np.ndarray:
+        """the normalized float32 embeddings of the nodes of the given documents, the unknown ones are skipped"""
+        with self._lock:
+            rows = [self._node_id_to_row[node_id] for ref_doc_id in ref_doc_ids
+                    for node_id in self._ref_doc_id_to_node_ids.get(ref_doc_id, ())]
+            return np.array(self._matrix[rows], dtype=np.float32).reshape(len(rows), self._dim)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if len(nodes) == 0:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        ref_doc_ids = [node.ref_doc_id or "None" for node in nodes]
+        node_ids = [node.node_id for node in nodes]
+        self.add_embeddings(node_ids, ref_doc_ids, embeddings, nodes=nodes)
+        return node_ids
+
+    def add_embeddings(self, node_ids: List[str], ref_doc_ids: List[str], embeddings: np.ndarray,
+                       nodes: Optional[List[BaseNode]] = None):
+        """add raw embeddings in bulk. an existing node id is overwritten"""
+        embeddings = normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(node_ids), -1))
+        nodes = [self._without_embedding(node) for node in nodes] if nodes is not None else [None] * len(node_ids)
+        with self._lock, self._logging():
+            if self._wal is not None:
+                self._wal.append_inserts(node_ids, ref_doc_ids, embeddings, nodes)
+            if self._dim == 0:
+                self._dim = embeddings.shape[1]
+                self._set_matrix(np.zeros((INITIAL_CAPACITY, self._dim), dtype=np.float32))
+            if embeddings.shape[1] != self._dim:
+                raise ValueError(f"embedding dim {embeddings.shape[1]} does not match the store dim {self._dim}")
+            self._mutations += 1
+            for node_id, ref_doc_id, embedding, node in zip(node_ids, ref_doc_ids, embeddings, nodes):
+                row = self._node_id_to_row.get(node_id)
+                if row is not None:
+                    # the published version may still return the old row
+                    self._kill_row(row)
+                row = self._append_row()
+                self._node_ids.append(node_id)
+                self._ref_doc_ids.append(ref_doc_id)
+                self._nodes.append(node)
+                self._node_id_to_row[node_id] = row
+                self._ref_doc_id_to_node_ids.setdefault(ref_doc_id, set()).add(node_id)
+                self._matrix[row] = embedding
+                if self._quantized is not None:
+                    self._quantize_rows(row, row + 1)
+                if self._centroids is not None:
+                    self._assignments[row] = np.argmax(self._centroids @ embedding)
+            if self.search_mode == SEARCH_MODE_IVF and self._n_live >= max(IVF_MIN_TRAIN_SIZE, 2 * self._trained_size):
+                self.train()
+            self._maybe_compact()
+            self._publish()
+
+    def train(self):
+        """(re)build the inverted file from the current rows"""
+        with self._lock:
+            if self._n_live == 0:
+                return
+            live_rows = np.flatnonzero(self._live[:self._size])
+            n_lists = max(1, int(np.sqrt(len(live_rows))))
+            rng = np.random.default_rng(len(live_rows))
+            n_samples = min(len(live_rows), n_lists * IVF_TRAIN_SAMPLES_PER_LIST)
+            samples = self._matrix[rng.choice(live_rows, n_samples, replace=False)]
+            centroids = spherical_kmeans(samples, n_lists)
+            # the published version keeps its centroids with its assignments
+            assignments = np.zeros(len(self._assignments), dtype=np.int32)
+            for start in range(0, self._size, INITIAL_CAPACITY):
+                end = min(start + INITIAL_CAPACITY, self._size)
+                assignments[start:end] = np.argmax(self._matrix[start:end] @ centroids.T, axis=1)
+            self._centroids = centroids
+            self._assignments = assignments
+            self._trained_size = len(live_rows)
+            self._publish()
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock, self._logging():
+            rows = [self._node_id_to_row[node_id] for node_id in self._ref_doc_id_to_node_ids.get(ref_doc_id, ())]
+            if self._wal is not None and len(rows) > 0:
+                self._wal.append_delete(ref_doc_id)
+            for row in rows:
+                self._kill_row(row)
+            self._maybe_compact()
+            self._publish()
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters=None, **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise NotImplementedError("metadata filters are not supported by NumpyVectorStore")
+        with self._lock, self._logging():
+            rows = [self._node_id_to_row[node_id] for node_id in node_ids or [] if node_id in self._node_id_to_row]
+            if self._wal is not None and len(rows) > 0:
+                self._wal.append_delete_nodes([self._node_ids[row] for row in rows])
+            for row in rows:
+                self._kill_row(row)
+            self._maybe_compact()
+            self._publish()
+
+    def clear(self) -> None:
+        with self._lock, self._logging():
+            if self._wal is not None:
+                self._wal.append_clear()
+            self._reset()
+            self._publish()
+
+    def _reset(self):
+        self._mutations += 1
+        self._size = 0
+        self._dead = 0
+        # new arrays, the published version keeps reading the old ones
+        self._set_matrix(np.zeros((0, self._dim), dtype=np.float32))
+        self._node_ids = []
+        self._ref_doc_ids = []
+        self._nodes = []
+        self._node_id_to_row = {}
+        self._ref_doc_id_to_node_ids = {}
+        self._centroids = None
+        self._trained_size = 0
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        if query.filters is not None:
+            raise NotImplementedError("metadata filters are not supported by NumpyVectorStore")
+        query_embedding = normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        version = self._version
+        if version.n_live == 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        # the index struct of a stores_text vector store is empty, so the retriever always passes node_ids=[]
+        if query.node_ids:
+            # the map may already have rows of a newer version
+            rows = [self._node_id_to_row.get(node_id) for node_id in query.node_ids]
+            rows = np.asarray([row for row in rows if row is not None and row < version.size], dtype=np.int64)
+        elif self.search_mode == SEARCH_MODE_IVF and version.centroids is not None:
+            probed = top_k(version.centroids @ query_embedding, self.n_probe)
+            rows = np.flatnonzero(np.isin(version.assignments[:version.size], probed))
+        else:
+            rows = None
+        if version.quantized is None:
+            matrix = version.matrix[:version.size] if rows is None else version.matrix[rows]
+            scores = matrix @ query_embedding
+        else:
+            scores = self._quantized_scores(version, rows, query_embedding)
+        if version.live is not None:
+            # the dead rows are scored with the others, but never returned
+            scores[~(version.live[:version.size] if rows is None else version.live[rows])] = -np.inf
+        if version.quantized is not None and self.rescore:
+            rows, scores = self._rescore(version, rows, scores, query_embedding, query.similarity_top_k)
+        best = top_k(scores, query.similarity_top_k)
+        best = best[scores[best] > -np.inf]
+        similarities = scores[best].tolist()
+        if rows is not None:
+            best = rows[best]
+        ids = [version.node_ids[row] for row in best]
+        nodes = [version.get_node(row) for row in best]
+        # nodes added as raw embeddings have no node to return
+        return VectorStoreQueryResult(nodes=nodes if None not in nodes else None, similarities=similarities, ids=ids)
+
+    async def aquery(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        # a search scans the rows for milliseconds, which must not stall the event loop
+        return await asyncio.to_thread(self.query, query, **kwargs)
+
+    @staticmethod
+    def _quantized_scores(version: IndexVersion, rows: Optional[np.ndarray], query_embedding: np.ndarray) -> np.ndarray:
+        """scores of the quantized rows, all of them if `rows` is None"""
+        quantized = version.quantized[:version.size] if rows is None else version.quantized[rows]
+        if version.scales is not None:
+            # einsum multiplies the int8 rows with the float32 query without converting the rows first,
+            # so it reads a quarter of the bytes of a float32 matrix product, at the same speed
+            scales = version.scales[:version.size] if rows is None else version.scales[rows]
+            return np.einsum("ij,j->i", quantized, query_embedding) * scales
+        scores = np.empty(len(quantized), dtype=np.float32)
+        buffer = np.empty((min(SCORE_CHUNK_ROWS, len(quantized)), version.dim), dtype=np.float32)
+        for start in range(0, len(quantized), SCORE_CHUNK_ROWS):
+            end = min(start + SCORE_CHUNK_ROWS, len(quantized))
+            chunk = buffer[:end - start]
+            np.copyto(chunk, quantized[start:end])
+            scores[start:end] = chunk @ query_embedding
+        return scores
+
+    @staticmethod
+    def _rescore(version: IndexVersion, rows: Optional[np.ndarray], scores: np.ndarray, query_embedding: np.ndarray,
+                 k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        the rows which may be in the exact top k, with their float32 scores.
+        every quantized score is within `error` of the exact one, so the exact k-th best score is at least
+        (k-th best quantized score - error), and a row can only reach it if its quantized score is at least
+        (k-th best quantized score - 2 * error). dead rows, scored -inf, are never candidates.
+        """
+        if len(scores) == 0:
+            return rows, scores
+        if version.scales is not None:
+            # each component is rounded by at most half its row's scale
+            error = np.abs(query_embedding).sum() * version.scales[:version.size].max() / 2
+        else:
+            error = FLOAT16_SCORE_ERROR
+        error += version.dim * FLOAT32_SCORE_ERROR_PER_DIM
+        kth_best = scores[top_k(scores, k)[-1]]
+        candidates = np.flatnonzero((scores >= kth_best - 2 * error) & (scores > -np.inf))
+        rows = candidates if rows is None else rows[candidates]
+        return rows, version.matrix[rows] @ query_embedding
+
+    def save_snapshot(self, snapshot_root: str, blocking=True) -> Optional[str]:
+        """
+        write the current rows as a new binary snapshot, see index_snapshot.py.
+        the rows are copied under the lock, the files are written outside of it.
+        if no row changed meanwhile, the store switches to the new snapshot: its float32 rows become memory-mapped
+        from the new files and its nodes are decoded from there, so neither is kept in memory any more.
+        with a shared log one process writes a snapshot at a time. if another one is writing and not `blocking`,
+        no snapshot is written and None is returned: the other one contains the mutations of this one.
+        """
+        with self._snapshot_lock:
+            host_lock = None
+            if self._wal is not None and self._wal.shared:
+                host_lock = self._host_snapshot_lock(snapshot_root)
+                if not host_lock.acquire(blocking=blocking):
+                    return None
+            try:
+                return self._save_snapshot(snapshot_root)
+            finally:
+                if host_lock is not None:
+                    host_lock.release()
+
+    def _host_snapshot_lock(self, snapshot_root: str) -> FileLock:
+        if self._host_lock is None:
+            self._host_lock = FileLock(os.path.join(snapshot_root, LOCK_FNAME))
+        return self._host_lock
+
+    def _save_snapshot(self, snapshot_root: str) -> str:
+        with self._lock, self._logging():
+            # the snapshot rows are the live rows, in the same order
+            self._compact()
+            self._publish()
+            mutations = self._mutations
+            size = self._size
+            matrix = np.array(self._matrix[:size])
+            node_ids = list(self._node_ids)
+            ref_doc_ids = list(self._ref_doc_ids)
+            nodes = list(self._nodes)
+            sidecar = self._sidecar
+            centroids = self._centroids
+            assignments = np.array(self._assignments[:size]) if centroids is not None else None
+            trained_size = self._trained_size
+            # the mutations from now on go to a new segment, which is not part of this snapshot
+            wal_sequence = self._wal.rotate() if self._wal is not None else self._wal_sequence
+        records = [sidecar.raw(node) if isinstance(node, int) else encode_node(node) for node in nodes]
+        snapshot_dir = write_snapshot(snapshot_root, matrix, node_ids, ref_doc_ids, records,
+                                      centroids=centroids, assignments=assignments, trained_size=trained_size,
+                                      wal_sequence=wal_sequence)
+        if self._wal is not None:
+            self._wal.remove_segments(wal_sequence)
+        with self._lock:
+            self._snapshot_root = snapshot_root
+            if self._mutations == mutations and size > 0:
+                self._switch_to_snapshot(Snapshot(snapshot_dir))
+                self._publish()
+        return snapshot_dir
+
+    @property
+    def wal(self) -> Optional[IndexWriteAheadLog]:
+        return self._wal
+
+    def attach_wal(self, wal: IndexWriteAheadLog) -> int:
+        """replay the log segments newer than the loaded snapshot, then log every following mutation"""
+        with self.batch():
+            self._wal = None
+            replayed = self._replay(wal.records(after_sequence=self._wal_sequence))
+            self._wal = wal
+            self._sync_baseline = None
+            return replayed
+
+    def sync(self) -> Tuple[Set[str], Set[str]]:
+        """
+        for a shared log: apply the mutations the other processes logged since the last ones applied here, after
+        switching to the snapshot another process wrote, if any. return the ref doc ids added and removed since the
+        last sync, including those of the mutations applied before a mutation of this process
+        """
+        with self.batch():
+            with self._wal.exclusive():
+                snapshot_dir = current_snapshot_dir(self._snapshot_root) if self._snapshot_root else None
+                if snapshot_dir is not None and snapshot_dir != self._snapshot_dir:
+                    self._replay(self._reload_snapshot())
+                else:
+                    self._catch_up()
+            if self._sync_baseline is None:
+                return set(), set()
+            ref_doc_ids = set(self._ref_doc_id_to_node_ids)
+            added, removed = ref_doc_ids - self._sync_baseline, self._sync_baseline - ref_doc_ids
+            self._sync_baseline = None
+            return added, removed
+
+    @contextmanager
+    def _logging(self):
+        """around a mutation which is logged: a shared log is tailed first, so the mutations are applied in its order"""
+        if self._wal is None:
+            yield
+            return
+        with self._wal.exclusive():
+            if self._wal.shared:
+                self._catch_up()
+            yield
+
+    def _catch_up(self):
+        with self.batch():
+            records = self._wal.tail()
+            if records is None:
+                # another process folded the segment into a snapshot and removed it, which has all the records
+                # applied here and the following ones
+                records = self._reload_snapshot()
+            self._replay(records)
+
+    @contextmanager
+    def batch(self):
+        """the mutations in the block are published as one version when it ends, so their copies are made once"""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                self._publish()
+
+    def _publish(self):
+        if self._batch_depth > 0:
+            return
+        # a row dying from now on is marked in a copy of the mask
+        self._live_shared = True
+        self._version = IndexVersion(
+            size=self._size,
+            n_live=self._n_live,
+            dim=self._dim,
+            matrix=self._matrix,
+            live=self._live if self._dead > 0 else None,
+            node_ids=self._node_ids,
+            nodes=self._nodes,
+            sidecar=self._sidecar,
+            centroids=self._centroids,
+            assignments=self._assignments,
+            quantized=self._quantized,
+            scales=self._scales,
+        )
+
+    @property
+    def _n_live(self) -> int:
+        return self._size - self._dead
+
+    def _reload_snapshot(self) -> Iterator[WalRecord]:
+        """replace the rows with those of the current snapshot, return the log records to replay on top of it"""
+        if self._sync_baseline is None:
+            self._sync_baseline = set(self._ref_doc_id_to_node_ids)
+        while True:
+            try:
+                snapshot = open_snapshot(self._snapshot_root) if self._snapshot_root else None
+                break
+            except FileNotFoundError:
+                # removed by a process which has just written a newer one
+                continue
+        if snapshot is None:
+            raise ValueError(f"the write-ahead log was compacted, but there is no snapshot in {self._snapshot_root}")
+        self._reset()
+        self._load_snapshot(snapshot)
+        return self._wal.records(after_sequence=self._wal_sequence)
+
+    def _replay(self, records: Iterable[WalRecord]) -> int:
+        """apply mutations which are already logged"""
+        wal, self._wal = self._wal, None
+        replayed = 0
+        try:
+            for record in records:
+                if self._sync_baseline is None:
+                    self._sync_baseline = set(self._ref_doc_id_to_node_ids)
+                self._apply(record)
+                replayed += 1
+        finally:
+            self._wal = wal
+        return replayed
+
+    def _apply(self, record: WalRecord):
+        if record.op == OP_INSERT:
+            self.add_embeddings([record.meta["node_id"]], [record.meta["ref_doc_id"]], record.vector[None, :],
+                                nodes=[record.node])
+        elif record.op == OP_DELETE:
+            self.delete(record.meta["ref_doc_id"])
+        elif record.op == OP_DELETE_NODES:
+            self.delete_nodes(record.meta["node_ids"])
+        elif record.op == OP_CLEAR:
+            self.clear()
+        else:
+            raise ValueError(f"Invalid write-ahead log record: {record.op}")
+
+    @classmethod
+    def from_snapshot(cls, snapshot_root: str, **kwargs: Any) -> "NumpyVectorStore":
+        vector_store = cls(**kwargs)
+        snapshot = open_snapshot(snapshot_root)
+        if snapshot is not None and snapshot.size > 0:
+            vector_store._load_snapshot(snapshot)
+            vector_store._publish()
+        elif snapshot is not None:
+            vector_store._wal_sequence = snapshot.wal_sequence
+            vector_store._snapshot_dir = snapshot.snapshot_dir
+        vector_store._snapshot_root = snapshot_root
+        return vector_store
+
+    @classmethod
+    def from_json_persist_dir(cls, persist_dir: str, **kwargs: Any) -> "NumpyVectorStore":
+        """
+        one-time migration from the json files that llama index's StorageContext.persist writes:
+        the embeddings come from the default vector store json, the nodes from docstore.json
+        """
+        vector_store = cls(**kwargs)
+        with open(os.path.join(persist_dir, f"{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}")) as f:
+            data = json.load(f)
+        embedding_dict = data.get("embedding_dict", {})
+        if len(embedding_dict) > 0:
+            docstore = SimpleDocumentStore.from_persist_dir(persist_dir)
+            node_ids = list(embedding_dict.keys())
+            text_id_to_ref_doc_id = data.get("text_id_to_ref_doc_id", {})
+            ref_doc_ids = [text_id_to_ref_doc_id.get(node_id, "None") for node_id in node_ids]
+            nodes = [docstore.get_node(node_id) for node_id in node_ids]
+            vector_store.add_embeddings(node_ids, ref_doc_ids, np.asarray(list(embedding_dict.values())), nodes=nodes)
+        return vector_store
+
+    def _switch_to_snapshot(self, snapshot: Snapshot):
+        # the rows are the same, only where they are kept changes. _set_matrix copies the per-row arrays
+        self._set_matrix(snapshot.matrix)
+        self._nodes = list(range(self._size))
+        self._sidecar = snapshot.sidecar
+        self._wal_sequence = snapshot.wal_sequence
+        self._snapshot_dir = snapshot.snapshot_dir
+
+    def _load_snapshot(self, snapshot: Snapshot):
+        with self._lock:
+            self._dim = snapshot.dim
+            self._set_matrix(snapshot.matrix)
+            self._size = snapshot.size
+            self._dead = 0
+            self._live[:self._size] = True
+            if self._quantized is not None:
+                self._quantize_rows(0, self._size)
+            self._node_ids = list(snapshot.node_ids)
+            self._ref_doc_ids = list(snapshot.ref_doc_ids)
+            self._nodes = list(range(snapshot.size))
+            self._sidecar = snapshot.sidecar
+            self._wal_sequence = snapshot.wal_sequence
+            self._snapshot_dir = snapshot.snapshot_dir
+            self._node_id_to_row = {node_id: row for row, node_id in enumerate(self._node_ids)}
+            self._ref_doc_id_to_node_ids = {}
+            for node_id, ref_doc_id in zip(self._node_ids, self._ref_doc_ids):
+                self._ref_doc_id_to_node_ids.setdefault(ref_doc_id, set()).add(node_id)
+            if self.search_mode == SEARCH_MODE_IVF and snapshot.centroids is not None:
+                self._centroids = snapshot.centroids
+                self._assignments[:self._size] = snapshot.assignments
+                self._trained_size = snapshot.trained_size
+            elif self.search_mode == SEARCH_MODE_IVF and self._size >= IVF_MIN_TRAIN_SIZE:
+                self.train()
+
+    @staticmethod
+    def _without_embedding(node: Optional[BaseNode]) -> Optional[BaseNode]:
+        # the embedding is kept in the matrix only
+        if node is None or node.embedding is None:
+            return node
+        node = node.copy()
+        node.embedding = None
+        return node
+
+    def _set_matrix(self, matrix: np.ndarray):
+        """use `matrix` as the float32 rows, and resize the per-row arrays to its capacity"""
+        capacity = len(matrix)
+        size = min(self._size, capacity)
+        self._matrix = matrix
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:size] = self._assignments[:size]
+        self._assignments = assignments
+        live = np.zeros(capacity, dtype=bool)
+        live[:size] = self._live[:size]
+        self._live = live
+        self._live_shared = False
+        if self.quantization == QUANTIZATION_NONE:
+            return
+        dtype = np.float16 if self.quantization == QUANTIZATION_FLOAT16 else np.int8
+        quantized = np.zeros((capacity, self._dim), dtype=dtype)
+        if self._quantized is not None:
+            quantized[:size] = self._quantized[:size]
+        self._quantized = quantized
+        if self.quantization == QUANTIZATION_INT8:
+            scales = np.ones(capacity, dtype=np.float32)
+            if self._scales is not None:
+                scales[:size] = self._scales[:size]
+            self._scales = scales
+
+    def _quantize_rows(self, start: int, end: int):
+        for chunk_start in range(start, end, SCORE_CHUNK_ROWS):
+            chunk_end = min(chunk_start + SCORE_CHUNK_ROWS, end)
+            quantized, scales = quantize(np.asarray(self._matrix[chunk_start:chunk_end]), self.quantization)
+            self._quantized[chunk_start:chunk_end] = quantized
+            if scales is not None:
+                self._scales[chunk_start:chunk_end] = scales
+
+    def _append_row(self) -> int:
+        if self._size == len(self._matrix):
+            grown = np.zeros((max(INITIAL_CAPACITY, 2 * len(self._matrix)), self._dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._set_matrix(grown)
+        # past the size of the published version, which does not read it
+        self._live[self._size] = True
+        self._size += 1
+        return self._size - 1
+
+    def _kill_row(self, row: int):
+        if self._live_shared:
+            self._live = self._live.copy()
+            self._live_shared = False
+        self._live[row] = False
+        self._dead += 1
+        self._mutations += 1
+        node_id = self._node_ids[row]
+        del self._node_id_to_row[node_id]
+        self._unlink_ref_doc(node_id, self._ref_doc_ids[row])
+
+    def _maybe_compact(self):
+        if self._dead > max(COMPACTION_MIN_DEAD_ROWS, COMPACTION_DEAD_RATIO * self._size):
+            self._compact()
+
+    def _compact(self):
+        """move the live rows into new dense arrays, the published version keeps the old ones"""
+        if self._dead == 0:
+            return
+        rows = np.flatnonzero(self._live[:self._size])
+        n_live = len(rows)
+        assignments = self._assignments[rows]
+        quantized = self._quantized[rows] if self._quantized is not None else None
+        scales = self._scales[rows] if self._scales is not None else None
+        matrix = np.zeros((n_live + max(INITIAL_CAPACITY, n_live // 4), self._dim), dtype=np.float32)
+        matrix[:n_live] = self._matrix[rows]
+        self._size = 0
+        self._set_matrix(matrix)
+        self._size = n_live
+        self._dead = 0
+        self._live[:n_live] = True
+        self._assignments[:n_live] = assignments
+        if quantized is not None:
+            self._quantized[:n_live] = quantized
+        if scales is not None:
+            self._scales[:n_live] = scales
+        self._node_ids = [self._node_ids[row] for row in rows]
+        self._ref_doc_ids = [self._ref_doc_ids[row] for row in rows]
+        self._nodes = [self._nodes[row] for row in rows]
+        self._node_id_to_row = {node_id: row for row, node_id in enumerate(self._node_ids)}
+        self._mutations += 1
+
+    def _unlink_ref_doc(self, node_id: str, ref_doc_id: str):
+        node_ids = self._ref_doc_id_to_node_ids.get(ref_doc_id)
+        if node_ids is not None:
+            node_ids.discard(node_id)
+            if len(node_ids) == 0:
+                del self._ref_doc_id_to_node_ids[ref_doc_id]
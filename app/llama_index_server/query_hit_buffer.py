@@ -0,0 +1,100 @@
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.utils.data_util import milliseconds_to_day
+from app.utils.log_util import logger
+from app.utils.metrics_util import Histogram, MILLISECONDS_BUCKETS, SIZE_BUCKETS
+
+# (doc_id, day) -> [number of hits, timestamp of the last hit]
+PendingHits = Dict[Tuple[str, int], List[int]]
+
+
+class QueryHitBuffer:
+    """
+    write-behind buffer for the query hits of the documents. record() only counts a hit in memory, per document and
+    day, and flush() hands the counts gathered since the last flush to `write`, which stores them with one bulk write.
+    at most `max_pending` (document, day) pairs are pending: once they are all taken, `on_full` is called to flush
+    early, and the hits of other documents are dropped(and counted) until the flush.
+    a failed flush is retried by the next one, so the hits of a partially applied batch may be counted twice.
+    """
+
+    def __init__(self, write: Callable[[PendingHits], Any], max_pending: int = 10000,
+                 on_full: Optional[Callable[[], Any]] = None):
+        self._write = write
+        self._max_pending = max_pending
+        self._on_full = on_full
+        self._lock = Lock()
+        # one flush at a time, the final one waits for a running one
+        self._flush_lock = Lock()
+        self._pending: PendingHits = {}
+        self._full = False
+        self._recorded = 0
+        self._dropped = 0
+        self._flushed = 0
+        self._failed_flushes = 0
+        self._batch_sizes = Histogram(SIZE_BUCKETS)
+        self._flush_latencies = Histogram(MILLISECONDS_BUCKETS)
+
+    def record(self, doc_id: str, timestamp: int) -> bool:
+        """count a hit of the document, False if it was dropped because the buffer is full"""
+        with self._lock:
+            was_full = self._full
+            if not self._add(doc_id, milliseconds_to_day(timestamp), 1, timestamp):
+                self._dropped += 1
+                return False
+            self._recorded += 1
+            became_full = self._full and not was_full
+        if became_full and self._on_full is not None:
+            self._on_full()
+        return True
+
+    def flush(self) -> int:
+        """write the pending hits, returns the number of (document, day) pairs written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._full = False
+            if len(pending) == 0:
+                return 0
+            start = time.perf_counter()
+            try:
+                self._write(pending)
+            except Exception as e:
+                logger.exception(f"Failed to flush {len(pending)} query hits: {e}")
+                with self._lock:
+                    self._failed_flushes += 1
+                    for (doc_id, day), (count, last_timestamp) in pending.items():
+                        if not self._add(doc_id, day, count, last_timestamp):
+                            self._dropped += count
+                return 0
+            self._flush_latencies.observe((time.perf_counter() - start) * 1000)
+            self._batch_sizes.observe(len(pending))
+            with self._lock:
+                self._flushed += sum(count for count, _ in pending.values())
+            return len(pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "pending": len(self._pending),
+                "recorded": self._recorded,
+                "dropped": self._dropped,
+                "flushed": self._flushed,
+                "failed_flushes": self._failed_flushes,
+            }
+        stats["batch_size"] = self._batch_sizes.to_dict()
+        stats["flush_ms"] = self._flush_latencies.to_dict()
+        return stats
+
+    def _add(self, doc_id: str, day: int, count: int, last_timestamp: int) -> bool:
+        """count hits under the lock, False if they are dropped. the hits of a pending pair are always counted"""
+        hits = self._pending.get((doc_id, day))
+        if hits is not None:
+            hits[0] += count
+            hits[1] = max(hits[1], last_timestamp)
+            return True
+        if self._full:
+            return False
+        self._pending[(doc_id, day)] = [count, last_timestamp]
+        self._full = len(self._pending) >= self._max_pending
+        return True
@@ -0,0 +1,99 @@
+import json
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional, Set, Tuple
+
+# stands for the asked question in a cached response body, each asker gets the body with their own question
+QUESTION_PLACEHOLDER = "\u0000question\u0000"
+PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_question(text: str) -> str:
+    """fold case, whitespace and punctuation, so `How do I putt?` and `how do i  putt` are the same question"""
+    return " ".join(PUNCTUATION.sub(" ", text).split()).casefold()
+
+
+class ResponseCache:
+    """
+    serialized /qa/query response bodies, keyed on the normalized question.
+    an entry belongs to the document it was answered from, and is invalidated when that document is changed or
+    removed. the changes made by other processes are seen after at most `ttl_seconds`, when the entry expires.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._lock = Lock()
+        # normalized question -> (doc_id, body before the question, body after the question, monotonic time when put)
+        self._entries: "OrderedDict[str, Tuple[str, bytes, bytes, float]]" = OrderedDict()
+        self._keys_of_doc: Dict[str, Set[str]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, question: str) -> Optional[Tuple[str, bytes]]:
+        """the doc_id and the response body for the question, if cached"""
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[3] > self._ttl:
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        doc_id, prefix, suffix, _ = entry
+        return doc_id, prefix + json.dumps(question, ensure_ascii=False).encode("utf-8") + suffix
+
+    def put(self, question: str, doc_id: str, body: str):
+        """`body` is the serialized response, with QUESTION_PLACEHOLDER as the question"""
+        if self._max_size <= 0:
+            return
+        prefix, suffix = body.encode("utf-8").split(json.dumps(QUESTION_PLACEHOLDER).encode("utf-8"), 1)
+        key = normalize_question(question)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (doc_id, prefix, suffix, time.monotonic())
+            self._keys_of_doc.setdefault(doc_id, set()).add(key)
+            while len(self._entries) > self._max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, doc_id: str):
+        with self._lock:
+            keys = self._keys_of_doc.pop(doc_id, set())
+            for key in keys:
+                del self._entries[key]
+            self._invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_of_doc.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "ttl_seconds": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+                "hit_rate": self._hits / lookups if lookups > 0 else 0.0,
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_of_doc[entry[0]]
+            keys.discard(key)
+            if len(keys) == 0:
+                del self._keys_of_doc[entry[0]]
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    concurrent calls with the same key share one execution: the first call starts it, the following ones wait for it.
+    the execution runs in a task of its own, so a caller which times out or is cancelled does not cancel it for the
+    other callers. not thread safe, all the calls must be made from the same event loop.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._executions = 0
+        self._shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """the result of `fn`, and whether it was shared with an execution started by another call"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self._shared += 1
+        else:
+            self._executions += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), shared
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._tasks),
+            "executions": self._executions,
+            "shared": self._shared,
+        }
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
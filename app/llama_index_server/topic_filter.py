@@ -0,0 +1,77 @@
+from typing import Any, Dict, List, Sequence
+import numpy as np
+from app.llama_index_server.numpy_vector_store import normalize
+
+
+class TopicFilter:
+    """
+    tells whether a question is about the topic of the knowledge base from its embedding, without asking the llm.
+
+    the relevance score of a question is the mean similarity to its `k` nearest knowledge base questions, a question
+    scoring below `threshold` is off-topic. only the standard questions from the csv file are compared to, so an
+    off-topic question which was answered before never widens the topic. a threshold of 0 turns the filter off.
+    """
+
+    def __init__(self, embeddings: np.ndarray, threshold: float, k: int = 1):
+        self._embeddings = normalize(np.asarray(embeddings, dtype=np.float32))
+        self._threshold = threshold
+        self._k = max(1, min(k, len(self._embeddings)))
+        self._rejected = 0
+        self._accepted = 0
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    def scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        similarities = normalize(np.asarray(query_embeddings, dtype=np.float32)) @ self._embeddings.T
+        nearest = -np.partition(-similarities, self._k - 1, axis=1)[:, :self._k]
+        return nearest.mean(axis=1)
+
+    def score(self, query_embedding: Sequence[float]) -> float:
+        return float(self.scores(np.asarray(query_embedding)[None, :])[0])
+
+    def is_relevant(self, query_embedding: Sequence[float]) -> bool:
+        if self._threshold <= 0 or len(self._embeddings) == 0:
+            return True
+        relevant = self.score(query_embedding) >= self._threshold
+        if relevant:
+            self._accepted += 1
+        else:
+            self._rejected += 1
+        return relevant
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self._threshold,
+            "knowledge_base_size": len(self._embeddings),
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+        }
+
+
+def evaluate(scores: np.ndarray, relevant: np.ndarray, thresholds: Sequence[float]) -> List[Dict[str, float]]:
+    """
+    precision and recall of the off-topic rejections at each threshold, for labelled questions.
+    `relevant_pass_rate` is the share of the on-topic questions which still reach the llm, it should stay close to 1
+    """
+    relevant = np.asarray(relevant, dtype=bool)
+    results = []
+    for threshold in thresholds:
+        rejected = scores < threshold
+        true_rejections = np.sum(rejected & ~relevant)
+        results.append({
+            "threshold": threshold,
+            "precision": float(true_rejections / max(1, np.sum(rejected))),
+            "recall": float(true_rejections / max(1, np.sum(~relevant))),
+            "relevant_pass_rate": float(np.sum(~rejected & relevant) / max(1, np.sum(relevant))),
+        })
+    return results
+
+
+def calibrate(scores: np.ndarray, relevant: np.ndarray, relevant_pass_rate: float = 0.99) -> float:
+    """the highest threshold which lets at least `relevant_pass_rate` of the on-topic questions through"""
+    relevant_scores = np.sort(np.asarray(scores)[np.asarray(relevant, dtype=bool)])
+    if len(relevant_scores) == 0:
+        return 0.0
+    return float(relevant_scores[int(np.floor((1 - relevant_pass_rate) * len(relevant_scores)))])
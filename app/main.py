@@ -9,6 +9,7 @@ from openai import OpenAIError
 from app.routers.qa import qa_router
 from app.routers.admin import admin_router
 from app.routers.chatbot import chatbot_router
+from app.llama_index_server import index_server
 from app.utils.log_util import logger
 import uvicorn
 import time
@@ -43,6 +44,17 @@ async def add_response_timing_header(request: Request, call_next):
     return response
 
 
+@app.on_event("startup")
+async def startup():
+    await index_server.startup()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    logger.info("Shutting down api server")
+    index_server.shutdown()
+
+
 # Remove 422 error in the api docs
 patch_openapi(app)
 prefix = "/api/v1"
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Path, Depends
 from fastapi.security import HTTPBasicCredentials
 from app.data.messages.qa import DeleteDocumentResponse
+from app.data.messages.admin import StatsResponse
 from app.llama_index_server import index_server
 from app.utils.log_util import logger
 from app.utils import auth_util
@@ -19,7 +20,7 @@ admin_router = APIRouter(
 async def delete_doc(doc_id: str = Path(..., title="The ID of the document to delete"),
                      credentials: HTTPBasicCredentials = Depends(auth_util.verify_credentials)):
     logger.info(f"Delete doc for {doc_id}")
-    deleted_count = index_server.delete_doc(doc_id)
+    deleted_count = await index_server.delete_doc(doc_id)
     return DeleteDocumentResponse(msg=f"Deleting {doc_id}. Deleted count = {deleted_count}")
 
 
@@ -30,5 +31,14 @@ async def delete_doc(doc_id: str = Path(..., title="The ID of the document to de
 )
 async def cleanup_for_test(credentials: HTTPBasicCredentials = Depends(auth_util.verify_credentials)):
     logger.info(f"Cleanup for test")
-    index_server.cleanup_for_test()
+    await index_server.cleanup_for_test()
     return DeleteDocumentResponse(msg=f"Successfully cleanup")
+
+
+@admin_router.get(
+    "/stats",
+    response_model=StatsResponse,
+    description="runtime statistics, e.g. the index size and the seconds since the index was last persisted",
+)
+async def get_stats(credentials: HTTPBasicCredentials = Depends(auth_util.verify_credentials)):
+    return StatsResponse(data=index_server.get_stats())
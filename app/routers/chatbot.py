@@ -1,9 +1,14 @@
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 import asyncio
+import json
+from openai import OpenAIError
 from app.data.messages.chat import ChatRequest, ChatResponse
 from app.llama_index_server import index_server
 from app.utils.log_util import logger
+from app.utils.sse_util import to_server_sent_event, to_error_event
 from app.utils.data_consts import API_TIMEOUT
+from app.data.models.mongodb import Message
 
 chatbot_router = APIRouter(
     prefix="/chat",
@@ -20,3 +25,29 @@ async def chat(request: ChatRequest):
     conversation_id = request.conversation_id
     message = await asyncio.wait_for(index_server.chat(request.content, conversation_id), timeout=API_TIMEOUT)
     return ChatResponse(data=message)
+
+
+async def stream_chat_events(request: ChatRequest):
+    try:
+        async for item in index_server.stream_chat(request.content, request.conversation_id):
+            if isinstance(item, Message):
+                yield to_server_sent_event("done", ChatResponse(data=item).model_dump_json())
+            else:
+                yield to_server_sent_event("delta", json.dumps({"content": item}))
+    except (OpenAIError, asyncio.TimeoutError) as e:
+        logger.error(f"Streaming chat failed: {e}")
+        yield to_error_event(e)
+
+
+@chatbot_router.post(
+    "/streaming",
+    description="Chat with the ai bot in a streaming way. the answer is sent as server-sent events: a `delta` event "
+                "for each piece of the answer as it is generated, then a `done` event with the saved message, "
+                "or an `error` event. if the client disconnects, the generation is cancelled")
+async def streaming_chat(request: ChatRequest):
+    logger.info("Streaming chat")
+    return StreamingResponse(
+        stream_chat_events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
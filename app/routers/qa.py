@@ -1,5 +1,8 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
+from fastapi.responses import StreamingResponse
 import asyncio
+import json
+from openai import OpenAIError
 from app.data.messages.qa import (
     QuestionAnsweringRequest,
     QuestionAnsweringResponse,
@@ -7,7 +10,9 @@ from app.data.messages.qa import (
     DocumentResponse,
 )
 from app.llama_index_server import index_server
+from app.data.models.qa import Answer
 from app.utils.log_util import logger
+from app.utils.sse_util import to_server_sent_event, to_error_event
 from app.utils.data_consts import API_TIMEOUT
 
 qa_router = APIRouter(
@@ -26,10 +31,46 @@ qa_router = APIRouter(
 async def answer_question(req: QuestionAnsweringRequest):
     logger.info("answer question from user")
     query_text = req.question
+    cached_response = index_server.get_cached_response(query_text)
+    if cached_response is not None:
+        return Response(content=cached_response, media_type="application/json")
     answer = await asyncio.wait_for(index_server.query_index(query_text), timeout=API_TIMEOUT)
+    index_server.cache_response(answer)
     return QuestionAnsweringResponse(data=answer)
 
 
+async def stream_answer_events(query_text):
+    cached_response = index_server.get_cached_response(query_text)
+    if cached_response is not None:
+        yield to_server_sent_event("done", cached_response.decode())
+        return
+    try:
+        async for item in index_server.stream_query_index(query_text):
+            if isinstance(item, Answer):
+                index_server.cache_response(item)
+                yield to_server_sent_event("done", QuestionAnsweringResponse(data=item).model_dump_json())
+            else:
+                yield to_server_sent_event("delta", json.dumps({"content": item}))
+    except (OpenAIError, asyncio.TimeoutError) as e:
+        logger.error(f"Streaming answer failed: {e}")
+        yield to_error_event(e)
+
+
+@qa_router.post(
+    "/query/streaming",
+    description="same as /query, as server-sent events. a standard answer is sent at once as a `done` event. an answer "
+                "from chatgpt is sent as a `delta` event for each piece of it as it is generated, then a `done` event "
+                "with the complete answer. an error is sent as an `error` event",
+)
+async def answer_question_streaming(req: QuestionAnsweringRequest):
+    logger.info("answer question from user, streaming")
+    return StreamingResponse(
+        stream_answer_events(req.question),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @qa_router.post(
     "/document",
     response_model=DocumentResponse,
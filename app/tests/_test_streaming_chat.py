@@ -9,5 +9,5 @@ body = {
 }
 
 with requests.post(url, data=json.dumps(body), stream=True) as r:
-    for chunk in r.iter_content(1024):  # or, for line in r.iter_lines():
-        print(chunk)
+    for line in r.iter_lines(decode_unicode=True):  # server-sent events: "event: delta" / "data: {...}" lines
+        print(line)
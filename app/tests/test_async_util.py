@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.async_util import call_in_executor, iterate_in_executor, run_in_background
+
+
+class IterateInExecutorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.closed = threading.Event()
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def tokens(self, delay):
+        try:
+            for i in range(5):
+                time.sleep(delay)
+                yield f"token {i}"
+        finally:
+            self.closed.set()
+
+    async def test_items_in_order(self):
+        items = [item async for item in iterate_in_executor(self.executor, self.tokens(0.001))]
+        self.assertEqual(items, [f"token {i}" for i in range(5)])
+
+    async def test_closed_when_the_consumer_stops(self):
+        async def consume():
+            async for _ in iterate_in_executor(self.executor, self.tokens(0.05)):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.07)
+        # like a client disconnecting while the next token is being read
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, self.closed.wait, 1))
+
+    async def test_timeout_between_items(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            async for _ in iterate_in_executor(self.executor, self.tokens(0.2), timeout=0.05):
+                pass
+
+
+class CallInExecutorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_result_of_an_abandoned_call_is_released(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        released = threading.Event()
+
+        def start_stream():
+            time.sleep(0.1)
+            return released
+
+        self.assertIs(await call_in_executor(executor, lambda: released, timeout=1, release=lambda e: e.set()),
+                      released)
+        self.assertFalse(released.is_set())
+        with self.assertRaises(asyncio.TimeoutError):
+            await call_in_executor(executor, start_stream, timeout=0.01, release=lambda e: e.set())
+        self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, released.wait, 1))
+        executor.shutdown(wait=True)
+
+
+class RunInBackgroundTest(unittest.IsolatedAsyncioTestCase):
+    async def test_runs_to_completion_and_logs_failures(self):
+        done = asyncio.Event()
+
+        async def write():
+            await asyncio.sleep(0.01)
+            done.set()
+
+        async def fail():
+            raise ValueError("mongo is down")
+
+        run_in_background(write())
+        with self.assertLogs("app.utils.log_util", level="ERROR") as logs:
+            await asyncio.wait([run_in_background(fail(), name="record_query")])
+            await asyncio.sleep(0)
+        await asyncio.wait_for(done.wait(), timeout=1)
+        self.assertIn("record_query", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import atexit
 import unittest
 from fastapi.testclient import TestClient
 import base64
@@ -10,9 +11,14 @@ from app.data.models.qa import Source
 from app.utils import data_consts
 from app.llama_index_server.chat_message_dao import ChatMessageDao
 
+# entered once for all the tests: the app starts up once, and every request runs in the same event loop, to which
+# the async daos opened on startup are bound
+client = TestClient(app=app).__enter__()
+atexit.register(client.__exit__, None, None, None)
+
 
 class BaseTest(unittest.TestCase):
-    client = TestClient(app=app)
+    client = client
     ROOT = "/api/v1"
     ROUTER_QA = "qa"
     ROUTER_ADMIN = "admin"
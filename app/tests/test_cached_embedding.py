@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from typing import List
+from llama_index.core import MockEmbedding
+from app.llama_index_server.cached_embedding import CachedEmbedding
+
+
+class CountingEmbedding(MockEmbedding):
+    calls: List[str] = []
+
+    def _get_vector(self) -> List[float]:
+        return [float(len(self.calls))] * self.embed_dim
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self.calls.append(query)
+        return self._get_vector()
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self.calls.append(text)
+        return self._get_vector()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+class CachedEmbeddingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.disk_path = os.path.join(self.tmp_dir.name, "embeddings.sqlite")
+        self.wrapped = CountingEmbedding(embed_dim=4, calls=[])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_memory_tier(self):
+        embed_model = CachedEmbedding(self.wrapped, max_size=2)
+        first = embed_model.get_query_embedding("How do I putt?")
+        self.assertEqual(embed_model.get_query_embedding("  how do i   PUTT? "), first)
+        self.assertEqual(len(self.wrapped.calls), 1)
+        # queries and texts are cached separately
+        embed_model.get_text_embedding("How do I putt?")
+        self.assertEqual(len(self.wrapped.calls), 2)
+        # the least recently used entry is evicted
+        embed_model.get_query_embedding("How do I chip?")
+        embed_model.get_query_embedding("How do I putt?")
+        self.assertEqual(len(self.wrapped.calls), 4)
+        self.assertEqual(embed_model.stats()["hits"], 1)
+        self.assertEqual(embed_model.stats()["misses"], 4)
+
+    def test_text_batch(self):
+        embed_model = CachedEmbedding(self.wrapped)
+        embed_model.get_text_embedding("b")
+        embeddings = embed_model.get_text_embedding_batch(["a", "b", "c"])
+        self.assertEqual(self.wrapped.calls, ["b", "a", "c"])
+        self.assertEqual(embeddings[1], embed_model.get_text_embedding("b"))
+        asyncio.run(embed_model.aget_text_embedding_batch(["a", "d"]))
+        self.assertEqual(self.wrapped.calls, ["b", "a", "c", "d"])
+
+    def test_disk_tier(self):
+        embed_model = CachedEmbedding(self.wrapped, disk_path=self.disk_path)
+        expected = embed_model.get_query_embedding("How do I putt?")
+        restarted = CachedEmbedding(self.wrapped, disk_path=self.disk_path)
+        self.assertEqual(asyncio.run(restarted.aget_query_embedding("how do I putt?")), expected)
+        self.assertEqual(len(self.wrapped.calls), 1)
+        self.assertEqual(restarted.stats()["disk_hits"], 1)
+
+    def test_disk_errors_fall_back_to_the_wrapped_model(self):
+        embed_model = CachedEmbedding(self.wrapped, disk_path=self.disk_path)
+        with sqlite3.connect(self.disk_path) as disk:
+            disk.execute("DROP TABLE embeddings")
+        embed_model.get_query_embedding("How do I putt?")
+        self.assertEqual(len(self.wrapped.calls), 1)
+        # the read and the write both failed
+        self.assertEqual(embed_model.stats()["disk_errors"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+from unittest import mock
+from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+from llama_index.llms.openai import OpenAI
+from app.llama_index_server.cancellable_openai import CancellableOpenAI, track_generations, cancel_generations
+
+
+class CancellableOpenAITest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_the_task_consuming_the_stream(self):
+        closed = asyncio.Event()
+
+        async def endless_stream(*args, **kwargs):
+            async def gen():
+                try:
+                    while True:
+                        await asyncio.sleep(0.01)
+                        yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=""), delta="a")
+                finally:
+                    closed.set()
+
+            return gen()
+
+        llm = CancellableOpenAI(api_key="sk-test")
+        messages = [ChatMessage(role=MessageRole.USER, content="hi")]
+        with mock.patch.object(OpenAI, "astream_chat", endless_stream):
+            with track_generations() as generations:
+                stream = await llm.astream_chat(messages)
+                # like an agent, which writes the final answer to its memory in a task of its own
+                writer = asyncio.create_task(self.consume(stream))
+                await asyncio.sleep(0.05)
+            self.assertEqual(generations, {writer})
+            cancel_generations(generations)
+            await asyncio.wait_for(closed.wait(), timeout=1)
+            self.assertTrue(writer.cancelled())
+            # not tracked outside of the block
+            stream = await llm.astream_chat(messages)
+            self.assertEqual((await stream.__anext__()).delta, "a")
+            await stream.aclose()
+
+    @staticmethod
+    async def consume(stream):
+        async for _ in stream:
+            pass
+
+
+if __name__ == "__main__":
+    unittest.main()
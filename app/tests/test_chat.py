@@ -1,13 +1,11 @@
+import json
 import unittest
-from fastapi.testclient import TestClient
 from llama_index.core.llms import MessageRole
-from app.main import app
 from app.data.models.mongodb import Message
 from app.tests.test_base import BaseTest
 
 
 class ChatTest(BaseTest):
-    client = TestClient(app=app)
     ROOT = "/api/v1"
     ROUTER_CHAT = "chat"
     CSV_PATH = "../llama_index_server/documents/golf-knowledge-base.csv"
@@ -53,6 +51,30 @@ class ChatTest(BaseTest):
         message = Message(**json_response["data"])
         self.assertIn("Christopher", message.content)
 
+    def test_streaming_chat(self):
+        self.conversation_id = "test_streaming_chat"
+        body = {
+            "conversation_id": self.conversation_id,
+            "role": "user",
+            "content": "how long is a golf course usually?",
+        }
+        events = []
+        with self.client.stream("POST", url=f"{self.ROOT}/{self.ROUTER_CHAT}/streaming", json=body) as response:
+            self.assertEqual(response.status_code, 200)
+            for line in response.iter_lines():
+                if line.startswith("event: "):
+                    events.append([line[len("event: "):], None])
+                elif line.startswith("data: "):
+                    events[-1][1] = json.loads(line[len("data: "):])
+        self.assertGreater(len(events), 1)
+        self.assertTrue(all(event == "delta" for event, _ in events[:-1]))
+        self.assertEqual(events[-1][0], "done")
+        message = Message(**events[-1][1]["data"])
+        self.assertEqual(message.role, MessageRole.ASSISTANT)
+        self.assertEqual(message.content, "".join(data["content"] for _, data in events[:-1]).strip())
+        history = self.chat_message_dao.get_chat_history(self.conversation_id)
+        self.assertEqual([m.role for m in history], [MessageRole.USER, MessageRole.ASSISTANT])
+
 
 if __name__ == "__main__":
     unittest.main()
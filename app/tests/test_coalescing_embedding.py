@@ -0,0 +1,70 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Event
+from typing import List
+from llama_index.core import MockEmbedding
+from app.llama_index_server.coalescing_embedding import CoalescingEmbedding, EmbeddingCoalescer
+
+
+class BatchRecordingEmbedding(MockEmbedding):
+    batches: List[List[str]] = []
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(list(texts))
+        return [[float(text.split()[-1])] * self.embed_dim for text in texts]
+
+
+class CoalescingEmbeddingTest(unittest.TestCase):
+    def setUp(self):
+        self.wrapped = BatchRecordingEmbedding(embed_dim=4, batches=[])
+
+    def test_concurrent_queries_share_a_batch(self):
+        embed_model = CoalescingEmbedding(self.wrapped, window_ms=200, max_batch_size=8)
+        barrier = Barrier(16)
+
+        def query(i):
+            barrier.wait()
+            return embed_model.get_query_embedding(f"question {i % 12}")
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            embeddings = list(executor.map(query, range(16)))
+        embed_model.close()
+        self.assertEqual(embeddings, [[float(i % 12)] * 4 for i in range(16)])
+        self.assertLess(len(self.wrapped.batches), 16)
+        self.assertTrue(all(len(batch) <= 8 for batch in self.wrapped.batches))
+        stats = embed_model.stats()
+        self.assertEqual(stats["queue_wait_ms"]["count"], 16)
+        self.assertEqual(stats["batch_size"]["count"], len(self.wrapped.batches))
+
+    def test_failed_batch(self):
+        embed_model = CoalescingEmbedding(self.wrapped, window_ms=0)
+        with self.assertRaises(ValueError):
+            embed_model.get_query_embedding("question x")
+        self.assertEqual(embed_model.get_query_embedding("question 1"), [1.0] * 4)
+        embed_model.close()
+
+    def test_cancelled_waiter_does_not_block_its_batch(self):
+        coalescer = EmbeddingCoalescer(self.wrapped.get_text_embedding_batch, window_ms=200)
+        cancelled = coalescer.submit("question 1")
+        waiting = coalescer.submit("question 2")
+        self.assertTrue(cancelled.cancel())
+        self.assertEqual(waiting.result(timeout=5), [2.0] * 4)
+        self.assertEqual(self.wrapped.batches, [["question 2"]])
+        coalescer.close()
+
+    def test_embed_times_out(self):
+        release = Event()
+
+        def embed_batch(texts):
+            release.wait()
+            return self.wrapped.get_text_embedding_batch(texts)
+
+        coalescer = EmbeddingCoalescer(embed_batch, window_ms=0, timeout=0.1)
+        with self.assertRaises(TimeoutError):
+            coalescer.embed("question 1")
+        release.set()
+        coalescer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest import mock
+from bson import Timestamp
+from app.data.models.qa import Source
+from app.llama_index_server.doc_meta_cache import DocMetaCache
+from app.llama_index_server.response_cache import ResponseCache, QUESTION_PLACEHOLDER
+
+
+def build_document(doc_id, answer="Gently."):
+    return {"_id": f"id-{doc_id}", "doc_id": doc_id, "question": doc_id, "source": Source.KNOWLEDGE_BASE.value,
+            "answer": answer, "insert_timestamp": 0}
+
+
+class DocMetaCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.responses = ResponseCache(max_size=10, ttl_seconds=60)
+        self.cache = DocMetaCache(max_size=2, ttl_seconds=60, response_cache=self.responses)
+        self.documents = {doc_id: build_document(doc_id) for doc_id in ("a", "b", "c")}
+        self.loads = []
+
+    async def load(self, doc_id):
+        self.loads.append(doc_id)
+        return self.documents.get(doc_id)
+
+    async def test_read_through(self):
+        self.assertEqual((await self.cache.get("a", self.load)).answer, "Gently.")
+        doc_meta = await self.cache.get("a", self.load)
+        # callers get copies
+        doc_meta.answer = "changed by a caller"
+        self.assertEqual((await self.cache.get("a", self.load)).answer, "Gently.")
+        self.assertIsNone(await self.cache.get("missing", self.load))
+        await self.cache.get("b", self.load)
+        await self.cache.get("c", self.load)
+        # "a" was the least recently used
+        await self.cache.get("a", self.load)
+        self.assertEqual(self.loads, ["a", "missing", "b", "c", "a"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (2, 5, 2))
+
+    async def test_ttl(self):
+        await self.cache.get("a", self.load)
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            await self.cache.get("a", self.load)
+        self.assertEqual(self.loads, ["a", "a"])
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    async def test_a_load_racing_with_an_invalidation_is_not_cached(self):
+        loading = asyncio.Event()
+        proceed = asyncio.Event()
+
+        async def slow_load(doc_id):
+            document = dict(self.documents[doc_id])
+            loading.set()
+            await proceed.wait()
+            return document
+
+        get = asyncio.create_task(self.cache.get("a", slow_load))
+        await loading.wait()
+        self.documents["a"] = build_document("a", answer="Edited.")
+        self.cache.invalidate("a")
+        proceed.set()
+        self.assertEqual((await get).answer, "Gently.")
+        self.assertEqual((await self.cache.get("a", self.load)).answer, "Edited.")
+
+    async def test_change_events(self):
+        await self.cache.get("a", self.load)
+        await self.cache.get("b", self.load)
+        event = {"operationType": "update", "documentKey": {"_id": "id-a"},
+                 "clusterTime": Timestamp(int(time.time()), 1)}
+        # the hits recorded by every server do not invalidate
+        self.cache._on_change({**event, "updateDescription": {"updatedFields": {"query_buckets.3": {}},
+                                                              "removedFields": []}})
+        self.assertEqual(self.cache.stats()["size"], 2)
+        self.cache._on_change({**event, "updateDescription": {"updatedFields": {"answer": "Edited."},
+                                                              "removedFields": []}})
+        self.cache._on_change({"operationType": "delete", "documentKey": {"_id": "id-b"}})
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertEqual(self.cache.stats()["change_events"], 3)
+
+    async def test_change_events_invalidate_the_responses(self):
+        await self.cache.get("a", self.load)
+        for doc_id in ("a", "b"):
+            self.responses.put(doc_id, doc_id, json.dumps({"question": QUESTION_PLACEHOLDER}))
+        self.cache._on_change({"operationType": "delete", "documentKey": {"_id": "id-a"}})
+        self.assertIsNone(self.responses.get("a"))
+        self.assertIsNotNone(self.responses.get("b"))
+        # the meta of "b" is not cached, its _id is unknown
+        self.cache._on_change({"operationType": "update", "documentKey": {"_id": "id-b"},
+                               "updateDescription": {"updatedFields": {"answer": "Edited."}, "removedFields": []}})
+        self.assertIsNone(self.responses.get("b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from app.data.models.mongodb import LlamaIndexDocumentMetaReadable, QUERY_STATS_DAYS
+from app.data.models.qa import Source
+from app.llama_index_server.document_meta_dao import (
+    to_query_buckets,
+    get_record_queries_update,
+    get_eviction_pipeline,
+    NOT_KNOWLEDGE_BASE_QUERY,
+)
+from app.llama_index_server.eviction_policy import (
+    EvictionPolicy,
+    get_eviction_policy,
+    EVICTION_POLICY_LFU,
+    EVICTION_POLICY_LRU,
+)
+from app.utils import data_util
+from app.utils.data_util import MILLISECONDS_PER_DAY
+
+
+class QueryStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = data_util.get_current_milliseconds()
+        self.today = data_util.milliseconds_to_day(self.now)
+
+    def test_to_query_buckets(self):
+        timestamps = [self.now, self.now, self.now - MILLISECONDS_PER_DAY, self.now - 30 * MILLISECONDS_PER_DAY]
+        buckets = to_query_buckets(timestamps, self.now)
+        self.assertEqual(buckets, {
+            str(self.today % QUERY_STATS_DAYS): {"day": self.today, "count": 2},
+            str((self.today - 1) % QUERY_STATS_DAYS): {"day": self.today - 1, "count": 1},
+        })
+
+    def test_record_queries_update_reuses_the_bucket_of_the_same_weekday(self):
+        day = self.today + QUERY_STATS_DAYS
+        query, pipeline = get_record_queries_update("q", day, 3, self.now)
+        bucket = f"query_buckets.{self.today % QUERY_STATS_DAYS}"
+        self.assertEqual(query, {"doc_id": "q"})
+        self.assertEqual(pipeline[0]["$set"][bucket]["count"], {"$add": [
+            {"$cond": [{"$eq": [f"${bucket}.day", day]}, f"${bucket}.count", 0]}, 3,
+        ]})
+
+    def test_readable_query_count(self):
+        buckets = to_query_buckets([self.now - i * MILLISECONDS_PER_DAY for i in range(10) for _ in range(i + 1)],
+                                   self.now)
+        doc_meta = LlamaIndexDocumentMetaReadable(
+            question="How do I putt?",
+            source=Source.KNOWLEDGE_BASE,
+            answer="Gently.",
+            insert_timestamp=self.now - 30 * MILLISECONDS_PER_DAY,
+            last_query_timestamp=self.now,
+            query_buckets=buckets,
+        )
+        # 1 + 2 + ... + 7 queries in the last 7 days
+        self.assertEqual(doc_meta.query_count_7_days, 28)
+        self.assertEqual(doc_meta.query_count(1), 1)
+        self.assertEqual(doc_meta.last_query_time, data_util.milliseconds_to_human_readable(self.now))
+
+
+class EvictionPolicyTest(unittest.TestCase):
+    def test_eviction_pipeline(self):
+        pipeline = get_eviction_pipeline(get_eviction_policy(EVICTION_POLICY_LRU), 5)
+        # neither the knowledge base nor the recent answers are candidates
+        self.assertEqual(pipeline[0]["$match"]["source"], NOT_KNOWLEDGE_BASE_QUERY["source"])
+        self.assertLess(pipeline[0]["$match"]["insert_timestamp"]["$lt"], data_util.get_current_milliseconds())
+        # a document never queried is as recent as its insertion
+        self.assertEqual(pipeline[1]["$set"]["last_used_timestamp"],
+                         {"$max": ["$last_query_timestamp", "$insert_timestamp"]})
+        self.assertEqual(pipeline[2], {"$sort": {"last_used_timestamp": 1, "insert_timestamp": 1}})
+        self.assertEqual(pipeline[-2:], [{"$limit": 5}, {"$project": {"_id": 0, "doc_id": 1}}])
+
+    def test_lfu_counts_the_recent_queries_first(self):
+        stages = get_eviction_policy(EVICTION_POLICY_LFU).stages(data_util.get_current_milliseconds())
+        self.assertIn("recent_query_count", stages[0]["$set"])
+        self.assertEqual(list(stages[1]["$sort"]), ["recent_query_count", "last_used_timestamp", "insert_timestamp"])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            get_eviction_policy("fifo")
+        with self.assertRaises(TypeError):
+            EvictionPolicy()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.index_wal import IndexWriteAheadLog
+from app.llama_index_server.eviction_policy import Evictor, get_eviction_policy
+from app.tests.test_numpy_vector_store import build_node
+
+
+class FakeDocumentMetaDao:
+    """the doc ids in the order of the eviction policy, and the limit of the documents"""
+
+    def __init__(self, doc_ids, limit):
+        self.doc_ids = list(doc_ids)
+        self.limit = limit
+
+    def excess_doc_size(self):
+        return max(len(self.doc_ids) - self.limit, 0)
+
+    def eviction_candidates(self, policy, limit):
+        return self.doc_ids[:limit]
+
+    def delete_docs(self, doc_ids):
+        self.doc_ids = [doc_id for doc_id in self.doc_ids if doc_id not in doc_ids]
+
+
+class EvictorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_root = os.path.join(self.tmp_dir.name, "snapshots")
+        self.wal_dir = os.path.join(self.tmp_dir.name, "wal")
+        self.lock_path = os.path.join(self.tmp_dir.name, "eviction.lock")
+        embeddings = np.random.default_rng(0).standard_normal((20, 8))
+        vector_store = NumpyVectorStore()
+        vector_store.add([build_node(i, e) for i, e in enumerate(embeddings)])
+        vector_store.attach_wal(IndexWriteAheadLog(self.wal_dir, fsync=False))
+        vector_store.save_snapshot(self.snapshot_root)
+        vector_store.wal.close()
+        self.mongo = FakeDocumentMetaDao([f"question {i}" for i in range(20)], limit=15)
+        self.stores = []
+
+    def tearDown(self):
+        for vector_store in self.stores:
+            vector_store.wal.close()
+        self.tmp_dir.cleanup()
+
+    def open_storage(self, before_remove=None):
+        """a storage of one worker, sharing the index with the others"""
+        vector_store = NumpyVectorStore.from_snapshot(self.snapshot_root)
+        vector_store.attach_wal(IndexWriteAheadLog(self.wal_dir, fsync=False, shared=True))
+        self.stores.append(vector_store)
+
+        def remove(doc_ids):
+            if before_remove:
+                before_remove()
+            vector_store.sync()
+            with vector_store.batch():
+                for doc_id in doc_ids:
+                    vector_store.delete(doc_id)
+            self.mongo.delete_docs(doc_ids)
+
+        evictor = Evictor(self.mongo, get_eviction_policy("age"), 100, remove, lock_path=self.lock_path)
+        return vector_store, evictor
+
+    def test_two_storages_evict_once(self):
+        removing, resume = threading.Event(), threading.Event()
+
+        def block():
+            removing.set()
+            resume.wait(5)
+
+        store_a, evictor_a = self.open_storage(before_remove=block)
+        store_b, evictor_b = self.open_storage()
+        evicted_a = []
+        thread = threading.Thread(target=lambda: evicted_a.extend(evictor_a.run()))
+        thread.start()
+        self.assertTrue(removing.wait(5))
+        # b runs while a evicts: it skips the run
+        self.assertEqual(evictor_b.run(), [])
+        resume.set()
+        thread.join(5)
+        # the excess is computed again after a has evicted
+        self.assertEqual(evictor_b.run(), [])
+        self.assertEqual(evicted_a, [f"question {i}" for i in range(5)])
+        self.assertEqual(len(self.mongo.doc_ids), 15)
+        self.assertEqual(evictor_b.stats()["skipped_runs"], 1)
+        self.assertEqual(evictor_b.stats()["evicted"], 0)
+        _, removed = store_b.sync()
+        self.assertEqual(removed, set(evicted_a))
+        self.assertEqual(store_a.size, store_b.size)
+
+
+if __name__ == "__main__":
+    unittest.main()
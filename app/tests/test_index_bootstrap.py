@@ -0,0 +1,83 @@
+import csv
+import os
+import tempfile
+import unittest
+from typing import List
+from app.tests.test_cached_embedding import CountingEmbedding
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.index_wal import IndexWriteAheadLog
+from app.llama_index_server.index_snapshot import snapshot_exists
+from app.llama_index_server.index_bootstrap import bootstrap_index
+
+
+class FailingEmbedding(CountingEmbedding):
+    """fails once `fail_after` texts were embedded, like a build killed halfway"""
+    fail_after: int = -1
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        if 0 <= self.fail_after <= len(self.calls):
+            raise RuntimeError("embedding failed")
+        return super()._get_text_embedding(text)
+
+
+class InMemoryMongo:
+    def __init__(self):
+        self.docs = {}
+
+    def bulk_upsert(self, docs, primary_keys):
+        for doc in docs:
+            self.docs[tuple(doc[key] for key in primary_keys)] = doc
+
+
+class IndexBootstrapTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "answers.csv")
+        self.checkpoint_path = os.path.join(self.tmp_dir.name, "saved_index", "bootstrap.json")
+        self.snapshot_root = os.path.join(self.tmp_dir.name, "saved_index", "snapshots")
+        self.wal_dir = os.path.join(self.tmp_dir.name, "saved_index", "wal")
+        with open(self.csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["category", "question", "answer"])
+            writer.writeheader()
+            for i in range(95):
+                writer.writerow({"category": "golf", "question": f"question {i}?", "answer": f"answer {i}"})
+            # a duplicated question is only indexed once
+            writer.writerow({"category": "golf", "question": "question 0?", "answer": "answer 0"})
+        self.mongo = InMemoryMongo()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def bootstrap(self, embed_model):
+        vector_store = NumpyVectorStore()
+        wal = IndexWriteAheadLog(self.wal_dir, fsync=False)
+        try:
+            stats = bootstrap_index(self.csv_path, vector_store, wal, self.mongo, self.checkpoint_path,
+                                    self.snapshot_root, batch_size=10, concurrency=1, embed_model=embed_model)
+        finally:
+            wal.close()
+        return vector_store, stats
+
+    def test_resume_after_interruption(self):
+        interrupted = FailingEmbedding(embed_dim=8, calls=[], fail_after=42)
+        with self.assertRaises(RuntimeError):
+            self.bootstrap(interrupted)
+        self.assertTrue(os.path.exists(self.checkpoint_path))
+        self.assertFalse(snapshot_exists(self.snapshot_root))
+        self.assertEqual(len(self.mongo.docs), 40)
+
+        resumed = CountingEmbedding(embed_dim=8, calls=[])
+        vector_store, stats = self.bootstrap(resumed)
+        # the 4 stored batches are replayed from the log, not embedded again
+        self.assertEqual(resumed.calls, [f"question {i}?" for i in range(40, 95)])
+        self.assertEqual(stats["rows"], 55)
+        self.assertEqual(stats["skipped"], 41)
+        self.assertEqual(vector_store.size, 95)
+        self.assertEqual(len(self.mongo.docs), 95)
+        self.assertTrue(snapshot_exists(self.snapshot_root))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        self.assertEqual(NumpyVectorStore.from_snapshot(self.snapshot_root).size, 95)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.index_wal import IndexWriteAheadLog
+from app.tests.test_numpy_vector_store import build_node
+
+
+class IndexWriteAheadLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_root = os.path.join(self.tmp_dir.name, "snapshots")
+        self.wal_dir = os.path.join(self.tmp_dir.name, "wal")
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.standard_normal((30, 8))
+        self.vector_store = NumpyVectorStore()
+        self.vector_store.add([build_node(i, e) for i, e in enumerate(self.embeddings[:20])])
+        self.vector_store.attach_wal(IndexWriteAheadLog(self.wal_dir, fsync=False))
+        self.vector_store.save_snapshot(self.snapshot_root)
+
+    def tearDown(self):
+        self.vector_store.wal.close()
+        self.tmp_dir.cleanup()
+
+    def restart(self):
+        """what the server does on startup after a crash"""
+        vector_store = NumpyVectorStore.from_snapshot(self.snapshot_root)
+        replayed = vector_store.attach_wal(IndexWriteAheadLog(self.wal_dir, fsync=False))
+        return vector_store, replayed
+
+    def top_1(self, vector_store, i):
+        result = vector_store.query(VectorStoreQuery(query_embedding=list(self.embeddings[i]), similarity_top_k=1))
+        return result.nodes[0].text if len(result.ids) > 0 else None
+
+    def test_replay_after_crash(self):
+        self.vector_store.add([build_node(i, e) for i, e in enumerate(self.embeddings[20:], start=20)])
+        self.vector_store.delete("question 3")
+        self.vector_store.delete_nodes(["node-4"])
+        restarted, replayed = self.restart()
+        self.assertEqual(replayed, 12)
+        self.assertEqual(restarted.size, 28)
+        self.assertEqual(self.top_1(restarted, 25), "question 25")
+        self.assertNotEqual(self.top_1(restarted, 3), "question 3")
+        self.assertNotEqual(self.top_1(restarted, 4), "question 4")
+        restarted.wal.close()
+
+    def test_torn_record_is_cut_off(self):
+        self.vector_store.add([build_node(20, self.embeddings[20]), build_node(21, self.embeddings[21])])
+        segment = os.path.join(self.wal_dir, sorted(os.listdir(self.wal_dir))[-1])
+        with open(segment, "rb+") as f:
+            f.truncate(os.path.getsize(segment) - 5)
+        restarted, replayed = self.restart()
+        self.assertEqual(replayed, 1)
+        self.assertEqual(self.top_1(restarted, 20), "question 20")
+        self.assertNotEqual(self.top_1(restarted, 21), "question 21")
+        # the log stays appendable after the torn record
+        restarted.add([build_node(22, self.embeddings[22])])
+        restarted.wal.close()
+        restarted, replayed = self.restart()
+        self.assertEqual(replayed, 2)
+        self.assertEqual(self.top_1(restarted, 22), "question 22")
+        restarted.wal.close()
+
+    def test_snapshot_removes_contained_segments(self):
+        self.vector_store.add([build_node(20, self.embeddings[20])])
+        self.assertEqual(self.vector_store.wal.pending_records, 1)
+        self.vector_store.save_snapshot(self.snapshot_root)
+        self.assertEqual(self.vector_store.wal.pending_records, 0)
+        self.assertEqual(len(os.listdir(self.wal_dir)), 1)
+        restarted, replayed = self.restart()
+        self.assertEqual(replayed, 0)
+        self.assertEqual(self.top_1(restarted, 20), "question 20")
+        restarted.wal.close()
+
+    def open_shared(self):
+        """what a worker of a server with a shared index does on startup"""
+        vector_store = NumpyVectorStore.from_snapshot(self.snapshot_root)
+        vector_store.attach_wal(IndexWriteAheadLog(self.wal_dir, fsync=False, shared=True))
+        return vector_store
+
+    def test_shared_log(self):
+        a, b = self.open_shared(), self.open_shared()
+        a.add([build_node(20, self.embeddings[20])])
+        self.assertNotEqual(self.top_1(b, 20), "question 20")
+        self.assertEqual(b.sync(), ({"question 20"}, set()))
+        self.assertEqual(self.top_1(b, 20), "question 20")
+        # b applies the insert of a before it logs the delete, so the log has them in the order b applied them
+        a.add([build_node(21, self.embeddings[21])])
+        b.delete("question 21")
+        self.assertEqual(a.sync(), (set(), {"question 21"}))
+        self.assertEqual(a.size, 21)
+        self.assertEqual(b.size, 21)
+        # a folds the log into a snapshot, including the segment b has not read to the end
+        a.add([build_node(22, self.embeddings[22])])
+        a.save_snapshot(self.snapshot_root)
+        b.add([build_node(23, self.embeddings[23])])
+        self.assertEqual(self.top_1(b, 22), "question 22")
+        self.assertEqual(a.sync(), ({"question 23"}, set()))
+        # the changes since the last sync of b, its own insert included
+        self.assertEqual(b.sync(), ({"question 22", "question 23"}, set()))
+        restarted, replayed = self.restart()
+        self.assertEqual(replayed, 1)
+        self.assertEqual(restarted.size, 23)
+        for vector_store in (a, b, restarted):
+            vector_store.wal.close()
+
+    def test_shared_log_switches_to_the_snapshot_of_another_process(self):
+        a, b = self.open_shared(), self.open_shared()
+        a.add([build_node(20, self.embeddings[20])])
+        b.sync()
+        a.save_snapshot(self.snapshot_root)
+        b.sync()
+        self.assertEqual(self.top_1(b, 20), "question 20")
+        # both map the rows of the same snapshot file, instead of keeping copies of the rows added since
+        self.assertEqual(a.memory_bytes(), b.memory_bytes())
+        self.assertEqual(a._matrix.filename, b._matrix.filename)
+        a.wal.close()
+        b.wal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
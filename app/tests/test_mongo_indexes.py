@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+from app.data.models.mongodb import LlamaIndexDocumentMeta, Message
+from pymongo.errors import OperationFailure
+from app.utils.mongo_dao import BaseMongoDao, INDEX_OPTIONS_CONFLICT, find_collection_scans, find_winning_plans
+
+COLLECTION_SCAN = {"stage": "LIMIT", "inputStage": {"stage": "COLLSCAN", "direction": "forward"}}
+INDEX_SCAN = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "doc_id"}}
+
+
+class MongoIndexesTest(unittest.TestCase):
+    def test_find_collection_scans(self):
+        self.assertTrue(find_collection_scans(COLLECTION_SCAN))
+        self.assertFalse(find_collection_scans(INDEX_SCAN))
+        # the plans of $or queries and of the slot based engine nest differently
+        self.assertTrue(find_collection_scans({"stage": "OR", "inputStages": [INDEX_SCAN, COLLECTION_SCAN]}))
+        self.assertFalse(find_collection_scans({"queryPlan": INDEX_SCAN, "slotBasedPlan": {"stages": "..."}}))
+
+    def test_find_winning_plans_of_an_aggregation(self):
+        explained = {"stages": [
+            {"$cursor": {"queryPlanner": {"winningPlan": INDEX_SCAN}}},
+            {"$lookup": {"queryPlanner": {"winningPlan": COLLECTION_SCAN}}},
+            {"$limit": 1},
+        ]}
+        self.assertEqual(list(find_winning_plans(explained)), [INDEX_SCAN, COLLECTION_SCAN])
+
+    def test_declared_indexes(self):
+        self.assertTrue(LlamaIndexDocumentMeta.indexes()[0].document["unique"])
+        self.assertEqual([index.document["name"] for index in Message.indexes()], ["conversation_history"])
+        with mock.patch("app.utils.data_consts.CHAT_MESSAGE_TTL_DAYS", 30):
+            ttl = Message.indexes()[-1].document
+        self.assertEqual(ttl["key"], {"created_at": 1})
+        self.assertEqual(ttl["expireAfterSeconds"], 30 * 24 * 60 * 60)
+
+    def test_index_conflicts(self):
+        dao = BaseMongoDao(mock.MagicMock(), "db", "message")
+        dao._collection.name = "message"
+        with mock.patch("app.utils.data_consts.CHAT_MESSAGE_TTL_DAYS", 30):
+            ttl = Message.indexes()[-1]
+        conflict = OperationFailure("conflict", code=INDEX_OPTIONS_CONFLICT)
+        # only the expiry of a ttl index can be changed in place
+        self.assertEqual(dao._index_conflict_command(ttl, conflict)["collMod"], "message")
+        self.assertIsNone(dao._index_conflict_command(Message.indexes()[0], conflict))
+
+
+if __name__ == "__main__":
+    unittest.main()
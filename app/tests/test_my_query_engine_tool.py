@@ -0,0 +1,50 @@
+import asyncio
+import time
+import unittest
+from typing import List
+from llama_index.core import MockEmbedding, VectorStoreIndex
+from llama_index.core.llms import MockLLM
+from llama_index.core.response_synthesizers.no_text import NoText
+from llama_index.core.schema import TextNode
+from app.llama_index_server.numpy_vector_store import NumpyVectorStore
+from app.llama_index_server.my_query_engine_tool import MyQueryEngineTool, MATCHED_MARK
+
+DELAY = 0.1
+
+
+class SlowEmbedding(MockEmbedding):
+    """an embedding model with the latency of an http call, blocking in the sync api only"""
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(DELAY)
+        return [1.0, 0.0, 0.0, 0.0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(DELAY)
+        return [1.0, 0.0, 0.0, 0.0]
+
+
+class MyQueryEngineToolTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        vector_store = NumpyVectorStore()
+        vector_store.add([TextNode(text="How do I putt?", embedding=[1.0, 0.0, 0.0, 0.0])])
+        index = VectorStoreIndex.from_vector_store(vector_store, embed_model=SlowEmbedding(embed_dim=4))
+        self.tool = MyQueryEngineTool.from_defaults(
+            query_engine=index.as_query_engine(
+                llm=MockLLM(),
+                response_synthesizer=NoText(llm=MockLLM()),
+            ),
+            name="local_query_engine",
+        )
+
+    async def test_concurrent_calls_overlap(self):
+        start = time.perf_counter()
+        outputs = await asyncio.gather(*[self.tool.acall(input=f"putting {i}") for i in range(5)])
+        elapsed = time.perf_counter() - start
+        self.assertEqual([o.content for o in outputs], [f"{MATCHED_MARK}How do I putt?"] * 5)
+        # one after another they would take 5 * DELAY
+        self.assertLess(elapsed, 3 * DELAY)
+
+
+if __name__ == "__main__":
+    unittest.main()
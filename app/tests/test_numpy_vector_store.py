@@ -0,0 +1,237 @@
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from llama_index.core import Document, MockEmbedding, QueryBundle, VectorStoreIndex
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from app.data.models.qa import Answer, Source
+from app.tests.test_cached_embedding import CountingEmbedding
+from app.llama_index_server.numpy_vector_store import (
+    NumpyVectorStore,
+    normalize,
+    IVF_MIN_TRAIN_SIZE,
+    SEARCH_MODE_IVF,
+    QUANTIZATION_NONE,
+    QUANTIZATION_FLOAT16,
+    QUANTIZATION_INT8,
+)
+
+
+def build_node(i, embedding):
+    return TextNode(
+        id_=f"node-{i}",
+        text=f"question {i}",
+        embedding=list(embedding),
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"question {i}")},
+    )
+
+
+class NumpyVectorStoreTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.standard_normal((50, 8))
+        self.nodes = [build_node(i, e) for i, e in enumerate(self.embeddings)]
+        self.vector_store = NumpyVectorStore()
+        self.vector_store.add(self.nodes)
+
+    def query(self, vector_store, embedding, top_k=3):
+        return vector_store.query(VectorStoreQuery(query_embedding=list(embedding), similarity_top_k=top_k))
+
+    def test_same_result_as_simple_vector_store(self):
+        simple_vector_store = SimpleVectorStore()
+        simple_vector_store.add(self.nodes)
+        for embedding in self.embeddings[:10]:
+            expected = self.query(simple_vector_store, embedding)
+            result = self.query(self.vector_store, embedding)
+            self.assertEqual(expected.ids, result.ids)
+            np.testing.assert_allclose(expected.similarities, result.similarities, rtol=1e-5)
+
+    def test_delete(self):
+        self.vector_store.delete("question 3")
+        self.vector_store.delete("question 49")
+        self.assertEqual(self.vector_store.size, 48)
+        result = self.query(self.vector_store, self.embeddings[3], top_k=48)
+        self.assertNotIn("node-3", result.ids)
+        self.assertNotIn("node-49", result.ids)
+        # the row of the deleted node is reused by the last node, which must still be found
+        result = self.query(self.vector_store, self.embeddings[48], top_k=1)
+        self.assertEqual(result.ids, ["node-48"])
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as snapshot_root:
+            self.vector_store.delete("question 7")
+            self.vector_store.save_snapshot(snapshot_root)
+            loaded = NumpyVectorStore.from_snapshot(snapshot_root)
+            self.assertEqual(loaded.size, 49)
+            for embedding in self.embeddings[:10]:
+                expected = self.query(self.vector_store, embedding)
+                result = self.query(loaded, embedding)
+                self.assertEqual(expected.ids, result.ids)
+                self.assertEqual([n.text for n in expected.nodes], [n.text for n in result.nodes])
+            # rows loaded from a snapshot are copy-on-write: changing them never touches the files
+            loaded.delete("question 0")
+            loaded.add([build_node(100, self.embeddings[0])])
+            self.assertEqual(NumpyVectorStore.from_snapshot(snapshot_root).size, 49)
+            self.assertEqual(self.query(loaded, self.embeddings[0], top_k=1).nodes[0].text, "question 100")
+            # a snapshot of a store loaded from a snapshot reuses the encoded nodes
+            loaded.save_snapshot(snapshot_root)
+            reloaded = NumpyVectorStore.from_snapshot(snapshot_root)
+            self.assertEqual(self.query(reloaded, self.embeddings[1], top_k=1).nodes[0].text, "question 1")
+            self.assertEqual(len(os.listdir(snapshot_root)), 2)
+
+    def test_migrate_from_json_persist_dir(self):
+        documents = [Document(doc_id=f"question {i}", text=f"question {i}") for i in range(20)]
+        index = VectorStoreIndex.from_documents(documents, embed_model=MockEmbedding(embed_dim=8))
+        with tempfile.TemporaryDirectory() as persist_dir:
+            index.storage_context.persist(persist_dir=persist_dir)
+            vector_store = NumpyVectorStore.from_json_persist_dir(persist_dir)
+        self.assertEqual(vector_store.size, 20)
+        result = self.query(vector_store, [1.0] * 8, top_k=20)
+        self.assertEqual(sorted(n.text for n in result.nodes), sorted(d.text for d in documents))
+        vector_store.delete("question 3")
+        self.assertEqual(vector_store.size, 19)
+
+    def test_vector_store_index(self):
+        vector_store = NumpyVectorStore()
+        index = VectorStoreIndex.from_vector_store(vector_store, embed_model=MockEmbedding(embed_dim=8))
+        self.assertIs(index.vector_store, vector_store)
+        for i in range(3):
+            index.insert(Document(doc_id=f"question {i}", text=f"question {i}", metadata={"answer": f"answer {i}"}))
+        index.delete_ref_doc("question 1", delete_from_docstore=True)
+        nodes = index.as_retriever(similarity_top_k=3).retrieve("question")
+        self.assertEqual(sorted(n.node.metadata["answer"] for n in nodes), ["answer 0", "answer 2"])
+
+    def test_pre_embedded_query_and_insert(self):
+        embed_model = CountingEmbedding(embed_dim=8, calls=[])
+        index = VectorStoreIndex.from_vector_store(NumpyVectorStore(), embed_model=embed_model)
+        answer = Answer(question="How do I putt?", source=Source.USER_ASKED, answer="Keep the head still.")
+        embedding = list(self.embeddings[0])
+        retrieved = index.as_retriever().retrieve(QueryBundle(query_str=answer.question, embedding=embedding))
+        self.assertEqual(retrieved, [])
+        doc = answer.to_llama_index_document()
+        doc.embedding = embedding
+        index.insert(doc)
+        self.assertEqual(embed_model.calls, [])
+        retrieved = index.as_retriever().retrieve(QueryBundle(query_str=answer.question, embedding=embedding))
+        self.assertEqual(retrieved[0].node.metadata["answer"], answer.answer)
+        self.assertAlmostEqual(retrieved[0].score, 1.0, places=5)
+        # a question inserted without an embedding is embedded without its answer, like a query
+        index.insert(Answer(question="How do I chip?", source=Source.USER_ASKED, answer="a").to_llama_index_document())
+        self.assertEqual(embed_model.calls, ["How do I chip?"])
+
+    def test_quantization(self):
+        rng = np.random.default_rng(2)
+        embeddings = normalize(rng.standard_normal((3000, 64)).astype(np.float32))
+        node_ids = [f"node-{i}" for i in range(len(embeddings))]
+        exact_store = NumpyVectorStore()
+        exact_store.add_embeddings(node_ids, node_ids, embeddings)
+        # near duplicates, whose order is decided by the re-scoring
+        queries = embeddings[:50] + 0.05 * rng.standard_normal((50, 64)).astype(np.float32)
+        for quantization in (QUANTIZATION_FLOAT16, QUANTIZATION_INT8):
+            with tempfile.TemporaryDirectory() as snapshot_root:
+                vector_store = NumpyVectorStore(quantization=quantization)
+                vector_store.add_embeddings(node_ids, node_ids, embeddings)
+                vector_store.delete("node-7")
+                exact_store.delete("node-7")
+                vector_store.save_snapshot(snapshot_root)
+                loaded = NumpyVectorStore.from_snapshot(snapshot_root, quantization=quantization)
+                for store in (vector_store, loaded):
+                    for q in queries:
+                        expected = self.query(exact_store, q, top_k=5)
+                        result = self.query(store, q, top_k=5)
+                        self.assertEqual(expected.ids, result.ids)
+                        np.testing.assert_allclose(expected.similarities, result.similarities, rtol=1e-5)
+                # the float32 rows are mapped from the snapshot, only the quantized ones stay in memory
+                self.assertLessEqual(loaded.memory_bytes(), exact_store.memory_bytes() / 2)
+                self.assertLessEqual(vector_store.memory_bytes(), exact_store.memory_bytes() / 2)
+
+    def test_ivf_incremental_insert_and_delete(self):
+        rng = np.random.default_rng(1)
+        size = IVF_MIN_TRAIN_SIZE + 100
+        embeddings = rng.standard_normal((size, 16))
+        node_ids = [f"node-{i}" for i in range(size)]
+        vector_store = NumpyVectorStore(search_mode=SEARCH_MODE_IVF, n_probe=4)
+        vector_store.add_embeddings(node_ids[:-100], node_ids[:-100], embeddings[:-100])
+        vector_store.add_embeddings(node_ids[-100:], node_ids[-100:], embeddings[-100:])
+        for i in list(range(0, size, 97)) + list(range(size - 100, size)):
+            self.assertEqual(self.query(vector_store, embeddings[i], top_k=1).ids, [node_ids[i]])
+        for i in range(0, 100):
+            vector_store.delete(node_ids[i])
+        self.assertEqual(vector_store.size, size - 100)
+        self.assertEqual(self.query(vector_store, embeddings[size - 1], top_k=1).ids, [node_ids[size - 1]])
+        self.assertNotEqual(self.query(vector_store, embeddings[0], top_k=1).ids, [node_ids[0]])
+
+
+class LockFreeReadTest(unittest.TestCase):
+    """queries from many threads while other threads insert, delete, prune in batches and snapshot"""
+    DIM = 16
+    READERS = 8
+    QUERIES_PER_READER = 500
+
+    def run_stress(self, quantization):
+        rng = np.random.default_rng(1)
+        embeddings = {i: normalize(rng.standard_normal(self.DIM)) for i in range(6000)}
+        vector_store = NumpyVectorStore(quantization=quantization)
+        vector_store.add([build_node(i, embeddings[i]) for i in range(2000)])
+        errors = []
+        stop = threading.Event()
+
+        def read(seed):
+            reader_rng = np.random.default_rng(seed)
+            try:
+                for _ in range(self.QUERIES_PER_READER):
+                    query_embedding = normalize(reader_rng.standard_normal(self.DIM))
+                    result = vector_store.query(VectorStoreQuery(query_embedding=list(query_embedding),
+                                                                 similarity_top_k=5))
+                    self.assertEqual(len(result.ids), 5)
+                    self.assertEqual(len(set(result.ids)), 5)
+                    self.assertEqual([node.node_id for node in result.nodes], result.ids)
+                    expected = [float(embeddings[int(node_id.split("-")[1])] @ query_embedding)
+                                for node_id in result.ids]
+                    np.testing.assert_allclose(result.similarities, expected, atol=1e-5)
+                    self.assertEqual(result.similarities, sorted(result.similarities, reverse=True))
+            except Exception as e:
+                errors.append(e)
+
+        def write(snapshot_root):
+            next_id, oldest = 2000, 0
+            try:
+                while not stop.is_set() and next_id < len(embeddings):
+                    vector_store.add([build_node(i, embeddings[i]) for i in range(next_id, next_id + 10)])
+                    next_id += 10
+                    # an overwrite kills the old row and appends a new one
+                    vector_store.add([build_node(next_id - 1, embeddings[next_id - 1])])
+                    vector_store.delete(f"question {oldest}")
+                    with vector_store.batch():
+                        for i in range(oldest + 1, oldest + 10):
+                            vector_store.delete(f"question {i}")
+                    oldest += 10
+                    if next_id % 1000 == 0:
+                        vector_store.save_snapshot(snapshot_root)
+            except Exception as e:
+                errors.append(e)
+
+        with tempfile.TemporaryDirectory() as snapshot_root:
+            readers = [threading.Thread(target=read, args=(i,)) for i in range(self.READERS)]
+            writer = threading.Thread(target=write, args=(snapshot_root,))
+            for thread in readers + [writer]:
+                thread.start()
+            for thread in readers:
+                thread.join()
+            stop.set()
+            writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(vector_store.size, 2000)
+
+    def test_concurrent_reads_and_writes(self):
+        self.run_stress(QUANTIZATION_NONE)
+
+    def test_concurrent_reads_and_writes_quantized(self):
+        self.run_stress(QUANTIZATION_INT8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,17 +1,17 @@
+import json
 import unittest
-from fastapi.testclient import TestClient
-from app.main import app
 from app.data.messages.qa import (
     QuestionAnsweringRequest,
     QuestionAnsweringResponse,
+    DocumentResponse,
 )
 from app.data.models.qa import Source, get_default_answer
 from app.llama_index_server.chat_message_dao import ChatMessageDao
+from app.utils import data_consts
 from app.tests.test_base import BaseTest
 
 
 class QaTest(BaseTest):
-    client = TestClient(app=app)
     ROOT = "/api/v1"
     ROUTER_QA = "qa"
     ROUTER_ADMIN = "admin"
@@ -24,8 +24,15 @@ class QaTest(BaseTest):
         response = self.client.post(url=f"{self.ROOT}/{self.ROUTER_QA}/query", json=data)
         response = QuestionAnsweringResponse(**response.json())
         self.assertEqual(get_default_answer(), response.data.answer)
-        self.check_document(doc_id=data["question"], from_knowledge_base=False)
-        self.doc_id = data["question"]
+        if data_consts.TOPIC_RELEVANCE_THRESHOLD > 0:
+            # rejected by the topic filter, without being indexed
+            self.assertEqual(response.data.source, Source.TOPIC_FILTER)
+            response = self.client.post(url=f"{self.ROOT}/{self.ROUTER_QA}/document",
+                                        json={"doc_id": data["question"]})
+            self.assertIsNone(DocumentResponse(**response.json()).data)
+        else:
+            self.check_document(doc_id=data["question"], from_knowledge_base=False)
+            self.doc_id = data["question"]
 
     def test_ask_questions_relevant_and_in_knowledge_base(self):
         data = QuestionAnsweringRequest.ConfigDict.json_schema_extra[
@@ -50,6 +57,51 @@ class QaTest(BaseTest):
         self.assertNotEqual(response.data.answer, get_default_answer())
         self.check_document(doc_id=data["question"], from_knowledge_base=False)
 
+    def test_missing_meta_of_an_indexed_question_is_restored(self):
+        data = QuestionAnsweringRequest.ConfigDict.json_schema_extra[
+            "example_relevant_but_not_in_knowledge_base"
+        ]
+        self.client.post(url=f"{self.ROOT}/{self.ROUTER_QA}/query", json=data)
+        self.doc_id = data["question"]
+        # removes the metas of the user questions, their nodes stay in the index
+        self.setUp()
+        self.doc_id = data["question"]
+        response = self.client.post(url=f"{self.ROOT}/{self.ROUTER_QA}/query", json=data)
+        self.assertNotEqual(QuestionAnsweringResponse(**response.json()).data.answer, get_default_answer())
+        self.check_document(doc_id=data["question"], from_knowledge_base=False)
+
+    def stream_events(self, data):
+        events = []
+        with self.client.stream("POST", url=f"{self.ROOT}/{self.ROUTER_QA}/query/streaming", json=data) as response:
+            self.assertEqual(response.status_code, 200)
+            for line in response.iter_lines():
+                if line.startswith("event: "):
+                    events.append([line[len("event: "):], None])
+                elif line.startswith("data: "):
+                    events[-1][1] = json.loads(line[len("data: "):])
+        return events
+
+    def test_streaming_knowledge_base_answer(self):
+        data = QuestionAnsweringRequest.ConfigDict.json_schema_extra[
+            "example_relevant_and_in_knowledge_base"
+        ]
+        events = self.stream_events(data)
+        self.assertEqual([event for event, _ in events], ["done"])
+        response = QuestionAnsweringResponse(**events[0][1])
+        self.assertEqual(response.data.source, Source.KNOWLEDGE_BASE)
+        self.assertIsNotNone(response.data.matched_question)
+
+    def test_streaming_llm_answer(self):
+        data = QuestionAnsweringRequest.ConfigDict.json_schema_extra[
+            "example_relevant_but_not_in_knowledge_base"
+        ]
+        events = self.stream_events(data)
+        self.assertGreater(len(events), 1)
+        self.assertTrue(all(event == "delta" for event, _ in events[:-1]))
+        self.assertEqual(events[-1][0], "done")
+        response = QuestionAnsweringResponse(**events[-1][1])
+        self.assertEqual(response.data.answer, "".join(d["content"] for _, d in events[:-1]).strip())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from app.llama_index_server.query_hit_buffer import QueryHitBuffer
+from app.utils.data_util import MILLISECONDS_PER_DAY
+
+NOW = 1700000000000
+TODAY = NOW // MILLISECONDS_PER_DAY
+
+
+class QueryHitBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.writes = []
+        self.full_calls = 0
+        self.fail = False
+        self.buffer = QueryHitBuffer(self.write, max_pending=2, on_full=self.on_full)
+
+    def write(self, hits):
+        if self.fail:
+            raise ConnectionError("mongo is down")
+        self.writes.append(hits)
+
+    def on_full(self):
+        self.full_calls += 1
+
+    def test_hits_are_aggregated_per_doc_and_day(self):
+        self.buffer.record("a", NOW)
+        self.buffer.record("a", NOW + 1)
+        self.buffer.record("a", NOW + MILLISECONDS_PER_DAY)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.writes, [{("a", TODAY): [2, NOW + 1], ("a", TODAY + 1): [1, NOW + MILLISECONDS_PER_DAY]}])
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.writes), 1)
+
+    def test_overflow_drops_new_docs_until_flushed(self):
+        self.assertTrue(self.buffer.record("a", NOW))
+        self.assertTrue(self.buffer.record("b", NOW))
+        self.assertEqual(self.full_calls, 1)
+        self.assertFalse(self.buffer.record("c", NOW))
+        # the docs already pending are still counted
+        self.assertTrue(self.buffer.record("a", NOW))
+        self.buffer.flush()
+        self.assertTrue(self.buffer.record("c", NOW))
+        stats = self.buffer.stats()
+        self.assertEqual((stats["recorded"], stats["dropped"], stats["flushed"], stats["pending"]), (4, 1, 3, 1))
+        self.assertEqual(stats["batch_size"]["count"], 1)
+
+    def test_failed_flush_is_retried(self):
+        self.buffer.record("a", NOW)
+        self.fail = True
+        self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.record("a", NOW + 1)
+        self.fail = False
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.writes, [{("a", TODAY): [2, NOW + 1]}])
+        self.assertEqual(self.buffer.stats()["failed_flushes"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
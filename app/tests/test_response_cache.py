@@ -0,0 +1,57 @@
+import json
+import time
+import unittest
+from unittest import mock
+from app.data.messages.qa import QuestionAnsweringResponse
+from app.data.models.qa import Answer, Source
+from app.llama_index_server.response_cache import ResponseCache, QUESTION_PLACEHOLDER, normalize_question
+
+
+def serialized(question, answer):
+    template = Answer(question=QUESTION_PLACEHOLDER, matched_question=question, source=Source.KNOWLEDGE_BASE,
+                      answer=answer)
+    return QuestionAnsweringResponse(data=template).model_dump_json()
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question(" How do I   PUTT?! "), "how do i putt")
+        self.assertEqual(normalize_question("What's a birdie?"), normalize_question("what s a birdie"))
+
+    def test_get_returns_body_with_the_asked_question(self):
+        cache = ResponseCache(max_size=10, ttl_seconds=60)
+        cache.put("How do I putt?", "How do I putt?", serialized("How do I putt?", "Keep the head still."))
+        doc_id, body = cache.get("how do I putt")
+        self.assertEqual(doc_id, "How do I putt?")
+        response = json.loads(body)
+        self.assertEqual(response["data"]["question"], "how do I putt")
+        self.assertEqual(response["data"]["answer"], "Keep the head still.")
+        self.assertIsNone(cache.get("How do I chip?"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_invalidate_and_size_bound(self):
+        cache = ResponseCache(max_size=2, ttl_seconds=60)
+        cache.put("How do I putt?", "How do I putt?", serialized("How do I putt?", "a"))
+        cache.put("How to putt", "How do I putt?", serialized("How do I putt?", "a"))
+        cache.put("How do I chip?", "How do I chip?", serialized("How do I chip?", "b"))
+        # the least recently used entry is evicted
+        self.assertIsNone(cache.get("How do I putt?"))
+        self.assertIsNotNone(cache.get("How to putt"))
+        cache.invalidate("How do I putt?")
+        self.assertIsNone(cache.get("How to putt"))
+        self.assertIsNotNone(cache.get("How do I chip?"))
+        self.assertEqual(cache.stats()["size"], 1)
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+    def test_entries_expire(self):
+        cache = ResponseCache(max_size=10, ttl_seconds=60)
+        cache.put("How do I putt?", "How do I putt?", serialized("How do I putt?", "a"))
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("How do I putt?"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from app.llama_index_server.single_flight import SingleFlight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_execution(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def answer(question):
+            calls.append(question)
+            await asyncio.sleep(0.05)
+            return f"answer to {question}"
+
+        results = await asyncio.gather(
+            *[single_flight.do("putt", lambda: answer("putt")) for _ in range(10)],
+            single_flight.do("chip", lambda: answer("chip")),
+        )
+        self.assertEqual(calls, ["putt", "chip"])
+        self.assertEqual([r for r, _ in results], ["answer to putt"] * 10 + ["answer to chip"])
+        self.assertEqual(sum(shared for _, shared in results), 9)
+        self.assertEqual(single_flight.in_flight(), 0)
+        # a finished execution is not shared with the following calls
+        await single_flight.do("putt", lambda: answer("putt"))
+        self.assertEqual(calls, ["putt", "chip", "putt"])
+
+    async def test_cancelled_caller_does_not_cancel_the_others(self):
+        single_flight = SingleFlight()
+
+        async def slow_answer():
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        first = asyncio.ensure_future(asyncio.wait_for(single_flight.do("putt", slow_answer), timeout=0.01))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(single_flight.do("putt", slow_answer))
+        with self.assertRaises(asyncio.TimeoutError):
+            await first
+        self.assertEqual(await second, ("answer", True))
+
+    async def test_error_is_shared(self):
+        single_flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("llm failed")
+
+        results = await asyncio.gather(single_flight.do("putt", failing), single_flight.do("putt", failing),
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
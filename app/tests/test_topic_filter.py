@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+from app.llama_index_server.numpy_vector_store import normalize
+from app.llama_index_server.topic_filter import TopicFilter, evaluate, calibrate
+
+
+class TopicFilterTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        topic = normalize(rng.standard_normal((1, 32)))
+        self.knowledge_base = normalize(topic + 0.1 * rng.standard_normal((40, 32)))
+        self.on_topic = normalize(self.knowledge_base[:20] + 0.05 * rng.standard_normal((20, 32)))
+        self.off_topic = normalize(rng.standard_normal((20, 32)))
+
+    def test_rejects_off_topic_questions(self):
+        topic_filter = TopicFilter(self.knowledge_base, threshold=0.8)
+        self.assertTrue(all(topic_filter.is_relevant(q) for q in self.on_topic))
+        self.assertFalse(any(topic_filter.is_relevant(q) for q in self.off_topic))
+        self.assertEqual(topic_filter.stats()["rejected"], 20)
+        self.assertAlmostEqual(topic_filter.score(self.knowledge_base[3]), 1.0, places=5)
+        # turned off
+        self.assertTrue(all(TopicFilter(self.knowledge_base, threshold=0).is_relevant(q) for q in self.off_topic))
+
+    def test_evaluate_and_calibrate(self):
+        topic_filter = TopicFilter(self.knowledge_base, threshold=0, k=3)
+        scores = topic_filter.scores(np.concatenate([self.on_topic, self.off_topic]))
+        relevant = np.array([True] * 20 + [False] * 20)
+        threshold = calibrate(scores, relevant, relevant_pass_rate=1.0)
+        self.assertEqual(threshold, scores[:20].min())
+        result, = evaluate(scores, relevant, [threshold])
+        self.assertEqual(result["relevant_pass_rate"], 1.0)
+        self.assertEqual(result["precision"], 1.0)
+        self.assertEqual(result["recall"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+from typing import Sequence
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from app.data.models.mongodb import CollectionModel
+from app.utils.log_util import logger
+from app.utils.mongo_dao import BaseMongoDao
+
+
+class AsyncMongoDao(BaseMongoDao):
+    """
+    Base Data Access Object for MongoDB, for the event loop. the same operations as MongoDao, with motor.
+    """
+
+    def __init__(
+            self,
+            mongo_uri,
+            db_name,
+            collection_name,
+            size_limit=0,
+            indexes: Sequence[IndexModel] = (),
+    ):
+        # the indexes are created by ensure_indexes, which has to be awaited at startup
+        super().__init__(AsyncIOMotorClient(mongo_uri), db_name, collection_name, size_limit, indexes)
+
+    async def ensure_indexes(self):
+        for index in self._indexes:
+            try:
+                await self._collection.create_indexes([index])
+            except OperationFailure as e:
+                command = self._index_conflict_command(index, e)
+                if command is not None:
+                    await self._db.command(command)
+
+    async def insert_one(self, doc: CollectionModel):
+        logger.info(f"Insert data")
+        await self._collection.insert_one(doc.model_dump())
+
+    async def upsert_one(self, query, doc: CollectionModel):
+        logger.info(f"Upsert one: query = {query}")
+        await self._collection.update_one(
+            query,
+            {"$set": doc.model_dump()},
+            upsert=True,
+        )
+
+    async def update_one(self, query, doc: CollectionModel):
+        logger.info(f"Update one: query = {query}")
+        await self._collection.update_one(
+            query,
+            {"$set": doc.model_dump()},
+            upsert=False,
+        )
+
+    async def bulk_upsert(self, docs, primary_keys):
+        result = await self._collection.bulk_write(self._bulk_upsert_operations(docs, primary_keys), ordered=False)
+        logger.info(f"Bulk upsert {len(docs)} docs, result = {result}")
+
+    async def find(self, query, projection=None, limit=0, sort=None, **kwargs):
+        """unlike MongoDao.find, the documents are read into a list"""
+        logger.info(
+            f"Find: query = {query}, projection = {projection}, limit = {limit}, sort = {sort}"
+        )
+        cursor = self._collection.find(
+            query, projection=projection, limit=limit, sort=sort, **kwargs
+        )
+        return await cursor.to_list(length=None)
+
+    async def find_one(self, query):
+        logger.info(f"Find one: query = {query}")
+        doc = await self._collection.find_one(query)
+        return doc
+
+    async def delete_one(self, query):
+        delete_result = await self._collection.delete_one(query)
+        logger.info(f"Delete one: query = {query}, delete_result = {delete_result}")
+        return delete_result.deleted_count
+
+    async def delete_many(self, query):
+        delete_result = await self._collection.delete_many(
+            query,
+        )
+        deleted_count = delete_result.deleted_count
+        logger.info(f"Delete many with query = {query}, deleted_count = {deleted_count}")
+        return deleted_count
+
+    def watch(self, pipeline=None, **kwargs):
+        """a change stream of the collection, to be used with `async with`. needs a replica set"""
+        return self._collection.watch(pipeline, **kwargs)
+
+    async def doc_size(self):
+        return await self._collection.count_documents({})
+
+    async def estimated_doc_size(self):
+        return await self._collection.estimated_document_count()
+
+    async def excess_doc_size(self):
+        return self._excess(await self.estimated_doc_size()) if self._size_limit > 0 else 0
+
+    async def cleanup_for_test(self):
+        pass
@@ -0,0 +1,62 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, Set
+from app.utils.log_util import logger
+
+# the event loop only keeps weak references to its tasks
+_background_tasks: Set[asyncio.Task] = set()
+
+
+async def iterate_in_executor(executor: Executor, generator: Iterator,
+                              timeout: Optional[float] = None) -> AsyncIterator:
+    """
+    consume a blocking generator in the executor, one item at a time, `timeout` is the max wait for one item.
+    the generator is closed if the consumer stops early
+    """
+    end = object()
+    future = None
+    try:
+        while True:
+            future = executor.submit(next, generator, end)
+            item = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+            if item is end:
+                return
+            yield item
+    finally:
+        if future is not None:
+            # a generator cannot be closed while `next` runs in another thread, so it is closed once that returns
+            future.add_done_callback(lambda _: generator.close())
+
+
+async def call_in_executor(executor: Executor, fn: Callable[[], Any], timeout: Optional[float] = None,
+                           release: Optional[Callable[[Any], Any]] = None) -> Any:
+    """
+    the result of a blocking call run in the executor, waiting at most `timeout` seconds. a call which cannot be
+    stopped may still return after the caller stopped waiting(timed out or cancelled), `release` then frees its result,
+    e.g. closes a stream it opened
+    """
+    future = executor.submit(fn)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        if release is not None:
+            def done(f: Future):
+                if not f.cancelled() and f.exception() is None:
+                    release(f.result())
+
+            future.add_done_callback(done)
+        raise
+
+
+def run_in_background(awaitable: Awaitable, name: Optional[str] = None) -> asyncio.Task:
+    """run a coroutine without waiting for it, e.g. a write the response does not depend on. a failure is logged"""
+    task = asyncio.ensure_future(awaitable)
+    _background_tasks.add(task)
+
+    def done(t: asyncio.Task):
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.error(f"Background task {name or t.get_name()} failed: {t.exception()!r}")
+
+    task.add_done_callback(done)
+    return task
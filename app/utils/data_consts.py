@@ -3,5 +3,61 @@ import os
 EXPECTED_USERNAME = os.environ.get("AI_BOT_ADMIN_USERNAME", "your-username")
 EXPECTED_PASSWORD = os.environ.get("AI_BOT_ADMIN_PASSWORD", "your-password")
 MONGO_URI = os.environ.get("AI_BOT_MONGO_URI", "mongodb://localhost:27017")
-DOCUMENT_META_LIMIT = os.environ.get("AI_BOT_DOCUMENT_META_LIMIT", 10000)
+# once there are more document metas than this, a background job evicts the user questions ranked first by
+# AI_BOT_EVICTION_POLICY("age", "lru" or "lfu"), at most AI_BOT_EVICTION_BATCH_SIZE every AI_BOT_EVICTION_INTERVAL
+# seconds. the questions inserted in the last AI_BOT_EVICTION_MIN_AGE_DAYS days are kept. 0 keeps all of them
+DOCUMENT_META_LIMIT = int(os.environ.get("AI_BOT_DOCUMENT_META_LIMIT", 10000))
+EVICTION_POLICY = os.environ.get("AI_BOT_EVICTION_POLICY", "lru")
+EVICTION_BATCH_SIZE = int(os.environ.get("AI_BOT_EVICTION_BATCH_SIZE", 100))
+EVICTION_INTERVAL = int(os.environ.get("AI_BOT_EVICTION_INTERVAL", 60))
+EVICTION_MIN_AGE_DAYS = float(os.environ.get("AI_BOT_EVICTION_MIN_AGE_DAYS", 1))
+# chat messages are removed by mongodb this many days after they were sent, 0 keeps them forever
+CHAT_MESSAGE_TTL_DAYS = float(os.environ.get("AI_BOT_CHAT_MESSAGE_TTL_DAYS", 0))
 API_TIMEOUT = 10
+# "exact" scans every stored question embedding, "ivf" only scans the closest clusters of an inverted file
+VECTOR_SEARCH_MODE = os.environ.get("AI_BOT_VECTOR_SEARCH_MODE", "exact")
+VECTOR_SEARCH_N_PROBE = int(os.environ.get("AI_BOT_VECTOR_SEARCH_N_PROBE", 16))
+# "float32", or "int8"(1/4 of the memory)/"float16"(1/2 of the memory, but scanned several times slower) to keep only
+# quantized embeddings in memory. the best candidates are re-scored in float32, so the matches do not change
+VECTOR_QUANTIZATION = os.environ.get("AI_BOT_VECTOR_QUANTIZATION", "float32")
+# fsync the index write-ahead log on every mutation, turn off to trade the last writes before a power loss for latency
+INDEX_WAL_FSYNC = os.environ.get("AI_BOT_INDEX_WAL_FSYNC", "true").lower() == "true"
+# number of logged mutations after which a background snapshot is written before the next scheduled one
+INDEX_WAL_COMPACTION_THRESHOLD = int(os.environ.get("AI_BOT_INDEX_WAL_COMPACTION_THRESHOLD", 1000))
+# seconds between two background snapshots of the index, a snapshot is only written if the index changed
+INDEX_PERSIST_INTERVAL = int(os.environ.get("AI_BOT_INDEX_PERSIST_INTERVAL", 600))
+# number of query/text embeddings kept in memory, and whether they are also kept in a sqlite file across restarts
+EMBEDDING_CACHE_SIZE = int(os.environ.get("AI_BOT_EMBEDDING_CACHE_SIZE", 10000))
+EMBEDDING_CACHE_ON_DISK = os.environ.get("AI_BOT_EMBEDDING_CACHE_ON_DISK", "true").lower() == "true"
+# the query embeddings requested within this many milliseconds of each other are sent in one request of at most
+# EMBEDDING_MAX_BATCH_SIZE texts
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get("AI_BOT_EMBEDDING_BATCH_WINDOW_MS", 5))
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("AI_BOT_EMBEDDING_MAX_BATCH_SIZE", 64))
+# number of serialized /qa/query responses cached by normalized question, each for at most
+# AI_BOT_RESPONSE_CACHE_TTL_SECONDS. 0 turns the cache off
+RESPONSE_CACHE_SIZE = int(os.environ.get("AI_BOT_RESPONSE_CACHE_SIZE", 10000))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("AI_BOT_RESPONSE_CACHE_TTL_SECONDS", 60))
+# number of csv rows embedded per request while bootstrapping the index, and number of requests in flight
+BOOTSTRAP_BATCH_SIZE = int(os.environ.get("AI_BOT_BOOTSTRAP_BATCH_SIZE", 100))
+BOOTSTRAP_CONCURRENCY = int(os.environ.get("AI_BOT_BOOTSTRAP_CONCURRENCY", 4))
+# a question whose mean similarity to its AI_BOT_TOPIC_RELEVANCE_K nearest knowledge base questions is below this is
+# answered as off-topic without asking the llm. 0(default) turns it off, calibrate it with
+# app/benchmarks/topic_filter_eval.py before turning it on
+TOPIC_RELEVANCE_THRESHOLD = float(os.environ.get("AI_BOT_TOPIC_RELEVANCE_THRESHOLD", 0))
+TOPIC_RELEVANCE_K = int(os.environ.get("AI_BOT_TOPIC_RELEVANCE_K", 1))
+# threads for the blocking work left outside the event loop: index writes, snapshots and the sync llama index calls
+EXECUTOR_MAX_WORKERS = int(os.environ.get("AI_BOT_EXECUTOR_MAX_WORKERS", 100))
+# several server processes on the host(e.g. uvicorn --workers) share one index: its snapshot is memory-mapped by all
+# of them, and each applies the changes the others logged every AI_BOT_INDEX_SYNC_INTERVAL_MS milliseconds
+INDEX_SHARED = os.environ.get("AI_BOT_INDEX_SHARED", "false").lower() == "true"
+INDEX_SYNC_INTERVAL_MS = int(os.environ.get("AI_BOT_INDEX_SYNC_INTERVAL_MS", 500))
+# the query hits of the documents are counted in memory and written to mongodb every AI_BOT_QUERY_HIT_FLUSH_INTERVAL_MS
+# milliseconds, or as soon as AI_BOT_QUERY_HIT_BUFFER_SIZE documents have pending hits
+QUERY_HIT_FLUSH_INTERVAL_MS = int(os.environ.get("AI_BOT_QUERY_HIT_FLUSH_INTERVAL_MS", 1000))
+QUERY_HIT_BUFFER_SIZE = int(os.environ.get("AI_BOT_QUERY_HIT_BUFFER_SIZE", 10000))
+# number of document metas cached in memory, each for at most AI_BOT_DOC_META_CACHE_TTL_SECONDS. 0 turns the cache off.
+# with AI_BOT_DOC_META_CHANGE_STREAM=true(needs a replica set) the documents changed outside the server are
+# invalidated as soon as mongodb reports them
+DOC_META_CACHE_SIZE = int(os.environ.get("AI_BOT_DOC_META_CACHE_SIZE", 10000))
+DOC_META_CACHE_TTL_SECONDS = float(os.environ.get("AI_BOT_DOC_META_CACHE_TTL_SECONDS", 60))
+DOC_META_CHANGE_STREAM = os.environ.get("AI_BOT_DOC_META_CHANGE_STREAM", "false").lower() == "true"
@@ -14,6 +14,11 @@ def get_current_milliseconds():
     return int(time.time() * 1000)
 
 
+def milliseconds_to_day(milliseconds):
+    """days since the epoch, in utc"""
+    return milliseconds // MILLISECONDS_PER_DAY
+
+
 def milliseconds_to_human_readable(milliseconds):
     return time.strftime(TIME_FORMAT, time.localtime(milliseconds / 1000))
 
@@ -0,0 +1,45 @@
+import fcntl
+import os
+from threading import RLock
+
+
+class FileLock:
+    """
+    lock held by one thread of one process on the host at a time: a thread lock around an flock on `path`.
+    it is reentrant, the flock is released when the outermost acquire is released, or when the process dies
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._path = path
+        self._lock = RLock()
+        self._depth = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self, blocking=True) -> bool:
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        if self._depth == 0:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def close(self):
+        os.close(self._fd)
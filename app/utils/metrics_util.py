@@ -0,0 +1,38 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Any, Dict, Sequence
+
+# upper bounds of the buckets, an observation larger than the last one goes to the "+Inf" bucket
+MILLISECONDS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+SECONDS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 600)
+
+
+class Histogram:
+    """a thread safe histogram with fixed buckets, cheap enough to be observed on every request"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets = tuple(buckets)
+        self._lock = Lock()
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect_left(self._buckets, value)] += 1
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = {str(bound): count for bound, count in zip(self._buckets, self._counts)}
+            buckets["+Inf"] = self._counts[-1]
+            return {
+                "count": self._count,
+                "mean": self._sum / self._count if self._count > 0 else 0.0,
+                "max": self._max,
+                "buckets": buckets,
+            }
@@ -1,11 +1,82 @@
-from pymongo import MongoClient
-from pymongo.collection import Collection
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from pymongo import MongoClient, IndexModel
+from pymongo.errors import OperationFailure
 from pymongo.operations import ReplaceOne
 from app.data.models.mongodb import CollectionModel
 from app.utils.log_util import logger
 
+# an index of the same name exists with other options
+INDEX_OPTIONS_CONFLICT = 85
 
-class MongoDao:
+
+def ttl_update_command(collection_name: str, index: IndexModel) -> Dict[str, Any]:
+    """the collMod command changing the expiry of an existing ttl index to that of `index`"""
+    return {
+        "collMod": collection_name,
+        "index": {"name": index.document["name"], "expireAfterSeconds": index.document["expireAfterSeconds"]},
+    }
+
+
+def find_winning_plans(explained: Any) -> Iterator[dict]:
+    """the winning plans in the output of an explained command, an aggregation may have one per stage"""
+    if isinstance(explained, dict):
+        if "winningPlan" in explained:
+            yield explained["winningPlan"]
+        for key, value in explained.items():
+            if key != "winningPlan":
+                yield from find_winning_plans(value)
+    elif isinstance(explained, list):
+        for value in explained:
+            yield from find_winning_plans(value)
+
+
+def find_collection_scans(plan: Any) -> bool:
+    """whether a query plan, as returned by explain(), scans a whole collection at any of its stages"""
+    if isinstance(plan, dict):
+        return plan.get("stage") == "COLLSCAN" or any(find_collection_scans(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(find_collection_scans(value) for value in plan)
+    return False
+
+
+class BaseMongoDao:
+    """
+    the state and the logic shared by MongoDao and AsyncMongoDao, which only differ in running the operations with
+    pymongo or motor.
+    """
+
+    def __init__(self, client, db_name, collection_name, size_limit=0, indexes: Sequence[IndexModel] = ()):
+        self._client = client
+        self._db = self._client[db_name]
+        self._collection = self._db[collection_name]
+        self._size_limit = max(size_limit, 0)
+        self._indexes = list(indexes)
+
+    def _index_conflict_command(self, index: IndexModel, e: OperationFailure) -> Optional[Dict[str, Any]]:
+        """
+        the command resolving a failed creation of `index`: the expiry of an existing ttl index is updated, any other
+        difference to an existing index is only logged, the index has to be dropped to change it
+        """
+        if e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in index.document:
+            return ttl_update_command(self._collection.name, index)
+        logger.error(f"Failed to create index {index.document['name']} of {self._collection.name}: {e}")
+        return None
+
+    def _excess(self, doc_size: int) -> int:
+        if self._size_limit <= 0:
+            return 0
+        return max(0, doc_size - self._size_limit)
+
+    @staticmethod
+    def _bulk_upsert_operations(docs, primary_keys) -> List[ReplaceOne]:
+        return [ReplaceOne(
+            filter={primary_key: doc[primary_key] for primary_key in primary_keys},
+            replacement=doc,
+            upsert=True
+        ) for doc in docs]
+
+
+class MongoDao(BaseMongoDao):
     """
     Base Data Access Object for MongoDB.
     """
@@ -16,30 +87,46 @@ class MongoDao:
             db_name,
             collection_name,
             size_limit=0,
+            indexes: Sequence[IndexModel] = (),
     ):
-        self._client = MongoClient(mongo_uri)
-        self._db = self._client[db_name]
-        self._collection: Collection = self._db[collection_name]
-        if size_limit > 0:
-            self._size_limit = size_limit
-        else:
-            self._size_limit = 0
+        super().__init__(MongoClient(mongo_uri), db_name, collection_name, size_limit, indexes)
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        """create the indexes of the collection which do not exist, idempotent"""
+        for index in self._indexes:
+            try:
+                self._collection.create_indexes([index])
+            except OperationFailure as e:
+                command = self._index_conflict_command(index, e)
+                if command is not None:
+                    self._db.command(command)
+
+    def explain(self, query, sort=None, limit=0):
+        """the plan mongodb chooses for a find, see find_collection_scans"""
+        return self._collection.find(query, sort=sort, limit=limit).explain()["queryPlanner"]["winningPlan"]
+
+    def explain_aggregate(self, pipeline):
+        """the plans mongodb chooses for the reads of an aggregation"""
+        explained = self._db.command("aggregate", self._collection.name, pipeline=pipeline, explain=True)
+        return list(find_winning_plans(explained))
 
     def insert_one(self, doc: CollectionModel):
         logger.info(f"Insert data")
         self._collection.insert_one(doc.model_dump())
 
-    def upsert_one(self, query, doc: CollectionModel, need_prune=False):
+    def upsert_one(self, query, doc: CollectionModel):
         logger.info(f"Upsert one: query = {query}")
         self._collection.update_one(
             query,
             {"$set": doc.model_dump()},
             upsert=True,
         )
-        pruned_ids = []
-        if need_prune and 0 < self._size_limit < self.doc_size():
-            pruned_ids = self.prune()
-        return pruned_ids
+
+    def insert_if_absent(self, query, doc: CollectionModel) -> bool:
+        """insert `doc` unless a document matches `query`, which is left as it is. returns whether it was inserted"""
+        result = self._collection.update_one(query, {"$setOnInsert": doc.model_dump()}, upsert=True)
+        return result.upserted_id is not None
 
     def update_one(self, query, doc: CollectionModel):
         logger.info(f"Update one: query = {query}")
@@ -50,12 +137,7 @@ class MongoDao:
         )
 
     def bulk_upsert(self, docs, primary_keys):
-        operations = [ReplaceOne(
-            filter={primary_key: doc[primary_key] for primary_key in primary_keys},
-            replacement=doc,
-            upsert=True
-        ) for doc in docs]
-        result = self._collection.bulk_write(operations, ordered=False)
+        result = self._collection.bulk_write(self._bulk_upsert_operations(docs, primary_keys), ordered=False)
         logger.info(f"Bulk upsert {len(docs)} docs, result = {result}")
 
     def find(self, query, projection=None, limit=0, sort=None, **kwargs):
@@ -87,8 +169,13 @@ class MongoDao:
     def doc_size(self):
         return self._collection.count_documents({})
 
-    def prune(self):
-        return []
+    def estimated_doc_size(self):
+        """the number of documents from the collection metadata, without counting them"""
+        return self._collection.estimated_document_count()
+
+    def excess_doc_size(self):
+        """how many documents there are beyond the size limit, by the estimated size"""
+        return self._excess(self.estimated_doc_size()) if self._size_limit > 0 else 0
 
     def cleanup_for_test(self):
         pass
@@ -0,0 +1,17 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from app.utils.log_util import logger
+
+# the background jobs of the server, they run in the scheduler's own threads, never in a request
+scheduler = BackgroundScheduler(daemon=True)
+
+
+def start():
+    if not scheduler.running:
+        logger.info(f"Starting scheduler with jobs: {[job.id for job in scheduler.get_jobs()]}")
+        scheduler.start()
+
+
+def shutdown():
+    if scheduler.running:
+        logger.info("Shutting down scheduler, waiting for the running jobs")
+        scheduler.shutdown(wait=True)
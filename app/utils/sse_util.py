@@ -0,0 +1,14 @@
+import asyncio
+import json
+from app.data.messages.status_code import StatusCode
+
+
+def to_server_sent_event(event: str, data: str) -> str:
+    """one server-sent event, `data` must not contain line breaks, e.g. compact json"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def to_error_event(e: Exception) -> str:
+    """the response status is already sent when a stream fails, the error is its last event instead"""
+    status_code = StatusCode.ERROR_TIMEOUT if isinstance(e, asyncio.TimeoutError) else StatusCode.ERROR_OPENAI
+    return to_server_sent_event("error", json.dumps({"status_code": status_code, "msg": str(e)}))